@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+"""
+FK/IK Matching Tool - Benchmark Suite
+Measure matching, calibration and baking on synthetic rigs without Maya
+
+Usage:
+    python benchmarks/bench_fkik.py
+    python benchmarks/bench_fkik.py --limbs 1 10 100 --frames 48 --json results.json
+    python benchmarks/bench_fkik.py --limbs 1000 --only match_all_ik_to_fk --verify
+
+Runs universal_fkik_match against the fake_maya stand-in and reports, per
+benchmark and rig size: wall time, cmds/API call counts and peak Python
+allocations (tracemalloc). The numbers are for catching regressions in the
+tool's own overhead; they do not predict DG evaluation cost in a real scene.
+
+Made by niexiongtao
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import fake_maya  # noqa: E402
+
+fake_maya.install()
+
+import universal_fkik_match as fkik  # noqa: E402
+import fkik_service  # noqa: E402
+
+BENCHMARKS = (
+    'calibrate_all_limbs',
+    'match_limb_ik_to_fk',
+    'match_limb_fk_to_ik',
+    'match_all_ik_to_fk',
+    'match_all_fk_to_ik',
+    'service_match_ik_to_fk',
+    'bake_ik_to_fk',
+    'bake_fk_to_ik',
+    'rebake_ik_to_fk',
+    'verify_ik_to_fk',
+)
+
+BONE_LENGTH = 5.0
+# service_match_ik_to_fk 的并发客户端数
+SERVICE_CLIENTS = 8
+
+
+# ============================================================================
+# 合成绑定 / Synthetic Rig
+# ============================================================================
+
+def build_rig(limb_count, frames, characters=0):
+    """
+    新建伪场景并创建 limb_count 个三节肢体
+
+    每个肢体: Blend骨骼链（带动画）、FK控制器链（父级有旋转）、IK控制器和极向量。
+    characters 大于 0 时在 char0..charN 命名空间中各创建一份（模拟引用的角色）
+
+    Returns:
+        list: LimbData 列表
+    """
+    scene = fake_maya.new_scene()
+    scene.playback = (1.0, float(frames))
+    limbs = []
+    prefixes = [f'char{c}:' for c in range(characters)] if characters else ['']
+    for c, prefix in enumerate(prefixes):
+        limbs.extend(_build_limbs(scene, limb_count, frames, prefix, c * 50.0))
+    return limbs
+
+
+def _build_limbs(scene, limb_count, frames, prefix, depth):
+    limbs = []
+    for i in range(limb_count):
+        root = f'{prefix}rig{i}'
+        scene.create_node(root, translate=(i * 20.0, 0.0, depth))
+
+        # Blend骨骼（参考来源），每节按不同相位做动画
+        blend = [f'{root}_blend{j}' for j in range(3)]
+        parent = root
+        for j, name in enumerate(blend):
+            scene.create_node(name, 'joint', parent, translate=(0.0, 10.0, 0.0) if j == 0 else (BONE_LENGTH, 0, 0))
+            parent = name
+        for frame in (1, max(2, frames // 2), max(3, frames)):
+            phase = frame * 0.1 + i * 0.37
+            scene.set_key(blend[0], 'rotateX', frame, 0.4 * math.sin(phase))
+            scene.set_key(blend[0], 'rotateY', frame, 0.3 * math.cos(phase))
+            scene.set_key(blend[0], 'rotateZ', frame, 0.2 + 0.5 * math.sin(phase * 0.5))
+            scene.set_key(blend[1], 'rotateZ', frame, 0.3 + 0.6 * abs(math.sin(phase)))
+            scene.set_key(blend[2], 'rotateX', frame, 0.5 * math.cos(phase))
+            scene.set_key(blend[2], 'rotateY', frame, 0.25 * math.sin(phase))
+
+        # FK控制器：父级组有旋转，中间控制器使用非默认旋转顺序
+        fk_group = scene.create_node(f'{root}_fkGrp', parent=root, translate=(0.0, 10.0, 0.0), rotate=(0, 15, 30))
+        fk = [f'{root}_fk{j}' for j in range(3)]
+        parent = fk_group
+        for j, name in enumerate(fk):
+            scene.create_node(name, parent=parent, translate=(0, 0, 0) if j == 0 else (BONE_LENGTH, 0, 0),
+                              rotate_order=1 if j == 1 else 0)
+            parent = name
+
+        # IK控制器和极向量
+        ik_group = scene.create_node(f'{root}_ikGrp', parent=root, translate=(0.0, 0.0, 5.0))
+        ik = scene.create_node(f'{root}_ik', parent=ik_group, translate=(10.0, 10.0, -5.0),
+                               rotate=(10, 20, 30), rotate_order=2)
+        pv = scene.create_node(f'{root}_pv', parent=ik_group, translate=(5.0, 10.0, 5.0))
+
+        limb = fkik.LimbData(f'{prefix}limb{i}')
+        limb.blend_joints = blend
+        limb.fk_controls = fk
+        limb.ik_control = ik.name
+        limb.pole_vector = pv.name
+        limbs.append(limb)
+    return limbs
+
+
+# ============================================================================
+# 结果校验 / Verification
+# ============================================================================
+
+def _world(name):
+    return fkik.get_world_mmatrix(name)
+
+
+def _rotation_error(a, b):
+    """两个世界矩阵旋转部分之间的夹角（度）"""
+    qa = fake_maya.MTransformationMatrix(a).rotation(asQuaternion=True)
+    qb = fake_maya.MTransformationMatrix(b).rotation(asQuaternion=True)
+    dot = abs(qa.x * qb.x + qa.y * qb.y + qa.z * qb.z + qa.w * qb.w)
+    return math.degrees(2.0 * math.acos(min(1.0, dot)))
+
+
+def _position_error(a, b):
+    return math.sqrt(sum((a.getElement(3, i) - b.getElement(3, i)) ** 2 for i in range(3)))
+
+
+def verify(limbs, direction, offsets):
+    """
+    匹配后的残差：FK对齐Blend骨骼，IK末端位置和（带偏移的）旋转对齐Blend末端
+
+    Returns:
+        dict: {'position': 最大位置误差, 'rotation': 最大旋转误差（度）}
+    """
+    position = rotation = 0.0
+    for limb in limbs:
+        if direction == fkik.BAKE_FK_TO_IK:
+            for i, (ctrl, joint) in enumerate(zip(limb.fk_controls, limb.blend_joints)):
+                ctrl_m, joint_m = _world(ctrl), _world(joint)
+                rotation = max(rotation, _rotation_error(ctrl_m, joint_m))
+                if i == 0:
+                    position = max(position, _position_error(ctrl_m, joint_m))
+        else:
+            ik_m, end_m = _world(limb.ik_control), _world(limb.blend_joints[-1])
+            position = max(position, _position_error(ik_m, end_m))
+            offset = offsets.get(limb.name)
+            if offset:
+                expected = fake_maya.MQuaternion(*offset) * \
+                    fake_maya.MTransformationMatrix(end_m).rotation(asQuaternion=True)
+                rotation = max(rotation, _rotation_error(ik_m, expected.asMatrix()))
+    return {'position': position, 'rotation': rotation}
+
+
+def verify_bake(limbs, direction, offsets, frames):
+    """在若干帧（通过 DG 上下文）校验烘焙结果"""
+    worst = {'position': 0.0, 'rotation': 0.0}
+    for frame in sorted({frames[0], frames[len(frames) // 2], frames[-1]}):
+        with fkik.dg_time_context(frame):
+            errors = verify(limbs, direction, offsets)
+        for key, value in errors.items():
+            worst[key] = max(worst[key], value)
+    return worst
+
+
+def verify_gimbal(frames=24):
+    """
+    穿过万向节的烘焙：Blend根骨骼 rotateY 从 80° 扫到 100°（xyz），FK控制器的旋转曲线不能翻转
+
+    分别用 NumPy 和 om2 逐帧路径烘焙 FK→IK，比较两条路径的曲线
+
+    Returns:
+        dict: {'step': 曲线相邻帧的最大跳变（度）, 'paths': 两条路径的最大差值（度）}
+    """
+    curves = []
+    for use_kernel in (True, False):
+        fake_maya.new_scene()
+        scene = fake_maya.SCENE
+        scene.playback = (1.0, float(frames))
+        scene.create_node('gimbal')
+        blend = ['gimbal_blend0', 'gimbal_blend1', 'gimbal_blend2']
+        fk = ['gimbal_fk0', 'gimbal_fk1', 'gimbal_fk2']
+        for chain in (blend, fk):
+            parent = 'gimbal'
+            for j, name in enumerate(chain):
+                scene.create_node(name, 'joint' if chain is blend else 'transform', parent,
+                                  translate=(BONE_LENGTH, 0, 0) if j else (0, 0, 0))
+                parent = name
+        scene.set_key(blend[0], 'rotateY', 1, math.radians(80.0))
+        scene.set_key(blend[0], 'rotateY', frames, math.radians(100.0))
+
+        limb = fkik.LimbData('gimbal')
+        limb.blend_joints = blend
+        limb.fk_controls = fk
+        kernel = fkik._kernel
+        if not use_kernel:
+            fkik._kernel = False
+        try:
+            fkik.FKIKMatcher([limb]).bake(1, frames, fkik.BAKE_FK_TO_IK)
+        finally:
+            fkik._kernel = kernel
+
+        values = []
+        for frame in range(1, frames + 1):
+            with fkik.dg_time_context(frame):
+                values.append([math.degrees(fkik.get_plug(fk[0], attr).asDouble()) for attr in fkik.ROTATE_ATTRS])
+        curves.append(values)
+
+    step = max(abs(b - a) for curve in curves for prev, cur in zip(curve, curve[1:]) for a, b in zip(prev, cur))
+    paths = max(abs(a - b) for row_a, row_b in zip(*curves) for a, b in zip(row_a, row_b))
+    return {'step': step, 'paths': paths}
+
+
+# ============================================================================
+# 运行 / Runner
+# ============================================================================
+
+def make_runner(name, engine, limbs, frames):
+    """返回执行单个基准的无参函数"""
+    if name == 'calibrate_all_limbs':
+        return lambda: engine.calibrate()
+    if name == 'match_limb_ik_to_fk':
+        return lambda: [engine.match_limb_ik_to_fk(limb) for limb in limbs]
+    if name == 'match_limb_fk_to_ik':
+        return lambda: [engine.match_limb_fk_to_ik(limb) for limb in limbs]
+    if name == 'match_all_ik_to_fk':
+        return lambda: engine.match_all(fkik.BAKE_IK_TO_FK)
+    if name == 'match_all_fk_to_ik':
+        return lambda: engine.match_all(fkik.BAKE_FK_TO_IK)
+    if name == 'service_match_ik_to_fk':
+        return lambda: run_service_clients(engine, limbs, fkik.BAKE_IK_TO_FK)
+    if name == 'bake_ik_to_fk':
+        return lambda: engine.bake(1, frames, fkik.BAKE_IK_TO_FK)
+    if name == 'bake_fk_to_ik':
+        return lambda: engine.bake(1, frames, fkik.BAKE_FK_TO_IK)
+    if name == 'rebake_ik_to_fk':
+        # 增量烘焙：来源动画没有改变，只检查指纹
+        return lambda: engine.bake(1, frames, fkik.BAKE_IK_TO_FK, incremental=True)
+    if name == 'verify_ik_to_fk':
+        # 烘焙后的残差校验（整段帧范围）
+        return lambda: engine.verify(fkik.BAKE_IK_TO_FK, 1, frames)
+    raise ValueError(f'unknown benchmark: {name}')
+
+
+def run_service_clients(engine, limbs, direction, clients=SERVICE_CLIENTS):
+    """
+    通过 fkik_service 匹配：clients 个客户端线程同时请求各自的一部分肢体，
+    合并窗口内到达的请求合并为一批，在本线程（主线程）中执行
+
+    Returns:
+        list: 每个请求的最终回复
+    """
+    service = fkik_service.MatchService(engine, port=0)
+    service.start()
+    names = [limb.name for limb in limbs]
+    replies = []
+
+    def client(part):
+        request = {'op': 'match', 'direction': direction, 'limbs': part}
+        replies.extend(reply for reply in fkik_service.send_requests([request], port=service.port)
+                       if reply['status'] in fkik_service.FINAL_STATUSES)
+
+    threads = [threading.Thread(target=client, args=(names[i::clients],)) for i in range(min(clients, len(names)))]
+    for thread in threads:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in threads):
+            service.process(0.01)
+    finally:
+        for thread in threads:
+            thread.join()
+        service.stop()
+    failed = [reply for reply in replies if reply['status'] != 'ok']
+    if failed:
+        raise RuntimeError(f'service request failed: {failed[0].get("error")}')
+    return replies
+
+
+def measure(runner, repeat, allocations):
+    """
+    计时（取最小值），最后一次运行的调用次数，另跑一次 tracemalloc 统计分配
+
+    Returns:
+        dict: wall_ms、cmds_calls、api_calls、evaluations、calls，以及 peak_kb、allocated_blocks
+    """
+    best = None
+    for _ in range(max(1, repeat)):
+        fake_maya.reset_counters()
+        time_start = time.perf_counter()
+        runner()
+        elapsed = time.perf_counter() - time_start
+        best = elapsed if best is None else min(best, elapsed)
+
+    calls = dict(fake_maya.CALLS)
+    result = {
+        'wall_ms': best * 1000.0,
+        'cmds_calls': sum(v for k, v in calls.items() if k.startswith('cmds.')),
+        'api_calls': sum(v for k, v in calls.items() if k.startswith('api.')),
+        'evaluations': calls.get('eval.worldMatrix', 0),
+        'calls': calls,
+    }
+
+    if allocations:
+        tracemalloc.start()
+        snapshot_start = tracemalloc.take_snapshot()
+        runner()
+        snapshot_end = tracemalloc.take_snapshot()
+        result['peak_kb'] = tracemalloc.get_traced_memory()[1] / 1024.0
+        tracemalloc.stop()
+        stats = snapshot_end.compare_to(snapshot_start, 'filename')
+        result['allocated_blocks'] = sum(max(0, stat.count_diff) for stat in stats)
+    return result
+
+
+def run(args):
+    results = []
+    names = args.only or BENCHMARKS
+    if args.no_kernel:
+        fkik._kernel = False
+    # 磁盘矩阵缓存只在指定目录时启用（伪场景默认是未保存的场景，不会缓存）
+    fkik.set_matrix_cache(args.matrix_cache)
+    if args.workers:
+        fkik.set_solve_workers(args.workers)
+
+    print(f'kernel: {"fkik_kernel (NumPy)" if fkik.get_kernel() else "om2 per frame"}, solve workers: {fkik.SOLVE_WORKERS}')
+    header = f'{"benchmark":<22}{"limbs":>7}{"wall ms":>11}{"us/limb":>10}{"cmds":>8}{"api":>9}{"peak KB":>10}'
+    if args.verify:
+        header += f'{"pos err":>10}{"rot err":>10}'
+    print(header)
+    print('-' * len(header))
+
+    for limb_count in args.limbs:
+        limbs = build_rig(limb_count, args.frames, args.characters)
+        if args.matrix_cache:
+            fake_maya.SCENE.scene_name = f'bench_{limb_count}x{args.characters}_{args.frames}.ma'
+        engine = fkik.FKIKMatcher(limbs)
+        if args.characters:
+            # 第一个角色的肢体作为模板，应用到所有命名空间
+            time_start = time.perf_counter()
+            instances = engine.instantiate(limbs[:limb_count])
+            elapsed = time.perf_counter() - time_start
+            limbs = engine.get_limbs()
+            print(f'instantiate: {len(instances)} namespaces, {len(limbs)} limbs in {elapsed * 1000.0:.2f} ms')
+        for name in names:
+            if name == 'calibrate_all_limbs' or not any(limb.rotation_offset for limb in limbs):
+                # 匹配前需要校准数据；未单独测量时先静默校准一次
+                engine.calibrate()
+            result = measure(make_runner(name, engine, limbs, args.frames), args.repeat, not args.no_alloc)
+            result.update({'benchmark': name, 'limbs': len(limbs), 'frames': args.frames})
+
+            line = (f'{name:<22}{len(limbs):>7}{result["wall_ms"]:>11.2f}'
+                    f'{result["wall_ms"] * 1000.0 / len(limbs):>10.1f}'
+                    f'{result["cmds_calls"]:>8}{result["api_calls"]:>9}'
+                    + (f'{result["peak_kb"]:>10.1f}' if 'peak_kb' in result else f'{"-":>10}'))
+            if args.verify and name != 'calibrate_all_limbs':
+                offsets = {limb.name: limb.rotation_offset for limb in limbs}
+                direction = fkik.BAKE_IK_TO_FK if 'ik_to_fk' in name else fkik.BAKE_FK_TO_IK
+                if 'bake' in name or 'verify' in name:
+                    errors = verify_bake(limbs, direction, offsets, list(range(1, args.frames + 1)))
+                else:
+                    errors = verify(limbs, direction, offsets)
+                result['errors'] = errors
+                line += f'{errors["position"]:>10.1e}{errors["rotation"]:>10.1e}'
+            print(line)
+
+            if args.profile:
+                runner = make_runner(name, engine, limbs, args.frames)
+                with fkik.profiling() as profiler:
+                    runner()
+                report = profiler.report()
+                result['profile'] = {stage: {'time': t, 'calls': c} for stage, (t, c) in report.totals().items()}
+                print('    ' + report.format(limit=args.profile).replace('\n', '\n    '))
+
+            if args.top_calls:
+                top = sorted(result['calls'].items(), key=lambda item: -item[1])[:args.top_calls]
+                print('    ' + ', '.join(f'{k}={v}' for k, v in top))
+            results.append(result)
+
+    if args.verify:
+        gimbal = verify_gimbal(args.frames)
+        print(f'gimbal crossing (fk_to_ik): max key step {gimbal["step"]:.2f} deg, '
+              f'NumPy vs om2 {gimbal["paths"]:.1e} deg')
+        results.append({'benchmark': 'verify_gimbal', 'errors': gimbal})
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f'results written to {args.json}')
+    return results
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Benchmark universal_fkik_match on synthetic rigs (no Maya needed).')
+    parser.add_argument('--limbs', type=int, nargs='+', default=[1, 10, 100, 1000], help='rig sizes to run')
+    parser.add_argument('--characters', type=int, default=0,
+                        help='build N namespaced copies of each rig and instance the limbs from a template')
+    parser.add_argument('--frames', type=int, default=24, help='frame range length for the bake benchmarks')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, help='run only these benchmarks')
+    parser.add_argument('--repeat', type=int, default=3, help='timing runs per benchmark (best is reported)')
+    parser.add_argument('--no-alloc', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--no-kernel', action='store_true', help='force the om2 per-frame bake path')
+    parser.add_argument('--verify', action='store_true', help='report max position/rotation residuals')
+    parser.add_argument('--matrix-cache', metavar='DIR', help='enable the on-disk Blend matrix cache in DIR')
+    parser.add_argument('--workers', type=int, metavar='N', help='compute-stage worker threads (default: FKIK_SOLVE_WORKERS)')
+    parser.add_argument('--top-calls', type=int, default=0, metavar='N', help='print the N most frequent calls')
+    parser.add_argument('--profile', type=int, default=0, metavar='N',
+                        help='run once more under enable_profiling() and print the N slowest limbs')
+    parser.add_argument('--json', help='write all results to this JSON file')
+    return parser
+
+
+def main(argv=None):
+    run(build_parser().parse_args(argv))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
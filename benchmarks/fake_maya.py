@@ -0,0 +1,1866 @@
+# -*- coding: utf-8 -*-
+"""
+FK/IK Matching Tool - Fake Maya Stand-in
+A lightweight in-process stand-in for maya.cmds and maya.api.OpenMaya
+
+Only the subset used by universal_fkik_match is implemented: a transform
+hierarchy with world matrices, rotate orders, linear animation curves,
+time-context evaluation, setAttr/xform/setKeyframe and MFnAnimCurve. Every
+cmds call and the main API entry points are counted in CALLS so benchmarks
+can report how much scene traffic a match generates.
+
+Usage:
+    import fake_maya
+    scene = fake_maya.install()      # registers maya.* in sys.modules
+    import universal_fkik_match
+
+Made by niexiongtao
+"""
+
+import functools
+import math
+import os
+import sys
+import types
+from collections import Counter
+
+CALLS = Counter()
+
+_IDENTITY = (1.0, 0.0, 0.0, 0.0,
+             0.0, 1.0, 0.0, 0.0,
+             0.0, 0.0, 1.0, 0.0,
+             0.0, 0.0, 0.0, 1.0)
+
+_ROTATE_ORDERS = ('xyz', 'yzx', 'zxy', 'xzy', 'yxz', 'zyx')
+_AXIS = {'x': 0, 'y': 1, 'z': 2}
+_VECTOR_ATTRS = {'translate': 'translate', 'rotate': 'rotate', 'scale': 'scale'}
+_KEYABLE = ('translateX', 'translateY', 'translateZ', 'rotateX', 'rotateY', 'rotateZ',
+            'scaleX', 'scaleY', 'scaleZ')
+
+
+def reset_counters():
+    CALLS.clear()
+
+
+# ============================================================================
+# 数学 / Math (row-vector convention, like Maya)
+# ============================================================================
+
+def _mat_mul(a, b):
+    return tuple(
+        a[r * 4] * b[c] + a[r * 4 + 1] * b[4 + c] + a[r * 4 + 2] * b[8 + c] + a[r * 4 + 3] * b[12 + c]
+        for r in range(4) for c in range(4)
+    )
+
+
+def _mat_inverse(m):
+    a = [list(m[r * 4:r * 4 + 4]) + [1.0 if r == c else 0.0 for c in range(4)] for r in range(4)]
+    for col in range(4):
+        pivot = max(range(col, 4), key=lambda r: abs(a[r][col]))
+        if abs(a[pivot][col]) < 1e-15:
+            raise RuntimeError('(kFailure): matrix is singular')
+        a[col], a[pivot] = a[pivot], a[col]
+        scale = a[col][col]
+        a[col] = [v / scale for v in a[col]]
+        for r in range(4):
+            if r != col and a[r][col] != 0.0:
+                factor = a[r][col]
+                a[r] = [v - factor * p for v, p in zip(a[r], a[col])]
+    return tuple(a[r][4 + c] for r in range(4) for c in range(4))
+
+
+def _quat_mul(a, b):
+    """与 Maya 相同：对应矩阵 a × b"""
+    ax, ay, az, aw = a
+    bx, by, bz, bw = b
+    return (bw * ax + bx * aw + by * az - bz * ay,
+            bw * ay - bx * az + by * aw + bz * ax,
+            bw * az + bx * ay - by * ax + bz * aw,
+            bw * aw - bx * ax - by * ay - bz * az)
+
+
+def _quat_to_rows(q):
+    x, y, z, w = q
+    n = math.sqrt(x * x + y * y + z * z + w * w) or 1.0
+    x, y, z, w = x / n, y / n, z / n, w / n
+    return ((1.0 - 2.0 * (y * y + z * z), 2.0 * (x * y + z * w), 2.0 * (x * z - y * w)),
+            (2.0 * (x * y - z * w), 1.0 - 2.0 * (x * x + z * z), 2.0 * (y * z + x * w)),
+            (2.0 * (x * z + y * w), 2.0 * (y * z - x * w), 1.0 - 2.0 * (x * x + y * y)))
+
+
+def _rows_to_quat(r):
+    (m00, m01, m02), (m10, m11, m12), (m20, m21, m22) = r
+    trace = m00 + m11 + m22
+    if trace > 0.0:
+        s = math.sqrt(trace + 1.0) * 2.0
+        q = ((m12 - m21) / s, (m20 - m02) / s, (m01 - m10) / s, 0.25 * s)
+    elif m00 > m11 and m00 > m22:
+        s = math.sqrt(1.0 + m00 - m11 - m22) * 2.0
+        q = (0.25 * s, (m01 + m10) / s, (m20 + m02) / s, (m12 - m21) / s)
+    elif m11 > m22:
+        s = math.sqrt(1.0 + m11 - m00 - m22) * 2.0
+        q = ((m01 + m10) / s, 0.25 * s, (m12 + m21) / s, (m20 - m02) / s)
+    else:
+        s = math.sqrt(1.0 + m22 - m00 - m11) * 2.0
+        q = ((m20 + m02) / s, (m12 + m21) / s, 0.25 * s, (m01 - m10) / s)
+    return q if q[3] >= 0.0 else tuple(-v for v in q)
+
+
+def _euler_to_quat(angles, order):
+    result = (0.0, 0.0, 0.0, 1.0)
+    for axis in _ROTATE_ORDERS[order]:
+        index = _AXIS[axis]
+        q = [0.0, 0.0, 0.0, math.cos(angles[index] * 0.5)]
+        q[index] = math.sin(angles[index] * 0.5)
+        result = _quat_mul(result, tuple(q))
+    return result
+
+
+def _quat_to_euler(q, order):
+    name = _ROTATE_ORDERS[order]
+    i, j, k = (_AXIS[axis] for axis in name)
+    rows = _quat_to_rows(q)
+    r = [[rows[c][rr] for c in range(3)] for rr in range(3)]  # 列向量约定
+    cy = math.hypot(r[i][i], r[j][i])
+    if cy > 1e-9:
+        ai = math.atan2(r[k][j], r[k][k])
+        aj = math.atan2(-r[k][i], cy)
+        ak = math.atan2(r[j][i], r[i][i])
+    else:
+        ai = math.atan2(-r[j][k], r[j][j])
+        aj = math.atan2(-r[k][i], cy)
+        ak = 0.0
+    if name not in ('xyz', 'yzx', 'zxy'):
+        ai, aj, ak = -ai, -aj, -ak
+    angles = [0.0, 0.0, 0.0]
+    angles[i], angles[j], angles[k] = ai, aj, ak
+    return angles
+
+
+def _compose(translate, rotate, scale, order):
+    rows = _quat_to_rows(_euler_to_quat(rotate, order))
+    return (rows[0][0] * scale[0], rows[0][1] * scale[0], rows[0][2] * scale[0], 0.0,
+            rows[1][0] * scale[1], rows[1][1] * scale[1], rows[1][2] * scale[1], 0.0,
+            rows[2][0] * scale[2], rows[2][1] * scale[2], rows[2][2] * scale[2], 0.0,
+            translate[0], translate[1], translate[2], 1.0)
+
+
+# ============================================================================
+# 场景 / Scene
+# ============================================================================
+
+class AnimCurve:
+    """线性插值的动画曲线（内部单位）"""
+
+    def __init__(self, name, curve_type=2):
+        self.name = name
+        self.curve_type = curve_type
+        self.times = []
+        self.values = []
+        self.tangents = []
+        self.alive = True
+        self.node_type = 'animCurve'
+
+    def find(self, t):
+        lo, hi = 0, len(self.times)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[mid] < t - 1e-9:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.times) and abs(self.times[lo] - t) < 1e-9:
+            return lo
+        return None
+
+    def set_key(self, t, value, tangent='auto'):
+        index = self.find(t)
+        if index is not None:
+            self.values[index] = value
+            return
+        position = 0
+        while position < len(self.times) and self.times[position] < t:
+            position += 1
+        self.times.insert(position, t)
+        self.values.insert(position, value)
+        self.tangents.insert(position, tangent)
+
+    def evaluate(self, t):
+        times = self.times
+        if not times:
+            return 0.0
+        if t <= times[0]:
+            return self.values[0]
+        if t >= times[-1]:
+            return self.values[-1]
+        lo, hi = 0, len(times) - 1
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if times[mid] <= t:
+                lo = mid
+            else:
+                hi = mid
+        alpha = (t - times[lo]) / (times[hi] - times[lo])
+        return self.values[lo] + (self.values[hi] - self.values[lo]) * alpha
+
+    def snapshot(self):
+        return list(self.times), list(self.values), list(self.tangents)
+
+    def restore(self, data):
+        self.times, self.values, self.tangents = (list(v) for v in data)
+
+
+class Node:
+    def __init__(self, name, node_type='transform', parent=None):
+        self.name = name
+        self.node_type = node_type
+        self.parent = parent
+        self.children = []
+        self.alive = True
+        self.attrs = {
+            'translate': [0.0, 0.0, 0.0],
+            'rotate': [0.0, 0.0, 0.0],   # 弧度
+            'scale': [1.0, 1.0, 1.0],
+            'rotateAxis': [0.0, 0.0, 0.0],   # 弧度（只用于读取，合成矩阵时视为零）
+            'rotateOrder': 0,
+        }
+        self.dynamic = {}     # addAttr 添加的属性 {名称: {'type', 'multi'}}
+        self.curves = {}      # {'rotateX': AnimCurve}
+        self.overrides = {}   # setAttr 在动画属性上的临时值（直到时间改变）
+
+    def path(self):
+        names = []
+        node = self
+        while node is not None:
+            names.append(node.name)
+            node = node.parent
+        return '|' + '|'.join(reversed(names))
+
+
+class Scene:
+    """伪场景：节点、层级、动画曲线和当前时间"""
+
+    def __init__(self):
+        self.nodes = {}
+        self.curves = {}
+        self.time = 1.0
+        self.context_time = None
+        self.version = 0
+        self.selection = []
+        self.playback = (1.0, 120.0)
+        self.scene_name = ''  # 未保存的场景
+        self.callbacks = {}
+        self._next_callback = 1
+        self._cache = {}
+        self.connections = {}  # {(目标节点, 属性): (源节点, 属性)}，属性可带 [索引]
+        self.undo_queue = []  # 可撤销的插件命令
+        self.redo_queue = []
+        # 偏好设置（快速烘焙会临时修改）
+        self.settings = {'autoSave': True, 'autoKeyframe': True, 'cachedPlayback': True,
+                         'evaluationManager': 'parallel', 'refreshSuspended': False}
+
+    # ------------------------------------------------------------ 构建
+
+    def create_node(self, name, node_type='transform', parent=None, translate=None, rotate=None,
+                    scale=None, rotate_order=0):
+        if name in self.nodes:
+            raise RuntimeError(f'duplicate node name: {name}')
+        parent_node = self.nodes[parent] if isinstance(parent, str) else parent
+        node = Node(name, node_type, parent_node)
+        if translate:
+            node.attrs['translate'] = [float(v) for v in translate]
+        if rotate:
+            node.attrs['rotate'] = [math.radians(v) for v in rotate]
+        if scale:
+            node.attrs['scale'] = [float(v) for v in scale]
+        node.attrs['rotateOrder'] = rotate_order
+        if parent_node is not None:
+            parent_node.children.append(node)
+        self.nodes[name] = node
+        self.dirty()
+        return node
+
+    def set_key(self, node, attr, t, value):
+        """设置关键帧（内部单位）"""
+        node = self.nodes[node] if isinstance(node, str) else node
+        curve = node.curves.get(attr)
+        if curve is None:
+            curve_type = 0 if attr.startswith('rotate') else 1 if attr.startswith('translate') else 2
+            curve = AnimCurve(f'{node.name}_{attr}', curve_type)
+            self.curves[curve.name] = curve
+            node.curves[attr] = curve
+        curve.set_key(t, value)
+        self.dirty()
+        return curve
+
+    def rename(self, node, new_name):
+        node = self.nodes.pop(node) if isinstance(node, str) else self.nodes.pop(node.name)
+        previous = node.name
+        node.name = new_name
+        self.nodes[new_name] = node
+        self._fire('name', MObject(node), previous)
+
+    def delete(self, name):
+        node = self.nodes.pop(name)
+        node.alive = False
+        if node.parent is not None:
+            node.parent.children.remove(node)
+        for key, source in list(self.connections.items()):
+            if key[0] is node or source[0] is node:
+                del self.connections[key]
+        self._fire('removed', MObject(node))
+        self.dirty()
+
+    def dirty(self):
+        self.version += 1
+
+    # ------------------------------------------------------------ 求值
+
+    def eval_time(self):
+        return self.time if self.context_time is None else self.context_time
+
+    def attr_value(self, node, attr):
+        """单个标量属性在当前求值时间的值（内部单位）"""
+        t = self.eval_time()
+        if attr in node.overrides and t == self.time:
+            return node.overrides[attr]
+        curve = node.curves.get(attr)
+        if curve is not None and curve.times:
+            return curve.evaluate(t)
+        if attr == 'rotateOrder' or not isinstance(node.attrs.get(attr, []), list):
+            return node.attrs[attr]
+        base, axis = attr[:-1], 'XYZ'.index(attr[-1])
+        return node.attrs[base][axis]
+
+    def vector_value(self, node, base):
+        return [self.attr_value(node, base + axis) for axis in 'XYZ']
+
+    def local_matrix(self, node):
+        return _compose(self.vector_value(node, 'translate'), self.vector_value(node, 'rotate'),
+                        self.vector_value(node, 'scale'), node.attrs['rotateOrder'])
+
+    def world_matrix(self, node):
+        if node is None:
+            return _IDENTITY
+        key = (node.name, self.eval_time())
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+        CALLS['eval.worldMatrix'] += 1
+        matrix = _mat_mul(self.local_matrix(node), self.world_matrix(node.parent))
+        self._cache[key] = (self.version, matrix)
+        return matrix
+
+    def set_static(self, node, attr, value):
+        """setAttr：无动画时修改静态值，有动画时设置临时覆盖值"""
+        base, axis = attr[:-1], 'XYZ'.index(attr[-1])
+        node.attrs[base][axis] = value
+        if attr in node.curves and node.curves[attr].times:
+            node.overrides[attr] = value
+        self.dirty()
+
+    def set_time(self, t):
+        self.time = float(t)
+        for node in self.nodes.values():
+            node.overrides.clear()
+        self.dirty()
+
+    # ------------------------------------------------------------ 连接
+
+    def connect(self, source, destination):
+        self.connections[destination] = source
+
+    def element_indices(self, node, attr):
+        """多重属性上已连接的逻辑索引（升序）"""
+        prefix = attr + '['
+        return sorted(int(key[1][len(prefix):-1]) for key in self.connections
+                      if key[0] is node and key[1].startswith(prefix))
+
+    # ------------------------------------------------------------ 回调
+
+    def add_callback(self, kind, function):
+        callback_id = self._next_callback
+        self._next_callback += 1
+        self.callbacks[callback_id] = (kind, function)
+        return callback_id
+
+    def _fire(self, kind, *args):
+        for callback_kind, function in list(self.callbacks.values()):
+            if callback_kind == kind:
+                function(*args, None)
+
+    # ------------------------------------------------------------ 查找
+
+    def find(self, name):
+        """按名称或DAG路径查找节点（或曲线）"""
+        if name in self.nodes:
+            return self.nodes[name]
+        if name in self.curves:
+            return self.curves[name]
+        if '|' in name:
+            short = name.rstrip('|').rsplit('|', 1)[-1]
+            node = self.nodes.get(short)
+            if node is not None and (node.path() == name or node.path().endswith('|' + name.lstrip('|'))):
+                return node
+        return None
+
+
+SCENE = Scene()
+
+
+# ============================================================================
+# maya.api.OpenMaya
+# ============================================================================
+
+class MSpace:
+    kInvalid, kTransform, kPreTransform, kPostTransform, kWorld, kObject = range(6)
+
+
+class MFn:
+    kInvalid = 0
+    kDependencyNode = 4
+    kDagNode = 107
+    kTransform = 110
+    kJoint = 121
+    kAnimCurve = 7
+    kExpression = 327
+    kTime = 513
+    kAttribute = 554
+    kUnitAttribute = 270
+
+
+class MObject:
+    def __init__(self, node=None, attribute=None):
+        self._node = node
+        self._attribute = attribute
+
+    def isNull(self):
+        return self._node is None and self._attribute is None
+
+    def hasFn(self, fn):
+        if self._attribute is not None:
+            return fn == MFn.kUnitAttribute and self._attribute[:-1] in ('translate', 'rotate')
+        node = self._node
+        if node is None:
+            return False
+        if isinstance(node, AnimCurve):
+            return fn in (MFn.kAnimCurve, MFn.kDependencyNode)
+        if fn == MFn.kDependencyNode:
+            return True
+        if fn in (MFn.kDagNode, MFn.kTransform):
+            return node.node_type in ('transform', 'joint')
+        if fn in (MFn.kTime, MFn.kExpression):
+            return node.node_type == ('time' if fn == MFn.kTime else 'expression')
+        if fn == MFn.kJoint:
+            return node.node_type == 'joint'
+        return False
+
+    def __eq__(self, other):
+        return isinstance(other, MObject) and other._node is self._node and other._attribute == self._attribute
+
+    def __hash__(self):
+        return id(self._node)
+
+
+MObject.kNullObj = MObject()
+
+
+class MObjectHandle:
+    def __init__(self, obj):
+        self._obj = obj
+
+    def isValid(self):
+        node = self._obj._node
+        return node is not None and node.alive
+
+    def isAlive(self):
+        return self.isValid()
+
+    def object(self):
+        return self._obj
+
+    def hashCode(self):
+        return id(self._obj._node)
+
+
+class MMatrix:
+    def __init__(self, values=None):
+        if values is None:
+            self._m = _IDENTITY
+        elif isinstance(values, MMatrix):
+            self._m = values._m
+        else:
+            flat = [v for row in values for v in row] if len(values) == 4 else list(values)
+            self._m = tuple(float(v) for v in flat)
+
+    def __mul__(self, other):
+        CALLS['api.MMatrix.mul'] += 1
+        return MMatrix(_mat_mul(self._m, other._m))
+
+    def inverse(self):
+        CALLS['api.MMatrix.inverse'] += 1
+        return MMatrix(_mat_inverse(self._m))
+
+    def getElement(self, row, col):
+        return self._m[row * 4 + col]
+
+    def __getitem__(self, index):
+        return self._m[index]
+
+    def __len__(self):
+        return 16
+
+    def __iter__(self):
+        return iter(self._m)
+
+    def __repr__(self):
+        return f'MMatrix({list(self._m)})'
+
+
+MMatrix.kIdentity = MMatrix()
+
+
+class MVector:
+    def __init__(self, *args):
+        if len(args) == 1:
+            values = list(args[0])[:3]
+        elif args:
+            values = list(args[:3])
+        else:
+            values = [0.0, 0.0, 0.0]
+        self.x, self.y, self.z = (float(v) for v in values)
+
+    def __iter__(self):
+        return iter((self.x, self.y, self.z))
+
+    def __getitem__(self, index):
+        return (self.x, self.y, self.z)[index]
+
+    def __len__(self):
+        return 3
+
+    def __add__(self, other):
+        return MVector(self.x + other[0], self.y + other[1], self.z + other[2])
+
+    def __sub__(self, other):
+        return MVector(self.x - other[0], self.y - other[1], self.z - other[2])
+
+    def __mul__(self, other):
+        if isinstance(other, MVector):
+            return self.x * other.x + self.y * other.y + self.z * other.z
+        if isinstance(other, MMatrix):
+            m = other._m
+            return MVector(self.x * m[0] + self.y * m[4] + self.z * m[8],
+                           self.x * m[1] + self.y * m[5] + self.z * m[9],
+                           self.x * m[2] + self.y * m[6] + self.z * m[10])
+        return MVector(self.x * other, self.y * other, self.z * other)
+
+    __rmul__ = __mul__
+
+    def length(self):
+        return math.sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
+
+    def normalize(self):
+        length = self.length() or 1.0
+        self.x, self.y, self.z = self.x / length, self.y / length, self.z / length
+        return self
+
+    def normal(self):
+        return MVector(self).normalize()
+
+
+class MPoint(MVector):
+    def __mul__(self, other):
+        if isinstance(other, MMatrix):
+            m = other._m
+            return MPoint(self.x * m[0] + self.y * m[4] + self.z * m[8] + m[12],
+                          self.x * m[1] + self.y * m[5] + self.z * m[9] + m[13],
+                          self.x * m[2] + self.y * m[6] + self.z * m[10] + m[14])
+        return MVector.__mul__(self, other)
+
+    def __sub__(self, other):
+        return MVector(self.x - other[0], self.y - other[1], self.z - other[2])
+
+
+class MQuaternion:
+    def __init__(self, x=0.0, y=0.0, z=0.0, w=1.0):
+        if isinstance(x, MQuaternion):
+            x, y, z, w = x.x, x.y, x.z, x.w
+        self.x, self.y, self.z, self.w = float(x), float(y), float(z), float(w)
+
+    def _tuple(self):
+        return self.x, self.y, self.z, self.w
+
+    def __mul__(self, other):
+        return MQuaternion(*_quat_mul(self._tuple(), other._tuple()))
+
+    def inverse(self):
+        n = self.x * self.x + self.y * self.y + self.z * self.z + self.w * self.w
+        return MQuaternion(-self.x / n, -self.y / n, -self.z / n, self.w / n)
+
+    def asEulerRotation(self):
+        return MEulerRotation(*_quat_to_euler(self._tuple(), 0), order=0)
+
+    def asMatrix(self):
+        rows = _quat_to_rows(self._tuple())
+        return MMatrix([rows[0][0], rows[0][1], rows[0][2], 0.0,
+                        rows[1][0], rows[1][1], rows[1][2], 0.0,
+                        rows[2][0], rows[2][1], rows[2][2], 0.0,
+                        0.0, 0.0, 0.0, 1.0])
+
+
+class MEulerRotation:
+    kXYZ, kYZX, kZXY, kXZY, kYXZ, kZYX = range(6)
+
+    def __init__(self, x=0.0, y=0.0, z=0.0, order=0):
+        self.x, self.y, self.z = float(x), float(y), float(z)
+        self.order = order
+
+    def __getitem__(self, index):
+        return (self.x, self.y, self.z)[index]
+
+    def asQuaternion(self):
+        return MQuaternion(*_euler_to_quat((self.x, self.y, self.z), self.order))
+
+    def reorder(self, order):
+        angles = _quat_to_euler(_euler_to_quat((self.x, self.y, self.z), self.order), order)
+        return MEulerRotation(*angles, order=order)
+
+    def alternateSolution(self):
+        i, j, k = (_AXIS[axis] for axis in _ROTATE_ORDERS[self.order])
+        angles = [self.x, self.y, self.z]
+        angles[i] += math.pi
+        angles[j] = math.pi - angles[j]
+        angles[k] += math.pi
+        return MEulerRotation(*angles, order=self.order)
+
+    def closestCut(self, dst):
+        angles = []
+        for value, target in zip((self.x, self.y, self.z), (dst.x, dst.y, dst.z)):
+            angles.append(value + round((target - value) / (2.0 * math.pi)) * 2.0 * math.pi)
+        return MEulerRotation(*angles, order=self.order)
+
+    def closestSolution(self, dst):
+        candidates = [self.closestCut(dst), self.alternateSolution().closestCut(dst)]
+        return min(candidates, key=lambda e: abs(e.x - dst.x) + abs(e.y - dst.y) + abs(e.z - dst.z))
+
+
+class MTransformationMatrix:
+    def __init__(self, matrix=None):
+        m = matrix._m if isinstance(matrix, MMatrix) else _IDENTITY
+        rows = [m[0:3], m[4:7], m[8:11]]
+        self._scale = [math.sqrt(sum(v * v for v in row)) or 1.0 for row in rows]
+        normalized = [[v / s for v in row] for row, s in zip(rows, self._scale)]
+        self._quat = _rows_to_quat(normalized)
+        self._translate = [m[12], m[13], m[14]]
+        self._order = 0
+
+    def rotation(self, asQuaternion=False):
+        if asQuaternion:
+            return MQuaternion(*self._quat)
+        return MEulerRotation(*_quat_to_euler(self._quat, self._order), order=self._order)
+
+    def setRotation(self, rotation):
+        if isinstance(rotation, MEulerRotation):
+            rotation = rotation.asQuaternion()
+        self._quat = rotation._tuple()
+        return self
+
+    def translation(self, space=MSpace.kTransform):
+        return MVector(self._translate)
+
+    def setTranslation(self, vector, space=MSpace.kTransform):
+        self._translate = [vector[0], vector[1], vector[2]]
+        return self
+
+    def scale(self, space=MSpace.kTransform):
+        return list(self._scale)
+
+    def reorderRotation(self, order):
+        self._order = order
+        return self
+
+    def asMatrix(self):
+        rows = _quat_to_rows(self._quat)
+        s = self._scale
+        t = self._translate
+        return MMatrix([rows[0][0] * s[0], rows[0][1] * s[0], rows[0][2] * s[0], 0.0,
+                        rows[1][0] * s[1], rows[1][1] * s[1], rows[1][2] * s[1], 0.0,
+                        rows[2][0] * s[2], rows[2][1] * s[2], rows[2][2] * s[2], 0.0,
+                        t[0], t[1], t[2], 1.0])
+
+
+class MTime:
+    kFilm, kPALFrame, kNTSCFrame = 6, 7, 8
+
+    def __init__(self, value=0.0, unit=6):
+        self.value = float(value)
+        self.unit = unit
+
+    @staticmethod
+    def uiUnit():
+        return MTime.kFilm
+
+    def asUnits(self, unit):
+        return self.value
+
+
+class MTimeArray(list):
+    pass
+
+
+class MDoubleArray(list):
+    pass
+
+
+class MDistance:
+    @staticmethod
+    def internalToUI(value):
+        return value
+
+    @staticmethod
+    def uiToInternal(value):
+        return value
+
+
+class MAngle:
+    @staticmethod
+    def internalToUI(value):
+        return math.degrees(value)
+
+    @staticmethod
+    def uiToInternal(value):
+        return math.radians(value)
+
+
+class MDGContext:
+    def __init__(self, time=None):
+        self._time = time.value if isinstance(time, MTime) else time
+
+    def makeCurrent(self):
+        CALLS['api.MDGContext.makeCurrent'] += 1
+        previous = MDGContext(SCENE.context_time)
+        SCENE.context_time = self._time
+        return previous
+
+    def getTime(self):
+        return MTime(SCENE.time if self._time is None else self._time)
+
+
+MDGContext.kNormal = MDGContext()
+
+
+class _MatrixData:
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+
+class _ArrayData:
+    def __init__(self, values):
+        self.values = list(values)
+
+    def isNull(self):
+        return False
+
+
+class MFnDoubleArrayData:
+    def __init__(self, obj=None):
+        self._obj = obj
+
+    def array(self):
+        return MDoubleArray(self._obj.values)
+
+
+class MFnStringArrayData:
+    def __init__(self, obj=None):
+        self._obj = obj
+
+    def array(self):
+        return list(self._obj.values)
+
+
+class MFnMatrixData:
+    def __init__(self, obj=None):
+        self._obj = obj
+
+    def matrix(self):
+        return MMatrix(self._obj.matrix)
+
+
+class MFnUnitAttribute:
+    kInvalid, kAngle, kDistance, kTime = range(4)
+
+    def __init__(self, attribute):
+        self._attribute = attribute
+
+    def unitType(self):
+        name = self._attribute._attribute
+        return self.kAngle if name.startswith('rotate') else self.kDistance
+
+
+class MPlug:
+    """伪 MPlug：节点 + 属性名（例如 'rotate'、'rotateX'、'worldMatrix[0]'）"""
+
+    def __init__(self, node=None, attr=None):
+        self._node = node
+        self._attr = attr
+
+    @property
+    def isNull(self):
+        return self._node is None
+
+    def node(self):
+        return MObject(self._node)
+
+    def attribute(self):
+        return MObject(attribute=self._attr)
+
+    def name(self):
+        return f'{self._node.name}.{self._attr}'
+
+    def partialName(self, includeNodeName=False, *args, **kwargs):
+        return self.name() if includeNodeName else self._attr
+
+    def child(self, index):
+        return MPlug(self._node, self._attr + 'XYZ'[index])
+
+    def numChildren(self):
+        return 3 if self._attr in _VECTOR_ATTRS else 0
+
+    def asMObject(self):
+        CALLS['api.MPlug.asMObject'] += 1
+        node = self._node
+        stored = node.attrs.get(self._attr)
+        if isinstance(stored, (list, tuple)) and len(stored) == 16:
+            # 保存的矩阵（例如 dagPose.worldMatrix[i]、skinCluster.bindPreMatrix[i]）
+            return _MatrixData(tuple(stored))
+        if self._attr == 'worldMatrix[0]':
+            matrix = SCENE.world_matrix(node)
+        elif self._attr == 'parentMatrix[0]':
+            matrix = SCENE.world_matrix(node.parent)
+        elif self._attr == 'parentInverseMatrix[0]':
+            matrix = _mat_inverse(SCENE.world_matrix(node.parent))
+        elif self._attr == 'worldInverseMatrix[0]':
+            matrix = _mat_inverse(SCENE.world_matrix(node))
+        elif self._attr == 'matrix':
+            matrix = SCENE.local_matrix(node)
+        elif self._attr in getattr(node, 'dynamic', {}):
+            value = node.attrs.get(self._attr)
+            return MObject.kNullObj if value is None else _ArrayData(value)
+        else:
+            raise RuntimeError(f'(kFailure): {self.name()} is not a matrix attribute')
+        return _MatrixData(matrix)
+
+    def asDouble(self):
+        CALLS['api.MPlug.asDouble'] += 1
+        return float(SCENE.attr_value(self._node, self._attr))
+
+    def asInt(self):
+        CALLS['api.MPlug.asInt'] += 1
+        return int(SCENE.attr_value(self._node, self._attr))
+
+    def asString(self):
+        return str(self._node.attrs.get(self._attr, ''))
+
+    def asBool(self):
+        return bool(self._node.attrs.get(self._attr, False))
+
+    def logicalIndex(self):
+        return int(self._attr[self._attr.rindex('[') + 1:-1])
+
+    def numElements(self):
+        return len(SCENE.element_indices(self._node, self._attr))
+
+    def elementByPhysicalIndex(self, index):
+        return MPlug(self._node, f'{self._attr}[{SCENE.element_indices(self._node, self._attr)[index]}]')
+
+    def elementByLogicalIndex(self, index):
+        return MPlug(self._node, f'{self._attr}[{index}]')
+
+    def setDouble(self, value):
+        CALLS['api.MPlug.setDouble'] += 1
+        SCENE.set_static(self._node, self._attr, value)
+
+    def source(self):
+        connection = SCENE.connections.get((self._node, self._attr))
+        if connection is not None:
+            return MPlug(*connection)
+        curve = getattr(self._node, 'curves', {}).get(self._attr)
+        if curve is None or not curve.alive:
+            return MPlug()
+        return MPlug(curve, 'output')
+
+    def isConnected(self):
+        return not self.source().isNull
+
+    @property
+    def isDestination(self):
+        return not self.source().isNull
+
+
+class MSelectionList:
+    def __init__(self):
+        self._items = []
+
+    def add(self, name):
+        CALLS['api.MSelectionList.add'] += 1
+        node_name, _, attr = name.partition('.')
+        node = SCENE.find(node_name)
+        if node is None or (attr and not _valid_attr(node, attr)):
+            raise RuntimeError(f'(kInvalidParameter): Object does not exist: {name}')
+        self._items.append((node, attr))
+        return self
+
+    def length(self):
+        return len(self._items)
+
+    def getDependNode(self, index):
+        return MObject(self._items[index][0])
+
+    def getDagPath(self, index):
+        node = self._items[index][0]
+        if isinstance(node, AnimCurve):
+            raise RuntimeError('(kInvalidParameter): not a DAG node')
+        return MDagPath(node)
+
+    def getPlug(self, index):
+        node, attr = self._items[index]
+        if not attr:
+            raise RuntimeError('(kInvalidParameter): no attribute')
+        return MPlug(node, attr)
+
+
+def _valid_attr(node, attr):
+    if isinstance(node, AnimCurve):
+        return attr == 'output'
+    base = attr.split('[')[0]
+    if base in ('worldMatrix', 'parentMatrix', 'parentInverseMatrix', 'worldInverseMatrix', 'matrix',
+                'rotateOrder', 'translate', 'rotate', 'scale'):
+        return True
+    if base == 'message' or base in node.dynamic:
+        return True
+    return base[:-1] in _VECTOR_ATTRS and base[-1] in 'XYZ' or base in node.attrs
+
+
+class MItDependencyGraph:
+    """只支持向上游遍历：输入连接和动画曲线，深度优先，包含起点；prune() 跳过当前节点的上游"""
+    kDownstream, kUpstream = 0, 1
+    kDepthFirst, kBreadthFirst = 0, 1
+    kNodeLevel, kPlugLevel = 0, 1
+
+    def __init__(self, root, filter=MFn.kInvalid, direction=kDownstream, traversal=kDepthFirst, level=kNodeLevel):
+        CALLS['api.MItDependencyGraph'] += 1
+        self._stack = [root._node]
+        self._seen = set()
+        self._current = None
+        self.next()
+
+    @staticmethod
+    def _sources(node):
+        if isinstance(node, AnimCurve):
+            return []
+        sources = [curve for curve in node.curves.values() if curve.alive]
+        sources.extend(src for (dst, _), (src, _) in SCENE.connections.items() if dst is node)
+        return sources
+
+    def isDone(self):
+        return self._current is None
+
+    def currentNode(self):
+        return MObject(self._current)
+
+    def prune(self):
+        self._pruned = True
+
+    def next(self):
+        if self._current is not None and not getattr(self, '_pruned', False):
+            self._stack.extend(reversed(self._sources(self._current)))
+        self._pruned = False
+        self._current = None
+        while self._stack:
+            node = self._stack.pop()
+            if id(node) not in self._seen:
+                self._seen.add(id(node))
+                self._current = node
+                return
+
+
+class MDagPath:
+    def __init__(self, node=None):
+        self._node = node
+
+    @staticmethod
+    def getAPathTo(obj):
+        return MDagPath(obj._node)
+
+    def fullPathName(self):
+        return self._node.path()
+
+    def partialPathName(self):
+        return self._node.name
+
+    def instanceNumber(self):
+        return 0
+
+    def node(self):
+        return MObject(self._node)
+
+    def isValid(self):
+        return self._node is not None and self._node.alive
+
+    def inclusiveMatrix(self):
+        return MMatrix(SCENE.world_matrix(self._node))
+
+    def exclusiveMatrix(self):
+        return MMatrix(SCENE.world_matrix(self._node.parent))
+
+
+class MFnDependencyNode:
+    def __init__(self, obj=None):
+        self._node = obj._node if obj is not None else None
+
+    def name(self):
+        return self._node.name
+
+    def typeName(self):
+        return self._node.node_type
+
+    def findPlug(self, attr, want_networked=False):
+        return MPlug(self._node, attr)
+
+    def hasAttribute(self, attr):
+        return _valid_attr(self._node, attr)
+
+    def getConnections(self):
+        CALLS['api.MFnDependencyNode.getConnections'] += 1
+        node = self._node
+        plugs = [MPlug(node, attr) for attr, curve in getattr(node, 'curves', {}).items() if curve.alive]
+        for (dst_node, dst_attr), (src_node, src_attr) in SCENE.connections.items():
+            if dst_node is node:
+                plugs.append(MPlug(node, dst_attr))
+            elif src_node is node:
+                plugs.append(MPlug(node, src_attr))
+        return plugs
+
+
+class MDGModifier:
+    """记录曲线的创建/连接和属性值修改，可整体撤销；再次 doIt 只执行新加入的操作"""
+
+    def __init__(self):
+        self._connections = []  # (node, attr, curve)
+        self._values = []  # [plug, value, 修改前的值]
+        self._done = False
+        self._applied = 0
+
+    def doIt(self):
+        CALLS['api.MDGModifier.doIt'] += 1
+        # 与 AnimCurveWriter 的排队顺序一致：先写属性值，再连接曲线
+        for entry in self._values[self._applied:]:
+            plug, value = entry[0], entry[1]
+            entry[2] = SCENE.attr_value(plug._node, plug._attr)
+            SCENE.set_static(plug._node, plug._attr, value)
+        self._applied = len(self._values)
+        for node, attr, curve in self._connections:
+            curve.alive = True
+            node.curves[attr] = curve
+            SCENE.curves[curve.name] = curve
+        self._done = True
+        SCENE.dirty()
+
+    def undoIt(self):
+        for node, attr, curve in self._connections:
+            curve.alive = False
+            node.curves.pop(attr, None)
+            SCENE.curves.pop(curve.name, None)
+        for plug, value, previous in reversed(self._values[:self._applied]):
+            SCENE.set_static(plug._node, plug._attr, previous)
+        self._applied = 0
+        SCENE.dirty()
+
+    def newPlugValueDouble(self, plug, value):
+        CALLS['api.MDGModifier.newPlugValueDouble'] += 1
+        self._values.append([plug, value, None])
+
+
+class MMessage:
+    @staticmethod
+    def removeCallback(callback_id):
+        SCENE.callbacks.pop(callback_id, None)
+
+
+class MNodeMessage(MMessage):
+    @staticmethod
+    def addNameChangedCallback(node, function, clientData=None):
+        return SCENE.add_callback('name', function)
+
+
+class MDGMessage(MMessage):
+    @staticmethod
+    def addNodeRemovedCallback(function, nodeType='dependNode', clientData=None):
+        return SCENE.add_callback('removed', function)
+
+    @staticmethod
+    def addNodeAddedCallback(function, nodeType='dependNode', clientData=None):
+        return SCENE.add_callback('added', function)
+
+
+class MDagMessage(MMessage):
+    @staticmethod
+    def addParentAddedCallback(function, clientData=None):
+        return SCENE.add_callback('parent', function)
+
+    @staticmethod
+    def addParentRemovedCallback(function, clientData=None):
+        return SCENE.add_callback('parent', function)
+
+
+class MSceneMessage(MMessage):
+    kBeforeNew, kAfterNew, kBeforeOpen, kAfterOpen, kBeforeSave = range(5)
+
+    @staticmethod
+    def addCallback(message, function, clientData=None):
+        return SCENE.add_callback(f'scene{message}', function)
+
+
+# ============================================================================
+# 插件命令 / Plugin Commands
+# ============================================================================
+
+class MGlobal:
+    @staticmethod
+    def displayWarning(message):
+        pass
+
+    @staticmethod
+    def displayError(message):
+        pass
+
+
+class MSyntax:
+    kNoArg, kBoolean, kLong, kDouble, kString = range(5)
+
+    def __init__(self):
+        self.flags = {}  # {短名称: 长名称}
+        self.multi_use = set()
+
+    def addFlag(self, short_name, long_name, *arg_types):
+        self.flags[short_name.lstrip('-')] = long_name.lstrip('-')
+
+    def makeFlagMultiUse(self, short_name):
+        self.multi_use.add(short_name.lstrip('-'))
+
+
+class MArgList(list):
+    def asString(self, index):
+        return str(self[index])
+
+
+class MArgDatabase:
+    """伪参数解析：args 为 cmds 调用的关键字参数 {标志: 值}，短名称和长名称都可以"""
+
+    def __init__(self, syntax, args):
+        self._values = {}
+        for short_name, long_name in syntax.flags.items():
+            for name in (short_name, long_name):
+                if name in args:
+                    value = args[name]
+                    self._values[short_name] = list(value) if isinstance(value, (list, tuple)) else [value]
+
+    def _get(self, flag):
+        return self._values[flag.lstrip('-')]
+
+    def isFlagSet(self, flag):
+        return flag.lstrip('-') in self._values
+
+    def numberOfFlagUses(self, flag):
+        return len(self._values.get(flag.lstrip('-'), []))
+
+    def getFlagArgumentList(self, flag, occurrence):
+        return MArgList([self._get(flag)[occurrence]])
+
+    def flagArgumentString(self, flag, index):
+        return str(self._get(flag)[0])
+
+    def flagArgumentDouble(self, flag, index):
+        return float(self._get(flag)[0])
+
+    def flagArgumentInt(self, flag, index):
+        return int(self._get(flag)[0])
+
+    def flagArgumentBool(self, flag, index):
+        return bool(self._get(flag)[0])
+
+
+class MPxCommand:
+    def __init__(self):
+        self._syntax = None
+        self._result = None
+
+    def syntax(self):
+        return self._syntax
+
+    def setResult(self, value):
+        self._result = value
+
+
+class MFnPlugin:
+    def __init__(self, plugin=None, vendor='', version=''):
+        self._plugin = plugin
+
+    def registerCommand(self, name, creator, syntax_creator=None):
+        """注册为 maya.cmds 中的函数：调用时新建命令对象并执行 doIt，可撤销的命令进入撤销队列"""
+        def command(**kwargs):
+            CALLS[f'cmds.{name}'] += 1
+            instance = creator()
+            instance._syntax = syntax_creator() if syntax_creator else MSyntax()
+            instance.doIt(kwargs)
+            if instance.isUndoable():
+                SCENE.undo_queue.append(instance)
+                SCENE.redo_queue.clear()
+            return instance._result
+
+        setattr(sys.modules['maya.cmds'], name, command)
+        PLUGINS.setdefault(self._plugin, set()).add(name)
+
+    def deregisterCommand(self, name):
+        delattr(sys.modules['maya.cmds'], name)
+        PLUGINS.get(self._plugin, set()).discard(name)
+
+
+# {插件名称: {命令}}
+PLUGINS = {}
+
+
+# ============================================================================
+# maya.api.OpenMayaAnim
+# ============================================================================
+
+class MAnimCurveChange:
+    """记录曲线修改前的状态，用于撤销/重做"""
+
+    def __init__(self):
+        self._before = {}
+        self._after = {}
+
+    def _record(self, curve):
+        if curve.name not in self._before:
+            self._before[curve.name] = (curve, curve.snapshot())
+
+    def undoIt(self):
+        for name, (curve, before) in self._before.items():
+            self._after[name] = curve.snapshot()
+            curve.restore(before)
+        SCENE.dirty()
+
+    def redoIt(self):
+        for name, (curve, before) in self._before.items():
+            if name in self._after:
+                curve.restore(self._after[name])
+        SCENE.dirty()
+
+
+class MFnAnimCurve:
+    kAnimCurveTA, kAnimCurveTL, kAnimCurveTT, kAnimCurveTU = range(4)
+    kTangentGlobal, kTangentFixed, kTangentLinear, kTangentFlat, kTangentSmooth = range(5)
+    kTangentAuto = 10
+    kConstant, kLinear, kCycle, kCycleRelative, kOscillate = range(5)
+
+    def __init__(self, obj=None):
+        self._curve = obj._node if isinstance(obj, MObject) else None
+
+    def create(self, plug, animCurveType=None, modifier=None):
+        CALLS['api.MFnAnimCurve.create'] += 1
+        node, attr = plug._node, plug._attr
+        curve_type = animCurveType if animCurveType is not None else self.timedAnimCurveTypeForPlug(plug)
+        curve = AnimCurve(f'{node.name}_{attr}', curve_type)
+        self._curve = curve
+        if modifier is not None:
+            modifier._connections.append((node, attr, curve))
+        else:
+            node.curves[attr] = curve
+            SCENE.curves[curve.name] = curve
+        return MObject(curve)
+
+    def timedAnimCurveTypeForPlug(self, plug):
+        attr = plug._attr
+        return self.kAnimCurveTA if attr.startswith('rotate') else \
+            self.kAnimCurveTL if attr.startswith('translate') else self.kAnimCurveTU
+
+    @property
+    def numKeys(self):
+        return len(self._curve.times)
+
+    def find(self, time):
+        CALLS['api.MFnAnimCurve.find'] += 1
+        return self._curve.find(time.value)
+
+    def input(self, index):
+        return MTime(self._curve.times[index])
+
+    def value(self, index):
+        return self._curve.values[index]
+
+    def setValue(self, index, value, change=None):
+        CALLS['api.MFnAnimCurve.setValue'] += 1
+        if change is not None:
+            change._record(self._curve)
+        self._curve.values[index] = value
+        SCENE.dirty()
+
+    def addKey(self, time, value, tangentInType=0, tangentOutType=0, change=None):
+        self.addKeys([time], [value], tangentInType, tangentOutType, True, change)
+
+    def addKeys(self, times, values, tangentInType=0, tangentOutType=0, keepExistingKeys=False, change=None):
+        CALLS['api.MFnAnimCurve.addKeys'] += 1
+        if change is not None:
+            change._record(self._curve)
+        if not keepExistingKeys:
+            self._curve.times, self._curve.values, self._curve.tangents = [], [], []
+        for time, value in zip(times, values):
+            self._curve.set_key(time.value, value, tangentInType)
+        SCENE.dirty()
+
+    def evaluate(self, time):
+        return self._curve.evaluate(time.value)
+
+    def inTangentType(self, index):
+        tangent = self._curve.tangents[index]
+        return tangent if isinstance(tangent, int) else self.kTangentAuto
+
+    def outTangentType(self, index):
+        return self.inTangentType(index)
+
+    def getTangentXY(self, index, isInTangent):
+        # 线性插值：切线方向取相邻关键帧的斜率
+        curve = self._curve
+        neighbour = index - 1 if isInTangent else index + 1
+        if not 0 <= neighbour < len(curve.times):
+            return 1.0, 0.0
+        dt = curve.times[neighbour] - curve.times[index]
+        return 1.0, (curve.values[neighbour] - curve.values[index]) / dt
+
+    @property
+    def preInfinityType(self):
+        return self.kConstant
+
+    @property
+    def postInfinityType(self):
+        return self.kConstant
+
+
+# ============================================================================
+# maya.cmds
+# ============================================================================
+
+def _counted(function):
+    name = 'cmds.' + function.__name__
+
+    def wrapper(*args, **kwargs):
+        CALLS[name] += 1
+        return function(*args, **kwargs)
+
+    wrapper.__name__ = function.__name__
+    return wrapper
+
+
+def _split_plug(name):
+    node_name, _, attr = name.partition('.')
+    node = SCENE.find(node_name)
+    if node is None:
+        raise ValueError(f'No object matches name: {name}')
+    return node, attr
+
+
+def _flag(kwargs, *names):
+    for name in names:
+        if name in kwargs:
+            return kwargs[name]
+    return None
+
+
+@_counted
+def objExists(name):
+    node_name, _, attr = name.partition('.')
+    node = SCENE.find(node_name)
+    return node is not None and (not attr or _valid_attr(node, attr))
+
+
+@_counted
+def ls(*args, **kwargs):
+    if _flag(kwargs, 'selection', 'sl'):
+        return list(SCENE.selection)
+    names = []
+    for arg in args:
+        names.extend([arg] if isinstance(arg, str) else arg)
+    if not args:
+        names = list(SCENE.nodes)
+    result = []
+    node_type = _flag(kwargs, 'type', 'typ')
+    if node_type is not None:
+        return [name for name in names if name in SCENE.nodes and SCENE.nodes[name].node_type == node_type]
+    if _flag(kwargs, 'recursive', 'r'):
+        # 在所有命名空间中按去掉命名空间后的名称匹配
+        import fnmatch
+        for name in names:
+            result.extend(n for n in SCENE.nodes if fnmatch.fnmatchcase(n.rpartition(':')[2], name))
+        names = []
+    for name in names:
+        if '*' in name:
+            import fnmatch
+            result.extend(n for n in SCENE.nodes if fnmatch.fnmatchcase(n, name))
+        elif SCENE.find(name) is not None:
+            result.append(name)
+    if _flag(kwargs, 'long', 'l'):
+        result = [SCENE.find(n).path() for n in result]
+    return result
+
+
+@_counted
+def select(*args, **kwargs):
+    if _flag(kwargs, 'clear', 'cl'):
+        SCENE.selection = []
+        return
+    names = []
+    for arg in args:
+        names.extend([arg] if isinstance(arg, str) else arg)
+    SCENE.selection = names
+
+
+@_counted
+def listRelatives(name, **kwargs):
+    node = SCENE.find(name)
+    if _flag(kwargs, 'parent', 'p'):
+        return [node.parent.name] if node.parent else None
+    return [child.name for child in node.children] or None
+
+
+@_counted
+def getAttr(name, **kwargs):
+    node, attr = _split_plug(name)
+    if kwargs.get('multiIndices') or kwargs.get('mi'):
+        return SCENE.element_indices(node, attr) or None
+    if attr in _VECTOR_ATTRS:
+        values = SCENE.vector_value(node, attr)
+        if attr == 'rotate':
+            values = [math.degrees(v) for v in values]
+        return [tuple(values)]
+    if attr == 'rotateOrder':
+        return node.attrs['rotateOrder']
+    if attr[:-1] in _VECTOR_ATTRS:
+        value = SCENE.attr_value(node, attr)
+        return math.degrees(value) if attr.startswith('rotate') else value
+    return node.attrs.get(attr)
+
+
+@_counted
+def setAttr(name, *values, **kwargs):
+    node, attr = _split_plug(name)
+    if attr in _VECTOR_ATTRS:
+        for axis, value in zip('XYZ', values):
+            SCENE.set_static(node, attr + axis, math.radians(value) if attr == 'rotate' else value)
+    elif attr[:-1] in _VECTOR_ATTRS:
+        SCENE.set_static(node, attr, math.radians(values[0]) if attr.startswith('rotate') else values[0])
+    elif kwargs.get('type') == 'doubleArray':
+        node.attrs[attr] = list(values[0])
+    elif kwargs.get('type') == 'stringArray':
+        node.attrs[attr] = list(values[1:1 + values[0]])
+    else:
+        node.attrs[attr] = values[0] if len(values) == 1 else list(values)
+        SCENE.dirty()
+
+
+@_counted
+def xform(name, **kwargs):
+    node = SCENE.find(name)
+    query = _flag(kwargs, 'query', 'q')
+    world = _flag(kwargs, 'worldSpace', 'ws')
+    if query:
+        matrix = SCENE.world_matrix(node) if world else SCENE.local_matrix(node)
+        if _flag(kwargs, 'matrix', 'm'):
+            return list(matrix)
+        if _flag(kwargs, 'translation', 't'):
+            return [matrix[12], matrix[13], matrix[14]]
+        if _flag(kwargs, 'rotation', 'ro'):
+            tm = MTransformationMatrix(MMatrix(matrix))
+            return [math.degrees(v) for v in _quat_to_euler(tm._quat, node.attrs['rotateOrder'])]
+        return None
+
+    translation = _flag(kwargs, 'translation', 't')
+    rotation = _flag(kwargs, 'rotation', 'ro')
+    parent_inverse = _mat_inverse(SCENE.world_matrix(node.parent)) if world else _IDENTITY
+    if translation is not None:
+        local = MPoint(translation) * MMatrix(parent_inverse)
+        for axis, value in zip('XYZ', local):
+            SCENE.set_static(node, 'translate' + axis, value)
+    if rotation is not None:
+        order = node.attrs['rotateOrder']
+        quat = _euler_to_quat([math.radians(v) for v in rotation], order)
+        if world:
+            parent_quat = MTransformationMatrix(MMatrix(SCENE.world_matrix(node.parent)))._quat
+            quat = _quat_mul(quat, MQuaternion(*parent_quat).inverse()._tuple())
+        for axis, value in zip('XYZ', _quat_to_euler(quat, order)):
+            SCENE.set_static(node, 'rotate' + axis, value)
+
+
+@_counted
+def setKeyframe(*args, **kwargs):
+    targets = []
+    for arg in args:
+        targets.extend([arg] if isinstance(arg, str) else arg)
+    attribute = _flag(kwargs, 'attribute', 'at')
+    time_value = _flag(kwargs, 'time', 't')
+    value = _flag(kwargs, 'value', 'v')
+    t = SCENE.time if time_value is None else float(time_value)
+
+    count = 0
+    for target in targets:
+        node, attr = _split_plug(target)
+        if attr:
+            attrs = [attr]
+        elif attribute in _VECTOR_ATTRS:
+            attrs = [attribute + axis for axis in 'XYZ']
+        elif attribute:
+            attrs = [attribute]
+        else:
+            attrs = list(_KEYABLE)
+        for name in attrs:
+            if value is not None:
+                key_value = math.radians(value) if name.startswith('rotate') else value
+            else:
+                key_value = SCENE.attr_value(node, name)
+            SCENE.set_key(node, name, t, key_value)
+            count += 1
+    return count
+
+
+@_counted
+def currentTime(*args, **kwargs):
+    if _flag(kwargs, 'query', 'q'):
+        return SCENE.time
+    SCENE.set_time(args[0])
+    return SCENE.time
+
+
+@_counted
+def playbackOptions(**kwargs):
+    if _flag(kwargs, 'query', 'q'):
+        if _flag(kwargs, 'minTime', 'min'):
+            return SCENE.playback[0]
+        if _flag(kwargs, 'maxTime', 'max'):
+            return SCENE.playback[1]
+    return None
+
+
+@_counted
+def undoInfo(*args, **kwargs):
+    return True
+
+
+@_counted
+def undo(*args, **kwargs):
+    """撤销最近一个插件命令（其他 cmds 调用不进入伪撤销队列）"""
+    if SCENE.undo_queue:
+        command = SCENE.undo_queue.pop()
+        command.undoIt()
+        SCENE.redo_queue.append(command)
+
+
+@_counted
+def redo(*args, **kwargs):
+    if SCENE.redo_queue:
+        command = SCENE.redo_queue.pop()
+        command.redoIt()
+        SCENE.undo_queue.append(command)
+
+
+@_counted
+def loadPlugin(path, **kwargs):
+    """导入插件文件并调用 initializePlugin，插件名称为文件名（不含扩展名）"""
+    import importlib.util
+    name = os.path.splitext(os.path.basename(path))[0]
+    if name in PLUGINS:
+        return [name]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.initializePlugin(name)
+    PLUGINS.setdefault(name, set())
+    return [name]
+
+
+@_counted
+def pluginInfo(name, query=False, loaded=False, **kwargs):
+    if query and loaded:
+        return name in PLUGINS
+    raise NotImplementedError('fake cmds.pluginInfo only supports query=True, loaded=True')
+
+
+@_counted
+def createNode(node_type, name=None, parent=None, skipSelect=False, **kwargs):
+    if name and ':' in name:
+        # 与 Maya 相同：名称中的命名空间必须已经存在（伪场景中即已有节点使用它）
+        namespace = name.rpartition(':')[0]
+        if not any(node.startswith(namespace + ':') for node in SCENE.nodes):
+            raise RuntimeError(f'createNode: namespace {namespace} does not exist')
+    base = name or node_type + '1'
+    name, index = base, 1
+    while name in SCENE.nodes:
+        name = f'{base.rstrip("0123456789")}{index}'
+        index += 1
+    SCENE.create_node(name, node_type, parent)
+    return name
+
+
+@_counted
+def delete(*args, **kwargs):
+    for arg in args:
+        for name in [arg] if isinstance(arg, str) else arg:
+            SCENE.delete(SCENE.find(name).name)
+
+
+@_counted
+def addAttr(node_name, longName=None, attributeType=None, dataType=None, multi=False, defaultValue=None, **kwargs):
+    node = SCENE.find(node_name)
+    node.dynamic[longName] = {'type': attributeType or dataType, 'multi': multi}
+    if defaultValue is not None:
+        node.attrs[longName] = defaultValue
+
+
+@_counted
+def attributeQuery(attr, node=None, exists=False, **kwargs):
+    target = SCENE.find(node)
+    return target is not None and _valid_attr(target, attr)
+
+
+def _plug_key(name):
+    node, attr = _split_plug(name)
+    return node, attr
+
+
+@_counted
+def connectAttr(source, destination, force=False, **kwargs):
+    SCENE.connect(_plug_key(source), _plug_key(destination))
+
+
+@_counted
+def disconnectAttr(source, destination):
+    SCENE.connections.pop(_plug_key(destination), None)
+
+
+@_counted
+def removeMultiInstance(name, b=False):
+    SCENE.connections.pop(_plug_key(name), None)
+
+
+@_counted
+def listConnections(name, source=True, destination=True, plugs=False, **kwargs):
+    node, attr = _split_plug(name)
+    result = []
+    if source:
+        keys = [(node, attr)] if (node, attr) in SCENE.connections else \
+            [(node, f'{attr}[{i}]') for i in SCENE.element_indices(node, attr)]
+        for key in keys:
+            src_node, src_attr = SCENE.connections[key]
+            result.append(f'{src_node.name}.{src_attr}' if plugs else src_node.name)
+    if destination:
+        for (dst_node, dst_attr), (src_node, src_attr) in SCENE.connections.items():
+            if src_node is node and (not attr or src_attr == attr):
+                result.append(f'{dst_node.name}.{dst_attr}' if plugs else dst_node.name)
+    return result or None
+
+
+def _setting(name, flag, kwargs):
+    """查询或修改 SCENE.settings 中的一项"""
+    if _flag(kwargs, 'query', 'q'):
+        return SCENE.settings[name]
+    if flag in kwargs:
+        SCENE.settings[name] = kwargs[flag]
+    return None
+
+
+@_counted
+def refresh(*args, **kwargs):
+    return _setting('refreshSuspended', 'suspend', kwargs)
+
+
+@_counted
+def autoSave(*args, **kwargs):
+    return _setting('autoSave', 'enable', kwargs)
+
+
+@_counted
+def autoKeyframe(*args, **kwargs):
+    return _setting('autoKeyframe', 'state', kwargs)
+
+
+@_counted
+def evaluationManager(*args, **kwargs):
+    value = _setting('evaluationManager', 'mode', kwargs)
+    return [value] if value is not None else None
+
+
+@_counted
+def evaluator(*args, name=None, **kwargs):
+    if name != 'cache':
+        raise RuntimeError(f'fake cmds.evaluator only supports the cache evaluator, not {name}')
+    return _setting('cachedPlayback', 'enable', kwargs)
+
+
+@_counted
+def warning(message):
+    pass
+
+
+@_counted
+def inViewMessage(**kwargs):
+    pass
+
+
+# 界面状态：延迟执行队列、进度窗口和对话框（测试时可修改 cancel_after / dialog_answer / batch）
+INTERFACE = {
+    'deferred': [],        # evalDeferred 排队的回调
+    'progress': None,      # 打开的进度窗口 {'progress', 'status', 'queries'}
+    'cancel_after': None,  # 进度窗口被查询多少次后视为按下 Esc（None 为从不）
+    'dialog_answer': None,  # confirmDialog 的返回值（None 为 dismissString）
+    'batch': False,
+}
+
+
+def process_idle(limit=None):
+    """
+    模拟 Maya 空闲：依次执行 evalDeferred 排队的回调（回调中新排队的也会执行）
+
+    Returns:
+        int: 执行的回调数
+    """
+    count = 0
+    while INTERFACE['deferred'] and (limit is None or count < limit):
+        INTERFACE['deferred'].pop(0)()
+        count += 1
+    return count
+
+
+@_counted
+def evalDeferred(command, lowestPriority=False, **kwargs):
+    INTERFACE['deferred'].append(command)
+
+
+def executeDeferred(command, *args, **kwargs):
+    """maya.utils.executeDeferred：可以从任意线程调用，回调排入空闲队列，由 process_idle 在主线程执行"""
+    INTERFACE['deferred'].append(functools.partial(command, *args, **kwargs) if args or kwargs else command)
+
+
+@_counted
+def progressWindow(*args, **kwargs):
+    window = INTERFACE['progress']
+    if kwargs.get('endProgress'):
+        INTERFACE['progress'] = None
+        return None
+    if _flag(kwargs, 'query', 'q'):
+        if window is None:
+            return False if 'isCancelled' in kwargs else None
+        if 'isCancelled' in kwargs:
+            window['queries'] += 1
+            cancel_after = INTERFACE['cancel_after']
+            return cancel_after is not None and window['queries'] > cancel_after
+        return window.get('progress')
+    if _flag(kwargs, 'edit', 'e'):
+        if window is None:
+            raise RuntimeError('progressWindow: no progress window is open')
+        window.update((k, kwargs[k]) for k in ('progress', 'status') if k in kwargs)
+        return None
+    INTERFACE['progress'] = {'progress': kwargs.get('progress', 0), 'status': kwargs.get('status', ''), 'queries': 0}
+    return True
+
+
+@_counted
+def confirmDialog(**kwargs):
+    answer = INTERFACE['dialog_answer']
+    return answer if answer is not None else kwargs.get('dismissString')
+
+
+@_counted
+def about(*args, **kwargs):
+    if kwargs.get('batch'):
+        return INTERFACE['batch']
+    raise NotImplementedError('fake cmds.about only supports batch=True')
+
+
+@_counted
+def internalVar(**kwargs):
+    return '/tmp/'
+
+
+@_counted
+def file(*args, query=False, sceneName=False, **kwargs):
+    if query and sceneName:
+        return SCENE.scene_name
+    raise NotImplementedError('fake cmds.file only supports query=True, sceneName=True')
+
+
+# ============================================================================
+# 安装 / Install
+# ============================================================================
+
+def new_scene():
+    """清空伪场景"""
+    global SCENE
+    callbacks = SCENE.callbacks
+    SCENE = Scene()
+    SCENE.callbacks = callbacks
+    SCENE._next_callback = max(callbacks, default=0) + 1
+    SCENE._fire('scene0')
+    return SCENE
+
+
+def install():
+    """
+    把伪模块注册到 sys.modules（maya、maya.cmds、maya.api.OpenMaya、maya.api.OpenMayaAnim、maya.utils）
+
+    Returns:
+        Scene: 当前伪场景
+    """
+    this = sys.modules[__name__]
+
+    cmds_module = types.ModuleType('maya.cmds')
+    for name in ('objExists', 'ls', 'select', 'listRelatives', 'getAttr', 'setAttr', 'xform', 'setKeyframe',
+                 'currentTime', 'playbackOptions', 'undoInfo', 'refresh', 'warning', 'inViewMessage',
+                 'internalVar', 'createNode', 'delete', 'addAttr', 'attributeQuery', 'connectAttr',
+                 'disconnectAttr', 'removeMultiInstance', 'listConnections', 'file', 'undo', 'redo',
+                 'loadPlugin', 'pluginInfo', 'autoSave', 'autoKeyframe', 'evaluationManager', 'evaluator',
+                 'evalDeferred', 'progressWindow', 'confirmDialog', 'about'):
+        setattr(cmds_module, name, getattr(this, name))
+
+    om_module = types.ModuleType('maya.api.OpenMaya')
+    for name in ('MSpace', 'MFn', 'MObject', 'MObjectHandle', 'MMatrix', 'MVector', 'MPoint', 'MQuaternion',
+                 'MEulerRotation', 'MTransformationMatrix', 'MTime', 'MTimeArray', 'MDoubleArray', 'MDistance',
+                 'MAngle', 'MDGContext', 'MFnMatrixData', 'MFnUnitAttribute', 'MPlug', 'MSelectionList',
+                 'MDagPath', 'MItDependencyGraph', 'MFnDependencyNode', 'MDGModifier', 'MMessage', 'MNodeMessage',
+                 'MDGMessage', 'MDagMessage', 'MSceneMessage', 'MFnDoubleArrayData', 'MFnStringArrayData', 'MGlobal',
+                 'MSyntax', 'MArgList', 'MArgDatabase', 'MPxCommand', 'MFnPlugin'):
+        setattr(om_module, name, getattr(this, name))
+
+    oma_module = types.ModuleType('maya.api.OpenMayaAnim')
+    oma_module.MFnAnimCurve = MFnAnimCurve
+    oma_module.MAnimCurveChange = MAnimCurveChange
+
+    utils_module = types.ModuleType('maya.utils')
+    utils_module.executeDeferred = executeDeferred
+
+    maya_module = types.ModuleType('maya')
+    api_module = types.ModuleType('maya.api')
+    maya_module.cmds = cmds_module
+    maya_module.api = api_module
+    maya_module.utils = utils_module
+    api_module.OpenMaya = om_module
+    api_module.OpenMayaAnim = oma_module
+
+    sys.modules.update({
+        'maya': maya_module,
+        'maya.cmds': cmds_module,
+        'maya.api': api_module,
+        'maya.api.OpenMaya': om_module,
+        'maya.api.OpenMayaAnim': oma_module,
+        'maya.utils': utils_module,
+    })
+    return SCENE
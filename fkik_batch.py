@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+FK/IK Matching Tool - Batch Scene Processor
+Match or bake FK/IK across many .ma/.mb scenes with a pool of mayapy workers
+
+Usage:
+    python fkik_batch.py --preset hero.json --direction fk_to_ik \
+        --workers 4 --output-dir converted/ "shots/**/*.ma"
+
+Every scene runs in its own mayapy process, so a crash only fails that scene.
+Progress is written to a JSON manifest after each scene; run again with
+--resume to skip the scenes that already succeeded.
+
+Made by niexiongtao
+"""
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# 工作进程输出结果行的前缀 / Prefix of the result line printed by a worker
+RESULT_MARKER = 'FKIK_BATCH_RESULT:'
+
+DIRECTIONS = ('ik_to_fk', 'fk_to_ik')
+SCENE_EXTENSIONS = ('.ma', '.mb')
+
+
+# ============================================================================
+# 工作进程（在 mayapy 中运行）/ Worker (runs inside mayapy)
+# ============================================================================
+
+def run_worker(job):
+    """
+    在 mayapy 中处理单个场景：打开 → 加载预设 → 匹配/烘焙 → 另存
+
+    Args:
+        job: {'scene', 'output', 'preset', 'direction', 'mode', 'start', 'end', 'step'}
+
+    Returns:
+        dict: 处理结果和各步骤耗时
+    """
+    import maya.standalone
+    maya.standalone.initialize(name='python')
+
+    try:
+        import maya.cmds as cmds
+
+        # 工具脚本与本文件位于同一目录
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        if script_dir not in sys.path:
+            sys.path.insert(0, script_dir)
+        import universal_fkik_match as fkik
+
+        result = {'scene': job['scene']}
+
+        time_start = time.perf_counter()
+        cmds.file(job['scene'], open=True, force=True, prompt=False)
+        result['open_time'] = time.perf_counter() - time_start
+
+        matcher = fkik.FKIKMatcher()
+        result['limbs'] = matcher.load_preset(job['preset'])
+
+        time_start = time.perf_counter()
+        if job['mode'] == 'match':
+            plan = matcher.match_all(job['direction'])
+            result['controls'] = len(plan.targets) if plan else 0
+            result['timings'] = plan.timings if plan else {}
+        else:
+            start, end = fkik.get_frame_range()
+            start = job['start'] if job['start'] is not None else start
+            end = job['end'] if job['end'] is not None else end
+            stats = matcher.bake(start, end, job['direction'], step=job['step'], fast=True) or {}
+            stats.pop('writer', None)
+            report = stats.pop('fast_bake', None)
+            if report is not None:
+                result['fast_bake'] = report.changes
+            result.update(stats)
+        result['match_time'] = time.perf_counter() - time_start
+
+        time_start = time.perf_counter()
+        output = job['output']
+        file_type = 'mayaBinary' if output.lower().endswith('.mb') else 'mayaAscii'
+        cmds.file(rename=output)
+        cmds.file(save=True, force=True, type=file_type)
+        result['save_time'] = time.perf_counter() - time_start
+        result['output'] = output
+        return result
+    finally:
+        maya.standalone.uninitialize()
+
+
+def worker_main(job_json):
+    """工作进程入口：执行任务并在标准输出打印一行结果"""
+    job = json.loads(job_json)
+    try:
+        result = run_worker(job)
+        result['status'] = 'ok'
+    except Exception as e:
+        result = {'scene': job.get('scene'), 'status': 'failed', 'error': f'{type(e).__name__}: {e}'}
+    sys.stdout.write(RESULT_MARKER + json.dumps(result) + '\n')
+    sys.stdout.flush()
+    return 0 if result['status'] == 'ok' else 1
+
+
+# ============================================================================
+# 调度进程 / Controller
+# ============================================================================
+
+def glob_root(pattern):
+    """通配符之前的目录部分（例如 "shots/**/*.ma" 为 shots），普通路径为所在目录"""
+    parts = []
+    for part in os.path.normpath(pattern).split(os.sep)[:-1]:
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return os.path.abspath(os.sep.join(parts) or os.curdir)
+
+
+def expand_scenes(patterns):
+    """
+    展开场景列表和通配符（支持 **），保持顺序并去重
+
+    Returns:
+        list: [(场景路径, 根目录)]，根目录为匹配它的通配符的 glob_root（--output-dir 下保留相对路径）
+    """
+    scenes = []
+    seen = set()
+    for pattern in patterns:
+        root = glob_root(pattern)
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        for path in matches:
+            path = os.path.abspath(path)
+            if path.lower().endswith(SCENE_EXTENSIONS) and path not in seen:
+                seen.add(path)
+                scenes.append((path, root))
+    return scenes
+
+
+def output_path(scene, output_dir=None, suffix='_fkik', root=None):
+    """
+    计算输出场景路径：指定目录时保持相对于 root（通配符的根目录）的路径，否则在原目录加后缀
+
+    例如 "shots/**/*.ma" 匹配的 shots/sh010/anim.ma 输出到 <output_dir>/sh010/anim.ma
+    """
+    if output_dir:
+        relative = os.path.relpath(scene, root) if root else os.path.basename(scene)
+        return os.path.join(os.path.abspath(output_dir), relative)
+    stem, ext = os.path.splitext(scene)
+    return f'{stem}{suffix}{ext}'
+
+
+def duplicate_outputs(jobs):
+    """多个场景写入同一个输出文件时返回 {输出路径: [场景]}（并行时会互相覆盖）"""
+    outputs = {}
+    for job in jobs:
+        outputs.setdefault(os.path.normcase(job['output']), []).append(job['scene'])
+    return {output: scenes for output, scenes in outputs.items() if len(scenes) > 1}
+
+
+def find_mayapy(explicit=None):
+    """mayapy 路径：命令行参数 > MAYAPY 环境变量 > PATH 中的 mayapy"""
+    return explicit or os.environ.get('MAYAPY') or 'mayapy'
+
+
+class Manifest:
+    """
+    批处理清单：每个场景的状态、耗时和错误
+
+    每完成一个场景就原子地写回磁盘，中途崩溃后可以用 --resume 继续。
+    每个条目记录处理时的设置，设置（预设、方向、帧范围等）改变后不会被当作已完成
+    """
+
+    def __init__(self, path, settings):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = {'settings': settings, 'scenes': {}}
+        self.previous_settings = None  # 旧版本清单的条目没有设置，使用清单的设置
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.data['scenes'] = data.get('scenes', {})
+            self.previous_settings = data.get('settings')
+
+    def is_done(self, scene, output=None):
+        """场景已经用当前设置成功处理过（输出文件存在，output 不为 None 时还要求输出路径相同）"""
+        entry = self.data['scenes'].get(scene)
+        if not entry or entry.get('status') != 'ok' or not os.path.exists(entry.get('output', '')):
+            return False
+        if output is not None and os.path.normcase(entry['output']) != os.path.normcase(output):
+            return False
+        return entry.get('settings', self.previous_settings) == self.data['settings']
+
+    def record(self, scene, entry):
+        with self.lock:
+            self.data['scenes'][scene] = dict(entry, settings=self.data['settings'])
+            self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        self.data['updated'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=2, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+
+    def summary(self):
+        statuses = [entry.get('status') for entry in self.data['scenes'].values()]
+        return {status: statuses.count(status) for status in set(statuses)}
+
+
+def run_scene(mayapy, job, timeout=None):
+    """在独立的 mayapy 进程中处理一个场景，返回清单条目"""
+    command = [mayapy, os.path.abspath(__file__), '--worker', json.dumps(job)]
+    time_start = time.perf_counter()
+    try:
+        process = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {'status': 'failed', 'error': f'timeout after {timeout}s', 'elapsed': time.perf_counter() - time_start}
+    except OSError as e:
+        return {'status': 'failed', 'error': f'cannot start {mayapy}: {e}', 'elapsed': time.perf_counter() - time_start}
+    elapsed = time.perf_counter() - time_start
+
+    result = None
+    for line in process.stdout.splitlines():
+        if line.startswith(RESULT_MARKER):
+            result = json.loads(line[len(RESULT_MARKER):])
+
+    if result is None:
+        # 进程在打印结果前崩溃
+        stderr_tail = process.stderr.strip().splitlines()[-5:]
+        result = {'status': 'failed', 'error': '\n'.join(stderr_tail) or 'worker exited without a result'}
+
+    result['returncode'] = process.returncode
+    result['elapsed'] = elapsed
+    return result
+
+
+def run_batch(args):
+    """调度所有场景到 mayapy 进程池"""
+    scenes = expand_scenes(args.scenes)
+    if not scenes:
+        print('No .ma/.mb scenes matched.', file=sys.stderr)
+        return 2
+
+    settings = {
+        'preset': os.path.abspath(args.preset),
+        'direction': args.direction,
+        'mode': args.mode,
+        'start': args.start,
+        'end': args.end,
+        'step': args.step,
+    }
+    manifest = Manifest(args.manifest, settings)
+
+    jobs = [
+        dict(settings, scene=scene, output=output_path(scene, args.output_dir, args.suffix, root))
+        for scene, root in scenes
+    ]
+    duplicates = duplicate_outputs(jobs)
+    if duplicates:
+        for output, sources in duplicates.items():
+            print(f'{len(sources)} scenes would be saved to {output}: {", ".join(sources)}', file=sys.stderr)
+        return 2
+    jobs = [job for job in jobs if not (args.resume and manifest.is_done(job['scene'], job['output']))]
+
+    skipped = len(scenes) - len(jobs)
+    print(f'{len(jobs)} scene(s) to process, {skipped} already done, {args.workers} worker(s)')
+    for output_dir in {os.path.dirname(job['output']) for job in jobs}:
+        os.makedirs(output_dir, exist_ok=True)
+
+    mayapy = find_mayapy(args.mayapy)
+    time_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(run_scene, mayapy, job, args.timeout): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            entry = future.result()
+            entry.setdefault('output', job['output'])
+            manifest.record(job['scene'], entry)
+            message = entry.get('error', '').splitlines()[-1:] if entry['status'] != 'ok' else []
+            print(f'[{entry["status"]}] {job["scene"]} ({entry["elapsed"]:.1f}s) {" ".join(message)}'.rstrip())
+
+    manifest.data['total_time'] = time.perf_counter() - time_start
+    manifest.save()
+    summary = manifest.summary()
+    print(f'Done in {manifest.data["total_time"]:.1f}s: {summary}')
+    return 0 if not summary.get('failed') else 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Batch FK/IK match/bake across Maya scenes with mayapy workers.')
+    parser.add_argument('scenes', nargs='+', help='scene files or glob patterns (** supported)')
+    parser.add_argument('--preset', required=True, help='limb preset JSON written by Save All Limbs')
+    parser.add_argument('--direction', choices=DIRECTIONS, required=True)
+    parser.add_argument('--mode', choices=('bake', 'match'), default='bake',
+                        help='bake a frame range (default) or match the current frame only')
+    parser.add_argument('--start', type=int, help='first frame (default: scene playback start)')
+    parser.add_argument('--end', type=int, help='last frame (default: scene playback end)')
+    parser.add_argument('--step', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument('--mayapy', help='path to mayapy (default: $MAYAPY or mayapy on PATH)')
+    parser.add_argument('--output-dir', help='save results here, keeping paths relative to each glob root')
+    parser.add_argument('--suffix', default='_fkik', help='suffix for results saved next to the source scene')
+    parser.add_argument('--manifest', default='fkik_batch_manifest.json', help='JSON manifest of per-scene results')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip scenes the manifest marks as done with the same settings and output')
+    parser.add_argument('--timeout', type=float, help='seconds before a scene is killed and marked failed')
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['--worker']:
+        return worker_main(argv[1])
+    return run_batch(build_parser().parse_args(argv))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+FK/IK Matching Tool - Matrix Cache
+On-disk cache of sampled world matrices stored as memory-mapped .npy files
+
+Each entry is one float64 array in its own .npy file, opened read-only with
+np.load(mmap_mode='r') so readers never copy it into memory. Entries are found
+through small key files that contain the name of the data file. Several keys
+can point at the same data (aliases). Callers build keys from everything the
+samples depend on (scene, frames, a hash of the upstream animation curves), so
+a changed source produces a new key and stale data is never read.
+
+Total disk use is capped by least-recently-used eviction. Opening an entry
+touches its data file, and the oldest files are deleted first.
+
+No central index is kept, so several mayapy workers can share one directory.
+
+Independent of Maya.
+
+Made by niexiongtao
+"""
+
+import glob
+import hashlib
+import os
+import time
+import uuid
+
+import numpy as np
+
+# 默认磁盘上限 / Default disk budget
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+_DATA_SUFFIX = '.npy'
+_KEY_SUFFIX = '.key'
+
+# 没有被任何键引用的数据文件（写入中断）超过该时间后清理
+_ORPHAN_AGE = 24 * 3600.0
+
+
+def make_key(*parts):
+    """由任意可 repr 的部分生成缓存键"""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+class MatrixCache:
+    """
+    内存映射的矩阵缓存
+
+    用法:
+        array = cache.open(key)                 # 命中：只读 memmap；未命中：None
+        array = cache.create(shape)             # 新建可写 memmap，原地填充
+        cache.publish(key, array)               # 填充完成后登记键，并按需淘汰
+        cache.alias(key, new_key)               # 同一份数据登记到另一个键
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, *parts):
+        """生成缓存键，参见 make_key"""
+        return make_key(*parts)
+
+    def _key_path(self, key):
+        return os.path.join(self.directory, key + _KEY_SUFFIX)
+
+    def _resolve(self, key):
+        """键对应的数据文件路径，不存在时返回 None（并删除失效的键）"""
+        key_path = self._key_path(key)
+        try:
+            with open(key_path, 'r', encoding='utf-8') as f:
+                data_path = os.path.join(self.directory, f.read().strip())
+        except OSError:
+            return None
+        if not os.path.exists(data_path):
+            _remove(key_path)
+            return None
+        return data_path
+
+    def _write_key(self, key, data_path):
+        """原子地写入键文件"""
+        key_path = self._key_path(key)
+        temp_path = f'{key_path}.{uuid.uuid4().hex}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(os.path.basename(data_path))
+        os.replace(temp_path, key_path)
+
+    # ============ 读写 ============
+
+    def open(self, key):
+        """
+        只读打开缓存条目（零拷贝）
+
+        Returns:
+            np.memmap 或 None（未命中或文件损坏）
+        """
+        data_path = self._resolve(key)
+        if data_path is None:
+            return None
+        try:
+            array = np.load(data_path, mmap_mode='r')
+        except (OSError, ValueError):
+            _remove(data_path)
+            return None
+        # 修改时间作为最近使用时间
+        try:
+            os.utime(data_path)
+        except OSError:
+            pass
+        return array
+
+    def create(self, shape):
+        """新建可写的 float64 memmap，填充完成后调用 publish 登记"""
+        os.makedirs(self.directory, exist_ok=True)
+        data_path = os.path.join(self.directory, uuid.uuid4().hex + _DATA_SUFFIX)
+        return np.lib.format.open_memmap(data_path, mode='w+', dtype=np.float64, shape=tuple(shape))
+
+    def publish(self, key, array):
+        """把填充完成的 memmap 登记到键，然后淘汰超出上限的旧条目"""
+        array.flush()
+        self._write_key(key, array.filename)
+        self.evict()
+
+    def alias(self, key, new_key):
+        """把已有条目登记到另一个键（源数据没有变化时复用采样）"""
+        if key == new_key:
+            return True
+        data_path = self._resolve(key)
+        if data_path is None:
+            return False
+        self._write_key(new_key, data_path)
+        return True
+
+    # ============ 容量管理 ============
+
+    def _data_files(self):
+        files = []
+        for path in glob.glob(os.path.join(self.directory, '*' + _DATA_SUFFIX)):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def size(self):
+        """缓存占用的磁盘空间（字节）"""
+        return sum(size for mtime, size, path in self._data_files())
+
+    def evict(self, max_bytes=None):
+        """
+        按最近使用时间淘汰数据文件，直到总大小不超过上限
+
+        Returns:
+            int: 删除的文件数
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        files = sorted(self._data_files())
+        total = sum(size for mtime, size, path in files)
+        now = time.time()
+        # 只有超出上限或存在很旧的文件时才需要读取所有键文件
+        if total <= max_bytes and not any(now - mtime > _ORPHAN_AGE for mtime, size, path in files):
+            return 0
+        referenced = self._referenced()
+        removed = 0
+        for mtime, size, path in files:
+            orphan = os.path.basename(path) not in referenced and now - mtime > _ORPHAN_AGE
+            if total <= max_bytes and not orphan:
+                continue
+            # 其他进程仍然映射着文件时（Windows）删除会失败，跳过
+            if _remove(path):
+                total -= size
+                removed += 1
+        if removed:
+            self._remove_dangling_keys()
+        return removed
+
+    def clear(self):
+        """删除所有缓存条目"""
+        self.evict(max_bytes=0)
+        self._remove_dangling_keys()
+
+    def _key_files(self):
+        return glob.glob(os.path.join(self.directory, '*' + _KEY_SUFFIX))
+
+    def _referenced(self):
+        names = set()
+        for key_path in self._key_files():
+            try:
+                with open(key_path, 'r', encoding='utf-8') as f:
+                    names.add(f.read().strip())
+            except OSError:
+                continue
+        return names
+
+    def _remove_dangling_keys(self):
+        for key_path in self._key_files():
+            self._resolve(os.path.basename(key_path)[:-len(_KEY_SUFFIX)])
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+"""
+FK/IK Matching Tool - Vectorized Math Kernel
+Pure NumPy versions of the matching math, independent of Maya
+
+All matrices follow Maya's row-vector convention: an (N, 4, 4) array where
+element [n, r, c] equals MMatrix.getElement(r, c) and the translation lives
+in row 3. Quaternions are (N, 4) arrays ordered [x, y, z, w].
+
+Made by niexiongtao
+"""
+
+import numpy as np
+
+# 与 Maya rotateOrder 枚举一致 / Same order as Maya's rotateOrder enum
+ROTATE_ORDERS = ('xyz', 'yzx', 'zxy', 'xzy', 'yxz', 'zyx')
+
+_AXIS_INDEX = {'x': 0, 'y': 1, 'z': 2}
+_EPSILON = 1e-12
+
+
+# ============================================================================
+# 数组转换 / Array Conversion
+# ============================================================================
+
+def as_matrix_array(values):
+    """
+    转换为 (N, 4, 4) float64 数组
+
+    接受单个矩阵、16个浮点数的序列，或它们的列表
+    """
+    m = np.asarray(values, dtype=np.float64)
+    if m.shape[-2:] != (4, 4):
+        m = m.reshape(-1, 4, 4)
+    return m.reshape(-1, 4, 4)
+
+
+def as_vector_array(values):
+    """转换为 (N, 3) float64 数组"""
+    return np.asarray(values, dtype=np.float64).reshape(-1, 3)
+
+
+def buffer_rows(buffer, width):
+    """连续的 float64 缓冲区（例如 array('d')）零拷贝地看作 (N, width) 数组，写入直接修改缓冲区"""
+    return np.frombuffer(buffer, dtype=np.float64).reshape(-1, width)
+
+
+def matrix_buffer(count):
+    """预先分配的 (count, 16) float64 采样缓冲区（逐帧原地填充，reshape 为 (count, 4, 4) 不复制）"""
+    return np.empty((count, 16), dtype=np.float64)
+
+
+def vector_buffer(count):
+    """预先分配的 (count, 3) float64 采样缓冲区"""
+    return np.empty((count, 3), dtype=np.float64)
+
+
+def stack_rows(arrays):
+    """沿第一维拼接多个数组（多个目标的采样合成一批计算）；只有一个时不复制"""
+    return arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+
+
+def repeat_rows(rows, count):
+    """每行重复 count 次：[(k,)] × count → (len(rows) × count, k)，用于逐目标的常量（例如旋转偏移）"""
+    rows = np.asarray(rows, dtype=np.float64).reshape(len(rows), -1)
+    return rows if count == 1 else np.repeat(rows, count, axis=0)
+
+
+def translations(m):
+    """世界矩阵 → (N, 3) 位置"""
+    return as_matrix_array(m)[:, 3, :3].copy()
+
+
+def transform_points(points, m):
+    """点 × 矩阵（行向量），返回 (N, 3)"""
+    m = as_matrix_array(m)
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    return np.einsum('ni,nij->nj', points, m[:, :3, :3]) + m[:, 3, :3]
+
+
+def transform_vectors(vectors, m):
+    """向量 × 矩阵（忽略位移），返回 (N, 3)"""
+    m = as_matrix_array(m)
+    vectors = np.asarray(vectors, dtype=np.float64).reshape(-1, 3)
+    return np.einsum('ni,nij->nj', vectors, m[:, :3, :3])
+
+
+def matrix_product(*matrices):
+    """依次相乘多个 (N, 4, 4) 或 (1, 4, 4) 矩阵数组（行向量约定，从左到右）"""
+    result = as_matrix_array(matrices[0])
+    for m in matrices[1:]:
+        result = np.matmul(result, as_matrix_array(m))
+    return result
+
+
+def inverse_matrices(m):
+    """批量求逆"""
+    return np.linalg.inv(as_matrix_array(m))
+
+
+def local_matrices(world_m, parent_m):
+    """局部矩阵 = 世界矩阵 × 父级逆矩阵"""
+    return np.matmul(as_matrix_array(world_m), np.linalg.inv(as_matrix_array(parent_m)))
+
+
+def matrix_scales(m):
+    """每个矩阵三个轴的缩放，返回 (N, 3)"""
+    return np.linalg.norm(as_matrix_array(m)[:, :3, :3], axis=2)
+
+
+def compose_matrices(quats, translation, scales=None):
+    """由旋转、位移（和缩放）组合 (N, 4, 4) 矩阵（缩放 → 旋转 → 位移）"""
+    rotation = quaternions_to_matrices(quats)
+    n = rotation.shape[0]
+    m = np.zeros((n, 4, 4))
+    if scales is not None:
+        rotation = rotation * np.asarray(scales, dtype=np.float64).reshape(-1, 3, 1)
+    m[:, :3, :3] = rotation
+    m[:, 3, :3] = np.asarray(translation, dtype=np.float64).reshape(-1, 3)
+    m[:, 3, 3] = 1.0
+    return m
+
+
+# ============================================================================
+# 极向量 / Pole Vector
+# ============================================================================
+
+def pole_vector_positions(start_m, mid_m, end_m, distance=1.0):
+    """
+    批量计算极向量位置（与 calculate_pole_vector_position 相同的算法）
+
+    Args:
+        start_m, mid_m, end_m: 根部/中间/末端骨骼的 (N, 4, 4) 世界矩阵
+        distance: 与肢体长度一半的倍数
+
+    Returns:
+        (N, 3) 极向量世界位置
+    """
+    start = translations(start_m)
+    mid = translations(mid_m)
+    end = translations(end_m)
+
+    start_end = end - start
+    start_mid = mid - start
+    length = np.linalg.norm(start_end, axis=1)
+    length_sq = np.einsum('ij,ij->i', start_end, start_end)
+
+    ratio = np.einsum('ij,ij->i', start_mid, start_end) / np.where(length_sq > _EPSILON, length_sq, 1.0)
+    projection = start + start_end * ratio[:, None]
+    direction = mid - projection
+
+    direction_length = np.linalg.norm(direction, axis=1)
+    flat = direction_length < 0.001
+    direction = np.where(flat[:, None], [0.0, 0.0, 1.0], direction / np.where(flat, 1.0, direction_length)[:, None])
+
+    positions = mid + direction * (distance * length * 0.5)[:, None]
+    # 根部与末端重合时直接使用中间骨骼位置
+    return np.where((length < 0.001)[:, None], mid, positions)
+
+
+# ============================================================================
+# 四元数 / Quaternions
+# ============================================================================
+
+def matrices_to_quaternions(m):
+    """
+    (N, 4, 4) 矩阵 → (N, 4) 四元数 [x, y, z, w]
+
+    先去除每个轴的缩放，结果与 MTransformationMatrix.rotation(asQuaternion=True) 一致
+    """
+    r = as_matrix_array(m)[:, :3, :3]
+    r = r / np.linalg.norm(r, axis=2, keepdims=True)
+
+    m00, m01, m02 = r[:, 0, 0], r[:, 0, 1], r[:, 0, 2]
+    m10, m11, m12 = r[:, 1, 0], r[:, 1, 1], r[:, 1, 2]
+    m20, m21, m22 = r[:, 2, 0], r[:, 2, 1], r[:, 2, 2]
+    trace = m00 + m11 + m22
+
+    # Shepperd 方法：按最大的对角分量选择数值稳定的分支
+    candidates = np.stack([
+        np.stack([m12 - m21, m20 - m02, m01 - m10, 1.0 + trace], axis=1),
+        np.stack([1.0 + m00 - m11 - m22, m01 + m10, m20 + m02, m12 - m21], axis=1),
+        np.stack([m01 + m10, 1.0 - m00 + m11 - m22, m12 + m21, m20 - m02], axis=1),
+        np.stack([m20 + m02, m12 + m21, 1.0 - m00 - m11 + m22, m01 - m10], axis=1),
+    ], axis=1)
+    choice = np.argmax(np.stack([trace, m00, m11, m22], axis=1), axis=1)
+    q = candidates[np.arange(len(choice)), choice]
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+
+    # 统一 w >= 0
+    return np.where(q[:, 3:4] < 0.0, -q, q)
+
+
+def quaternions_to_matrices(q):
+    """(N, 4) 四元数 → (N, 3, 3) 旋转矩阵（行向量约定）"""
+    q = np.asarray(q, dtype=np.float64).reshape(-1, 4)
+    q = q / np.linalg.norm(q, axis=1, keepdims=True)
+    x, y, z, w = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+
+    m = np.empty((q.shape[0], 3, 3))
+    m[:, 0, 0] = 1.0 - 2.0 * (y * y + z * z)
+    m[:, 0, 1] = 2.0 * (x * y + z * w)
+    m[:, 0, 2] = 2.0 * (x * z - y * w)
+    m[:, 1, 0] = 2.0 * (x * y - z * w)
+    m[:, 1, 1] = 1.0 - 2.0 * (x * x + z * z)
+    m[:, 1, 2] = 2.0 * (y * z + x * w)
+    m[:, 2, 0] = 2.0 * (x * z + y * w)
+    m[:, 2, 1] = 2.0 * (y * z - x * w)
+    m[:, 2, 2] = 1.0 - 2.0 * (x * x + y * y)
+    return m
+
+
+def quat_multiply(a, b):
+    """
+    四元数乘法，与 om2.MQuaternion 的 a * b 相同
+
+    对应矩阵乘法 a × b（行向量约定：先应用 a，再应用 b）
+    """
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    ax, ay, az, aw = a[:, 0], a[:, 1], a[:, 2], a[:, 3]
+    bx, by, bz, bw = b[:, 0], b[:, 1], b[:, 2], b[:, 3]
+    return np.stack([
+        bw * ax + bx * aw + by * az - bz * ay,
+        bw * ay - bx * az + by * aw + bz * ax,
+        bw * az + bx * ay - by * ax + bz * aw,
+        bw * aw - bx * ax - by * ay - bz * az,
+    ], axis=1)
+
+
+def quat_inverse(q):
+    """四元数的逆"""
+    q = np.asarray(q, dtype=np.float64).reshape(-1, 4)
+    conjugate = q * np.array([-1.0, -1.0, -1.0, 1.0])
+    return conjugate / np.einsum('ij,ij->i', q, q)[:, None]
+
+
+def offset_quaternions(ik_m, blend_m):
+    """
+    校准偏移: offset = IK_quat × Blend_quat⁻¹（与 calibrate_all_limbs 相同）
+
+    Returns:
+        (N, 4) 偏移四元数
+    """
+    return quat_multiply(matrices_to_quaternions(ik_m), quat_inverse(matrices_to_quaternions(blend_m)))
+
+
+def apply_rotation_offset(offset, blend_m):
+    """
+    应用偏移: IK_quat = Offset_quat × Blend_quat（与 match_rotation_with_offset 相同）
+
+    Args:
+        offset: (4,) 或 (N, 4) 偏移四元数；为 None 时直接返回 Blend 旋转
+        blend_m: (N, 4, 4) Blend 骨骼世界矩阵
+    """
+    blend_q = matrices_to_quaternions(blend_m)
+    if offset is None:
+        return blend_q
+    offset = np.broadcast_to(np.asarray(offset, dtype=np.float64).reshape(-1, 4), blend_q.shape)
+    return quat_multiply(offset, blend_q)
+
+
+def local_quaternions(world_q, parent_m):
+    """局部旋转 = 父级逆 × 世界旋转（与 match_rotation_with_offset 相同）"""
+    return quat_multiply(quat_inverse(matrices_to_quaternions(parent_m)), world_q)
+
+
+# ============================================================================
+# 欧拉角 / Euler Angles
+# ============================================================================
+
+def quaternions_to_euler(q, rotate_order=0):
+    """
+    (N, 4) 四元数 → (N, 3) 欧拉角（弧度），按 Maya 旋转顺序分解
+
+    Args:
+        rotate_order: 0-5（Maya rotateOrder 枚举）或 'xyz' 等字符串
+
+    Returns:
+        (N, 3) 数组，列依次为 X/Y/Z 轴的旋转
+    """
+    if not isinstance(rotate_order, str):
+        rotate_order = ROTATE_ORDERS[int(rotate_order)]
+    i, j, k = (_AXIS_INDEX[axis] for axis in rotate_order)
+    odd = rotate_order not in ('xyz', 'yzx', 'zxy')
+
+    # 列向量约定的旋转矩阵: R = Rk × Rj × Ri
+    r = np.swapaxes(quaternions_to_matrices(q), 1, 2)
+    cy = np.hypot(r[:, i, i], r[:, j, i])
+    regular = cy > 1e-9
+
+    angle_i = np.where(regular, np.arctan2(r[:, k, j], r[:, k, k]), np.arctan2(-r[:, j, k], r[:, j, j]))
+    angle_j = np.arctan2(-r[:, k, i], cy)
+    angle_k = np.where(regular, np.arctan2(r[:, j, i], r[:, i, i]), 0.0)
+    if odd:
+        angle_i, angle_j, angle_k = -angle_i, -angle_j, -angle_k
+
+    euler = np.empty((r.shape[0], 3))
+    euler[:, i] = angle_i
+    euler[:, j] = angle_j
+    euler[:, k] = angle_k
+    return euler
+
+
+def euler_to_quaternions(euler, rotate_order=0):
+    """(N, 3) 欧拉角（弧度）→ (N, 4) 四元数，按 Maya 旋转顺序组合"""
+    if not isinstance(rotate_order, str):
+        rotate_order = ROTATE_ORDERS[int(rotate_order)]
+    euler = np.asarray(euler, dtype=np.float64).reshape(-1, 3)
+
+    result = None
+    for axis in rotate_order:
+        index = _AXIS_INDEX[axis]
+        half = euler[:, index] * 0.5
+        q = np.zeros((euler.shape[0], 4))
+        q[:, index] = np.sin(half)
+        q[:, 3] = np.cos(half)
+        result = q if result is None else quat_multiply(result, q)
+    return result
+
+
+def alternate_euler(euler, rotate_order=0):
+    """
+    等价的另一组欧拉角（与 MEulerRotation.alternateSolution 相同）：
+    旋转顺序的第一、三个轴 +π，中间的轴取 π − 角度
+    """
+    if not isinstance(rotate_order, str):
+        rotate_order = ROTATE_ORDERS[int(rotate_order)]
+    i, j, k = (_AXIS_INDEX[axis] for axis in rotate_order)
+    alternate = np.array(euler, dtype=np.float64)
+    alternate[..., i] += np.pi
+    alternate[..., j] = np.pi - alternate[..., j]
+    alternate[..., k] += np.pi
+    return alternate
+
+
+def euler_distances(a, b):
+    """各通道差值折算到 [-π, π] 后的绝对值之和（closestSolution 的比较标准）"""
+    return np.abs(np.remainder(a - b + np.pi, 2.0 * np.pi) - np.pi).sum(axis=-1)
+
+
+def unwrap_euler(euler, segments=1, rotate_order=0):
+    """
+    沿帧方向保持欧拉角连续（逐帧烘焙时曲线不翻转、不跳变），结果与逐帧 closestSolution 相同
+
+    先在两组等价解之间选择：某帧的另一组解离上一帧更近时切换。两组解互换时相邻帧的距离不变，
+    所以是否切换只取决于相邻两帧的分解结果，按累计切换次数的奇偶选择即可向量化；
+    然后去除 ±360° 跳变。
+    segments 大于 1 时 euler 为多个等长片段（每个目标一段）首尾相接，各片段分别处理
+    """
+    euler = np.asarray(euler, dtype=np.float64).reshape(segments, -1, 3)
+    alternate = alternate_euler(euler, rotate_order)
+    flips = euler_distances(alternate[:, 1:], euler[:, :-1]) < euler_distances(euler[:, 1:], euler[:, :-1])
+    use_alternate = np.zeros(euler.shape[:2], dtype=bool)
+    use_alternate[:, 1:] = np.cumsum(flips, axis=1) % 2 == 1
+    euler = np.where(use_alternate[..., None], alternate, euler)
+    return np.unwrap(euler, axis=1).reshape(-1, 3)
+
+
+# ============================================================================
+# 残差 / Residuals
+# ============================================================================
+
+def distances(a, b):
+    """两组点之间的距离，返回 (N,)"""
+    return np.linalg.norm(as_vector_array(a) - as_vector_array(b), axis=1)
+
+
+def quaternion_angles(a, b):
+    """
+    两组旋转之间的夹角（弧度），返回 (N,)
+
+    用 atan2 计算相对旋转的角度，接近 0 时比 arccos(|a·b|) 精确
+    """
+    relative = quat_multiply(quat_inverse(a), b)
+    return 2.0 * np.arctan2(np.linalg.norm(relative[:, :3], axis=1), np.abs(relative[:, 3]))
+
+
+def pole_plane_angles(start_m, mid_m, end_m, pole_positions):
+    """
+    极向量平面与肢体平面的夹角（弧度），返回 (N,)
+
+    两个平面都经过根部到末端的轴：肢体平面由中间骨骼确定，极向量平面由极向量位置确定。
+    夹角为 0 表示 IK 解算会得到与 Blend 骨骼相同的弯曲方向，接近 π 表示翻转。
+    肢体伸直（中间骨骼在轴上）时平面没有定义，返回 0
+    """
+    start = translations(start_m)
+    axis = translations(end_m) - start
+    axis /= np.maximum(np.linalg.norm(axis, axis=1), _EPSILON)[:, None]
+
+    def reject(points):
+        offset = as_vector_array(points) - start
+        return offset - axis * np.einsum('ij,ij->i', offset, axis)[:, None]
+
+    bend = reject(translations(mid_m))
+    pole = reject(pole_positions)
+    defined = (np.linalg.norm(bend, axis=1) > 0.001) & (np.linalg.norm(pole, axis=1) > 0.001)
+    angles = np.arctan2(np.linalg.norm(np.cross(bend, pole), axis=1), np.einsum('ij,ij->i', bend, pole))
+    return np.where(defined, angles, 0.0)
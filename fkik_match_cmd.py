@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+FK/IK Matching Tool - API Command Plugin
+fkikMatch: match, bake or match switch points as one undoable command
+
+Usage:
+    cmds.loadPlugin(r'C:\\Users\\YourName\\Documents\\maya\\scripts\\fkik_match_cmd.py')
+    cmds.fkikMatch(direction='ik_to_fk')                        # current frame, all limbs
+    cmds.fkikMatch(direction='ik_to_fk', key=True)              # ... and key the matched channels
+    cmds.fkikMatch(direction='fk_to_ik', start=1, end=240)      # bake a frame range
+    cmds.fkikMatch(direction='fk_to_ik', start=1, end=240, fast=True)   # ... inside fast_bake
+    cmds.fkikMatch(switches=True, start=1, end=240, limb=['L_Arm', 'R_Arm'])
+    cmds.fkikMatch(service=True)        # run the pending fkik_service batch (issued by the service)
+    cmds.fkikMatch(task=True)           # register a finished background task (issued by the window)
+
+Every attribute value and key the command writes is recorded in one
+MDGModifier and one MAnimCurveChange (AnimCurveWriter). The whole operation
+is therefore a single entry in the undo queue. Undo and redo replay those
+two objects instead of thousands of setAttr/setKeyframe records.
+
+Limbs come from the open FK/IK Matching window, or from the scene storage
+nodes when the window is closed. The result is the number of keys written
+(controls matched for a current-frame match).
+
+Made by niexiongtao
+"""
+
+import maya.api.OpenMaya as om2
+
+import universal_fkik_match as fkik
+
+# 标志 / Flags
+FLAG_DIRECTION = ('-d', '-direction')
+FLAG_LIMB = ('-l', '-limb')
+FLAG_START = ('-s', '-start')
+FLAG_END = ('-e', '-end')
+FLAG_STEP = ('-st', '-step')
+FLAG_INCREMENTAL = ('-i', '-incremental')
+FLAG_KEY = ('-k', '-key')
+FLAG_SWITCHES = ('-sw', '-switches')
+FLAG_FAST = ('-f', '-fast')
+FLAG_SERVICE = ('-sv', '-service')
+FLAG_TASK = ('-tk', '-task')
+
+DIRECTIONS = (fkik.BAKE_IK_TO_FK, fkik.BAKE_FK_TO_IK)
+
+
+def maya_useNewAPI():
+    """使用 Maya Python API 2.0"""
+    pass
+
+
+class FKIKMatchCommand(om2.MPxCommand):
+    """
+    fkikMatch 命令
+
+    doIt 解析参数并执行匹配/烘焙，所有修改记录在一个 AnimCurveWriter 中；
+    undoIt / redoIt 只回放这一个 writer。
+    被约束或动画层驱动的属性仍然通过 setKeyframe 打Key（见 AnimCurveWriter），不在 writer 中
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.writer = None
+
+    @staticmethod
+    def creator():
+        return FKIKMatchCommand()
+
+    @staticmethod
+    def create_syntax():
+        syntax = om2.MSyntax()
+        syntax.addFlag(*FLAG_DIRECTION, om2.MSyntax.kString)
+        syntax.addFlag(*FLAG_LIMB, om2.MSyntax.kString)
+        syntax.makeFlagMultiUse(FLAG_LIMB[0])
+        syntax.addFlag(*FLAG_START, om2.MSyntax.kDouble)
+        syntax.addFlag(*FLAG_END, om2.MSyntax.kDouble)
+        syntax.addFlag(*FLAG_STEP, om2.MSyntax.kLong)
+        syntax.addFlag(*FLAG_INCREMENTAL, om2.MSyntax.kBoolean)
+        syntax.addFlag(*FLAG_KEY, om2.MSyntax.kBoolean)
+        syntax.addFlag(*FLAG_SWITCHES, om2.MSyntax.kBoolean)
+        syntax.addFlag(*FLAG_FAST, om2.MSyntax.kBoolean)
+        syntax.addFlag(*FLAG_SERVICE, om2.MSyntax.kBoolean)
+        syntax.addFlag(*FLAG_TASK, om2.MSyntax.kBoolean)
+        return syntax
+
+    def doIt(self, args):
+        database = om2.MArgDatabase(self.syntax(), args)
+
+        def flag_value(flag, read, default=None):
+            return read(flag[0], 0) if database.isFlagSet(flag[0]) else default
+
+        direction = flag_value(FLAG_DIRECTION, database.flagArgumentString)
+        start = flag_value(FLAG_START, database.flagArgumentDouble)
+        end = flag_value(FLAG_END, database.flagArgumentDouble, start)
+        step = flag_value(FLAG_STEP, database.flagArgumentInt, 1)
+        incremental = flag_value(FLAG_INCREMENTAL, database.flagArgumentBool, False)
+        key = flag_value(FLAG_KEY, database.flagArgumentBool, False)
+        switches = flag_value(FLAG_SWITCHES, database.flagArgumentBool, False)
+        fast = flag_value(FLAG_FAST, database.flagArgumentBool, False)
+        service = flag_value(FLAG_SERVICE, database.flagArgumentBool, False)
+        task = flag_value(FLAG_TASK, database.flagArgumentBool, False)
+        names = [
+            database.getFlagArgumentList(FLAG_LIMB[0], index).asString(0)
+            for index in range(database.numberOfFlagUses(FLAG_LIMB[0]))
+        ] or None
+
+        if service:
+            # fkik_service 合并的一批请求：所有修改写入同一个 writer，整批一步撤销
+            import fkik_service
+            self.writer = fkik.AnimCurveWriter()
+            self.setResult(len(fkik_service.run_command_batch(self.writer)))
+            return
+
+        matcher = fkik.get_command_matcher()
+        if task:
+            # 后台任务（ChunkedTask）已经分块写入的 writer：不再执行，只作为一步放入撤销队列
+            self.writer, matcher.task_writer = matcher.task_writer, None
+            return
+
+        if names:
+            missing = [name for name in names if name not in matcher.limbs]
+            if missing:
+                om2.MGlobal.displayWarning(f'{fkik.MATCH_COMMAND}: unknown limb(s): {", ".join(missing)}')
+
+        if switches:
+            result = matcher.match_switches(names, start, end, fast)
+            count = result['keys'] if result else 0
+        elif direction not in DIRECTIONS:
+            raise ValueError(f'{fkik.MATCH_COMMAND}: -direction must be one of {", ".join(DIRECTIONS)}')
+        elif start is None:
+            result = matcher.match_all(direction, names, auto_key=key, writer=fkik.AnimCurveWriter())
+            count = len(result.targets)
+        else:
+            result = matcher.bake(min(start, end), max(start, end), direction, names, step, incremental, fast)
+            count = result['keys'] if result else 0
+            if result:
+                # 保存烘焙指纹（不进入撤销队列）
+                matcher.save_to_scene()
+
+        if result is not None:
+            self.writer = result['writer'] if isinstance(result, dict) else result.writer
+        matcher.last_result = result
+        self.setResult(count)
+
+    def redoIt(self):
+        self.writer.redo()
+
+    def undoIt(self):
+        self.writer.undo()
+
+    def isUndoable(self):
+        return self.writer is not None
+
+
+def initializePlugin(plugin):
+    plugin_fn = om2.MFnPlugin(plugin, 'niexiongtao', '2.1')
+    plugin_fn.registerCommand(fkik.MATCH_COMMAND, FKIKMatchCommand.creator, FKIKMatchCommand.create_syntax)
+
+
+def uninitializePlugin(plugin):
+    om2.MFnPlugin(plugin).deregisterCommand(fkik.MATCH_COMMAND)
@@ -0,0 +1,643 @@
+# -*- coding: utf-8 -*-
+"""
+FK/IK Matching Tool - Match Service
+Accept match/bake/verify requests from other processes over a local socket
+
+Usage (inside Maya):
+    import fkik_service
+    fkik_service.start()                        # listens on 127.0.0.1:7031
+
+Usage (mayapy, no idle loop):
+    service = fkik_service.start()
+    service.serve_forever()                     # runs batches on this thread until stop()
+
+Usage (client, any Python):
+    python fkik_service.py match --direction ik_to_fk --namespace charA
+    python fkik_service.py bake --direction fk_to_ik --limb L_Arm --limb R_Arm --start 1 --end 240
+
+Protocol: one JSON object per line in each direction. A request looks like
+    {"id": "shot010", "op": "match" | "bake" | "verify", "direction": "ik_to_fk" | "fk_to_ik",
+     "limbs": [...], "namespaces": [...], "start": 1, "end": 240, "step": 1,
+     "incremental": false, "fast": false, "key": false}
+Without limbs or namespaces a request covers every limb. For every request the
+service replies "queued" at once and "running" when its batch starts. It then
+sends "ok" with the result and timings, or "error". Once the client shuts down
+its side, the server closes the connection after the last final reply.
+
+Requests that arrive within MERGE_WINDOW of each other form one batch.
+Requests with the same operation and parameters are merged into one call over
+the union of their limbs. The batch runs on Maya's main thread and writes
+through a single AnimCurveWriter. With the fkikMatch plugin loaded the batch
+runs inside the command and is one undo step. Otherwise service.undo_last()
+rolls it back. The listener only binds the loopback interface.
+
+Made by niexiongtao
+"""
+
+import argparse
+import json
+import socket
+import socketserver
+import sys
+import threading
+import time
+import uuid
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 7031
+# 合并窗口（秒）：第一个请求到达后等待这么久，期间到达的请求合并为一批
+MERGE_WINDOW = 0.05
+# 监听线程检查停止请求的间隔（秒），决定 stop() 的等待时间
+LISTEN_POLL_INTERVAL = 0.05
+
+OPERATIONS = ('match', 'bake', 'verify')
+DIRECTIONS = ('ik_to_fk', 'fk_to_ik')
+FINAL_STATUSES = ('ok', 'error')
+
+_service = None
+_command_service = None
+
+
+def _engine():
+    """universal_fkik_match（只在 Maya 中导入，客户端不需要）"""
+    import universal_fkik_match as fkik
+    return fkik
+
+
+def _json_default(value):
+    """NumPy 标量等无法直接序列化的值"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def _name_list(payload, key):
+    names = payload.get(key) or []
+    if isinstance(names, str):
+        names = [names]
+    if not all(isinstance(name, str) for name in names):
+        raise ValueError(f'{key} must be a list of names')
+    return list(names)
+
+
+def _frame(payload, key):
+    value = payload.get(key)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f'{key} must be a number')
+    return value
+
+
+# ============================================================================
+# 请求 / Requests
+# ============================================================================
+
+class ServiceRequest:
+    """
+    一个已接收的请求：在监听线程中解析和检查，在主线程中执行
+
+    reply(message) 把回复发回客户端（任意线程均可调用）
+    """
+
+    def __init__(self, payload, reply):
+        if not isinstance(payload, dict):
+            raise ValueError('request must be a JSON object')
+        self.id = str(payload.get('id') or uuid.uuid4().hex[:8])
+        self.op = payload.get('op')
+        if self.op not in OPERATIONS:
+            raise ValueError(f'op must be one of {", ".join(OPERATIONS)}')
+        self.direction = payload.get('direction')
+        if self.direction not in DIRECTIONS:
+            raise ValueError(f'direction must be one of {", ".join(DIRECTIONS)}')
+        self.limbs = _name_list(payload, 'limbs')
+        self.namespaces = _name_list(payload, 'namespaces')
+        self.start = _frame(payload, 'start')
+        self.end = _frame(payload, 'end')
+        self.step = max(1, int(payload.get('step', 1)))
+        self.incremental = bool(payload.get('incremental', False))
+        self.fast = bool(payload.get('fast', False))
+        self.key = bool(payload.get('key', False))
+        self.reply = reply
+        self.received = time.perf_counter()
+        self.final = None  # 最终回复（ok / error），发送后记录
+
+    def merge_key(self):
+        """参数相同（只有肢体不同）的请求可以合并为一次调用"""
+        if self.op == 'match':
+            return self.op, self.direction, self.key
+        if self.op == 'bake':
+            return self.op, self.direction, self.start, self.end, self.step, self.incremental, self.fast
+        return self.op, self.direction, self.start, self.end, self.step
+
+    def resolve(self, matcher):
+        """
+        请求的肢体名称：指定的肢体 + 指定命名空间中的肢体，两者都没有时为全部肢体
+
+        Returns:
+            (names, missing): 存在的肢体名称，以及找不到的肢体名称和命名空间
+        """
+        fkik = _engine()
+        if not self.limbs and not self.namespaces:
+            return list(matcher.limbs), []
+        names = [name for name in self.limbs if name in matcher.limbs]
+        missing = [name for name in self.limbs if name not in matcher.limbs]
+        for namespace in self.namespaces:
+            found = [
+                limb.name for limb in matcher.get_limbs()
+                if (limb.namespace or fkik.namespace_of(limb.name)) == namespace
+            ]
+            if not found:
+                missing.append(namespace + ':')
+            names.extend(name for name in found if name not in names)
+        return names, missing
+
+
+# ============================================================================
+# 服务 / Service
+# ============================================================================
+
+class MatchService:
+    """
+    本地匹配服务
+
+    监听线程只接收和检查请求；合并窗口结束后，整批请求通过 schedule(flush)
+    （Maya 界面中为 maya.utils.executeDeferred）在主线程执行。
+    schedule 为 None 时由主线程调用 process() / serve_forever() 执行
+
+    Args:
+        matcher: 使用的 FKIKMatcher，None 时每批使用 get_command_matcher()（界面的引擎或场景中的肢体）
+        port: 监听端口，0 为任意空闲端口（启动后见 self.port）
+        merge_window: 合并窗口（秒）
+        schedule: schedule(callable)，把回调安排到主线程执行
+    """
+
+    def __init__(self, matcher=None, host=DEFAULT_HOST, port=DEFAULT_PORT, merge_window=MERGE_WINDOW,
+                 schedule=None):
+        self.matcher = matcher
+        self.host = host
+        self.port = port
+        self.merge_window = merge_window
+        self.schedule = schedule
+        self.last_writer = None     # 上一批的 AnimCurveWriter（没有通过 fkikMatch 命令执行时）
+        self.batches = 0
+        self.last_replies = []
+        self._pending = []
+        self._batch = None
+        self._lock = threading.Lock()
+        self._timer = None
+        self._ready = threading.Event()
+        self._server = None
+
+    # ============ 监听 ============
+
+    @property
+    def running(self):
+        return self._server is not None
+
+    def start(self):
+        """在后台线程中开始监听，返回端口"""
+        if self._server is None:
+            self._server = _Server((self.host, self.port), _Handler)
+            self._server.service = self
+            self.port = self._server.server_address[1]
+            threading.Thread(
+                target=self._server.serve_forever, args=(LISTEN_POLL_INTERVAL,), name='fkik_service', daemon=True
+            ).start()
+        return self.port
+
+    def stop(self):
+        """停止监听；还没有执行的请求回复错误"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        for request in pending:
+            request.reply({'id': request.id, 'status': 'error', 'error': 'service stopped'})
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def accept(self, payload, reply):
+        """
+        检查一个请求并回复 queued（不排队）
+
+        Returns:
+            ServiceRequest，请求无效时为 None（已回复错误）
+        """
+        try:
+            request = ServiceRequest(payload, reply)
+        except (TypeError, ValueError) as e:
+            request_id = payload.get('id') if isinstance(payload, dict) else None
+            reply({'id': request_id, 'status': 'error', 'error': str(e)})
+            return None
+        reply({'id': request.id, 'status': 'queued'})
+        return request
+
+    def submit(self, payload, reply):
+        """
+        接收一个请求（任意线程）：检查后立即回复 queued，合并窗口结束后在主线程执行
+
+        Returns:
+            ServiceRequest，请求无效时为 None（已回复错误）
+        """
+        request = self.accept(payload, reply)
+        if request is None:
+            return None
+        with self._lock:
+            self._pending.append(request)
+            if self._timer is None:
+                self._timer = threading.Timer(self.merge_window, self._wake)
+                self._timer.daemon = True
+                self._timer.start()
+        return request
+
+    def _wake(self):
+        with self._lock:
+            self._timer = None
+        if self.schedule is not None:
+            self.schedule(self.flush)
+        else:
+            self._ready.set()
+
+    def process(self, timeout=None):
+        """
+        等待下一批（最多 timeout 秒）并在当前线程执行，schedule 为 None 时使用
+
+        Returns:
+            int: 执行的请求数
+        """
+        if not self._ready.wait(timeout):
+            return 0
+        self._ready.clear()
+        return self.flush()
+
+    def serve_forever(self, poll_interval=0.1):
+        """在当前（主）线程中循环执行到达的批次，直到 stop() 或 Ctrl+C（mayapy 中使用）"""
+        try:
+            while self.running:
+                self.process(poll_interval)
+        except KeyboardInterrupt:
+            self.stop()
+
+    # ============ 执行（主线程）============
+
+    def flush(self):
+        """执行所有已到达的请求，返回请求数"""
+        with self._lock:
+            requests, self._pending = self._pending, []
+        if requests:
+            self.execute(requests)
+        return len(requests)
+
+    def execute(self, requests):
+        """
+        执行一批请求（主线程），所有修改写入同一个 AnimCurveWriter
+
+        fkikMatch 插件已加载时在命令中执行（见 run_command_batch），整批在撤销队列中只占一步。
+        批次中任何地方出错（获取引擎、保存指纹、命令本身等）时，还没有最终回复的请求都回复错误，
+        客户端不会一直等待
+
+        Returns:
+            list: 每个请求的最终回复
+        """
+        global _command_service
+        writes = any(request.op != 'verify' for request in requests)
+        self._batch = requests
+        try:
+            fkik = _engine()
+            import maya.cmds as cmds
+            if writes and fkik.match_command_loaded():
+                _command_service = self
+                try:
+                    getattr(cmds, fkik.MATCH_COMMAND)(service=True)
+                finally:
+                    _command_service = None
+                self.last_writer = None
+            else:
+                writer = fkik.AnimCurveWriter()
+                try:
+                    self.run_batch(writer)
+                finally:
+                    if writes:
+                        self.last_writer = writer
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+            print(f'FK/IK match service: batch failed: {error}', file=sys.stderr)
+            for request in requests:
+                if request.final is None:
+                    self._finish(request, {'status': 'error', 'error': error})
+        finally:
+            self._batch = None
+        self.last_replies = [request.final for request in requests]
+        return self.last_replies
+
+    def run_batch(self, writer):
+        """
+        执行当前批次：按 merge_key 分组，每组对所有请求的肢体调用一次引擎，结果再发回各个请求
+
+        一组失败时只有该组的请求回复错误；烘焙后保存指纹（不进入撤销队列）
+        """
+        fkik = _engine()
+        requests = self._batch or []
+        matcher = self.matcher or fkik.get_command_matcher()
+        groups = {}
+        for request in requests:
+            groups.setdefault(request.merge_key(), []).append(request)
+        for request in requests:
+            request.reply({'id': request.id, 'status': 'running', 'batch': len(requests)})
+
+        replies = []
+        baked = False
+        for group in groups.values():
+            time_start = time.perf_counter()
+            resolved = []
+            for request in group:
+                names, missing = request.resolve(matcher)
+                if names:
+                    resolved.append((request, names, missing))
+                else:
+                    replies.append(self._finish(request, {
+                        'status': 'error', 'error': f'no limbs found: {", ".join(missing) or "no limbs loaded"}'}))
+            if not resolved:
+                continue
+
+            union = []
+            seen = set()
+            for request, names, missing in resolved:
+                union.extend(name for name in names if name not in seen)
+                seen.update(names)
+            try:
+                result, timings, per_limb = self._run_group(fkik, matcher, group[0], union, writer)
+            except Exception as e:
+                for request, names, missing in resolved:
+                    replies.append(self._finish(request, {'status': 'error', 'error': f'{type(e).__name__}: {e}'}))
+                continue
+            baked = baked or (group[0].op == 'bake' and bool(result.get('rebaked_frames')))
+            elapsed = time.perf_counter() - time_start
+
+            for request, names, missing in resolved:
+                request_result = dict(result)
+                if per_limb is not None:
+                    request_result['limbs'] = {name: per_limb[name] for name in names if name in per_limb}
+                    request_result['passed'] = not any(
+                        entry['failed_frames'] for entry in request_result['limbs'].values())
+                message = {
+                    'status': 'ok', 'op': request.op, 'limbs': names, 'merged': len(resolved),
+                    'result': request_result,
+                    'timings': dict(timings, wait=time_start - request.received, run=elapsed),
+                }
+                if missing:
+                    message['missing'] = missing
+                replies.append(self._finish(request, message))
+
+        if baked:
+            matcher.save_to_scene()
+        self.batches += 1
+        self.last_replies = replies
+        return replies
+
+    def _run_group(self, fkik, matcher, request, names, writer):
+        """
+        对合并后的肢体执行一次操作
+
+        Returns:
+            (result, timings, per_limb): 共用的结果、各阶段耗时，以及校验时每个肢体的结果（否则为 None）
+        """
+        if request.op == 'match':
+            plan = matcher.match_all(request.direction, names, auto_key=request.key, writer=writer)
+            return {'controls': len(plan.targets)}, dict(plan.timings), None
+
+        if request.op == 'bake':
+            start, end = request.start, request.end
+            if start is None or end is None:
+                range_start, range_end = fkik.get_frame_range()
+                start = range_start if start is None else start
+                end = range_end if end is None else end
+            stats = fkik.run_steps(matcher.iter_bake(
+                min(start, end), max(start, end), request.direction, names, request.step,
+                request.incremental, request.fast, writer=writer
+            ))
+            if not stats:
+                return {'keys': 0}, {}, None
+            stats = dict(stats)
+            stats.pop('writer', None)
+            report = stats.pop('fast_bake', None)
+            if report is not None:
+                stats['fast_bake'] = report.changes
+            timings = {key[:-len('_time')]: stats.pop(key) for key in list(stats) if key.endswith('_time')}
+            return stats, timings, None
+
+        report = matcher.verify(request.direction, request.start, request.end, names, request.step)
+        if report is None:
+            return {'frames': []}, {}, {}
+        data = report.to_dict()
+        per_limb = data.pop('limbs')
+        return data, {}, per_limb
+
+    def _finish(self, request, message):
+        message = dict(message, id=request.id)
+        request.final = message
+        request.reply(message)
+        return message
+
+    def undo_last(self):
+        """撤销上一批写入的修改（没有通过 fkikMatch 命令执行时；否则使用 Maya 的撤销）"""
+        if self.last_writer is None:
+            return False
+        self.last_writer.undo()
+        self.last_writer = None
+        return True
+
+
+def run_command_batch(writer):
+    """fkikMatch -service 的入口：在命令中执行正在提交的批次，返回最终回复"""
+    if _command_service is None:
+        raise RuntimeError('no fkik_service batch is waiting to run')
+    return _command_service.run_batch(writer)
+
+
+# ============================================================================
+# 连接 / Connections
+# ============================================================================
+
+class _Connection:
+    """一个客户端连接：按行发送回复（可能来自多个线程），记录还没有最终回复的请求数"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.open_requests = 0
+        self.lock = threading.Condition()
+
+    def opened(self):
+        with self.lock:
+            self.open_requests += 1
+
+    def send(self, message):
+        data = (json.dumps(message, default=_json_default) + '\n').encode('utf-8')
+        with self.lock:
+            try:
+                self.stream.write(data)
+                self.stream.flush()
+            except OSError:
+                # 客户端已断开，结果仍然写入了场景
+                pass
+            if message.get('status') in FINAL_STATUSES:
+                self.open_requests -= 1
+                self.lock.notify_all()
+
+    def wait_idle(self):
+        with self.lock:
+            while self.open_requests > 0:
+                self.lock.wait()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        service = self.server.service
+        connection = _Connection(self.wfile)
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            connection.opened()
+            try:
+                payload = json.loads(line.decode('utf-8'))
+            except ValueError as e:
+                connection.send({'id': None, 'status': 'error', 'error': f'invalid JSON: {e}'})
+                continue
+            service.submit(payload, connection.send)
+        # 客户端关闭了发送方向：等所有请求都有最终回复后再关闭连接
+        connection.wait_idle()
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+# ============================================================================
+# Maya 入口 / Maya Entry Points
+# ============================================================================
+
+def start(port=DEFAULT_PORT, host=DEFAULT_HOST, matcher=None, merge_window=MERGE_WINDOW):
+    """
+    启动服务（已在运行时直接返回）
+
+    Maya 界面中批次通过 maya.utils.executeDeferred 在主线程执行；
+    批处理模式（mayapy）没有空闲循环，需要在主线程调用 serve_forever()
+    """
+    global _service
+    if _service is not None and _service.running:
+        return _service
+    import maya.cmds as cmds
+    schedule = None
+    if not cmds.about(batch=True):
+        import maya.utils
+        schedule = maya.utils.executeDeferred
+    _service = MatchService(matcher, host, port, merge_window, schedule)
+    _service.start()
+    print(f'FK/IK match service listening on {host}:{_service.port}')
+    return _service
+
+
+def stop():
+    """停止服务"""
+    global _service
+    if _service is not None:
+        _service.stop()
+        _service = None
+
+
+def active_service():
+    """正在运行的 MatchService，没有时为 None"""
+    return _service
+
+
+def execute_json(text):
+    """
+    同步执行 JSON 请求（一个对象或列表）并返回最终回复的 JSON，不经过合并窗口
+
+    供 Maya commandPort 的客户端使用：fkik_service.execute_json('{"op": "match", ...}')
+    """
+    payloads = json.loads(text)
+    if isinstance(payloads, dict):
+        payloads = [payloads]
+    service = _service or MatchService()
+    replies = []
+
+    def reply(message):
+        if message.get('status') in FINAL_STATUSES:
+            replies.append(message)
+
+    requests = [request for request in (service.accept(payload, reply) for payload in payloads) if request]
+    if requests:
+        service.execute(requests)
+    return json.dumps(replies, default=_json_default)
+
+
+# ============================================================================
+# 客户端 / Client
+# ============================================================================
+
+def send_requests(requests, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=None):
+    """
+    发送请求并逐条产出服务的回复（queued / running / ok / error），所有请求都有最终回复后结束
+
+    Args:
+        requests: 请求字典列表（见模块说明）
+        timeout: 套接字超时（秒），None 为一直等待（长时间烘焙）
+    """
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        sock.sendall(''.join(json.dumps(request) + '\n' for request in requests).encode('utf-8'))
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile('r', encoding='utf-8') as stream:
+            for line in stream:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Send a match/bake/verify request to a running FK/IK match service.')
+    parser.add_argument('op', choices=OPERATIONS)
+    parser.add_argument('--direction', choices=DIRECTIONS, required=True)
+    parser.add_argument('--limb', action='append', default=[], help='limb name (repeatable)')
+    parser.add_argument('--namespace', action='append', default=[], help='match every limb in this namespace (repeatable)')
+    parser.add_argument('--start', type=float, help='first frame (bake/verify; default: playback start)')
+    parser.add_argument('--end', type=float, help='last frame (bake/verify; default: playback end)')
+    parser.add_argument('--step', type=int, default=1)
+    parser.add_argument('--incremental', action='store_true', help='only re-bake changed frames')
+    parser.add_argument('--fast', action='store_true', help='bake inside fast_bake()')
+    parser.add_argument('--key', action='store_true', help='key the matched channels (match)')
+    parser.add_argument('--id', help='request id echoed in every reply')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--timeout', type=float, help='socket timeout in seconds')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    request = {
+        'op': args.op, 'direction': args.direction, 'limbs': args.limb, 'namespaces': args.namespace,
+        'start': args.start, 'end': args.end, 'step': args.step,
+        'incremental': args.incremental, 'fast': args.fast, 'key': args.key,
+    }
+    if args.id:
+        request['id'] = args.id
+    failed = False
+    try:
+        for reply in send_requests([request], args.host, args.port, args.timeout):
+            print(json.dumps(reply))
+            failed = failed or reply.get('status') == 'error'
+    except OSError as e:
+        print(f'cannot reach the match service at {args.host}:{args.port}: {e}', file=sys.stderr)
+        return 2
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
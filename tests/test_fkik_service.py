@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+fkik_service 测试：在 fake_maya 伪场景中检查请求合并、无效请求和失败的批次
+
+Usage:
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+sys.path.insert(0, ROOT)
+
+import bench_fkik  # noqa: E402  (安装 fake_maya)
+import fkik_service  # noqa: E402
+import universal_fkik_match as fkik  # noqa: E402
+
+
+@pytest.fixture
+def engine():
+    return fkik.FKIKMatcher(bench_fkik.build_rig(4, 12))
+
+
+def submit(service, payload):
+    """提交一个请求，返回收到的回复列表"""
+    replies = []
+    service.submit(payload, replies.append)
+    return replies
+
+
+def final(replies):
+    finals = [reply for reply in replies if reply['status'] in fkik_service.FINAL_STATUSES]
+    assert len(finals) == 1
+    return finals[0]
+
+
+def test_requests_with_same_parameters_are_merged(engine):
+    service = fkik_service.MatchService(engine, merge_window=60.0)
+    first = submit(service, {'id': 'a', 'op': 'match', 'direction': 'ik_to_fk', 'limbs': ['limb0', 'limb1']})
+    second = submit(service, {'id': 'b', 'op': 'match', 'direction': 'ik_to_fk', 'limbs': ['limb2']})
+    assert service.flush() == 2
+    service.stop()
+
+    assert service.batches == 1
+    assert [reply['status'] for reply in first] == ['queued', 'running', 'ok']
+    assert final(first)['merged'] == 2 and final(second)['merged'] == 2
+    assert final(first)['limbs'] == ['limb0', 'limb1']
+    assert final(second)['limbs'] == ['limb2']
+
+
+def test_invalid_request_gets_an_error_without_queueing(engine):
+    service = fkik_service.MatchService(engine, merge_window=60.0)
+    replies = submit(service, {'id': 'bad', 'op': 'explode', 'direction': 'ik_to_fk'})
+    assert final(replies)['id'] == 'bad'
+    assert 'op must be one of' in final(replies)['error']
+    assert service.flush() == 0
+    service.stop()
+
+
+def test_failing_group_only_fails_its_requests(engine, monkeypatch):
+    def broken_match_all(*args, **kwargs):
+        raise RuntimeError('solver exploded')
+
+    monkeypatch.setattr(engine, 'match_all', broken_match_all)
+    service = fkik_service.MatchService(engine, merge_window=60.0)
+    match = submit(service, {'op': 'match', 'direction': 'ik_to_fk', 'limbs': ['limb0']})
+    verify = submit(service, {'op': 'verify', 'direction': 'ik_to_fk', 'limbs': ['limb1'], 'start': 1, 'end': 3})
+    service.flush()
+    service.stop()
+
+    assert final(match)['status'] == 'error'
+    assert 'solver exploded' in final(match)['error']
+    assert final(verify)['status'] == 'ok'
+
+
+def test_batch_failure_still_replies_to_every_request(monkeypatch):
+    def no_matcher():
+        raise RuntimeError('no limbs stored in the scene')
+
+    monkeypatch.setattr(fkik, 'get_command_matcher', no_matcher)
+    service = fkik_service.MatchService(merge_window=60.0)
+    match = submit(service, {'op': 'match', 'direction': 'ik_to_fk'})
+    bake = submit(service, {'op': 'bake', 'direction': 'fk_to_ik', 'start': 1, 'end': 4})
+    assert service.flush() == 2
+    service.stop()
+
+    # 批次在分组之前失败：每个请求仍然收到最终的错误回复，客户端不会一直等待
+    for replies in (match, bake):
+        assert final(replies)['status'] == 'error'
+        assert 'no limbs stored in the scene' in final(replies)['error']
+    assert [reply['status'] for reply in service.last_replies] == ['error', 'error']
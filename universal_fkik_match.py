@@ -9,14 +9,43 @@ Made by niexiongtao
 
 import maya.cmds as cmds
 import maya.api.OpenMaya as om2
+import maya.api.OpenMayaAnim as om2anim
 import json
 import os
+import re
+import sys
 import math
-from contextlib import contextmanager
+import time
+import array
+import bisect
+import hashlib
+import functools
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 
 # 常量 / Constants
 RAD_TO_DEG = 180.0 / math.pi
 
+_kernel = None
+
+
+def get_kernel():
+    """
+    按需导入向量化数学内核 fkik_kernel（依赖 NumPy）
+    
+    延迟到第一次使用时导入，保证模块本身在 mayapy 中快速加载；不可用时返回 None
+    """
+    global _kernel
+    if _kernel is None:
+        try:
+            import fkik_kernel as kernel
+        except ImportError:
+            # NumPy 不可用时回退到 om2 逐帧计算
+            kernel = False
+        _kernel = kernel
+    return _kernel or None
+
 
 # ============================================================================
 # 多语言 / Localization
@@ -46,6 +75,10 @@ LANGUAGES = {
         'load_ik': 'Load Selected as IK Control',
         'pole_vector': 'Elbow/Knee Control (Pole Vector)',
         'load_pv': 'Load Selected as Control',
+        'switch_attr': 'FK/IK Switch Attribute (Optional)',
+        'load_switch': 'Load Selected Channel',
+        'switch_values': 'FK / IK Value',
+        'no_switch_channel': 'Select the FK/IK attribute in the Channel Box',
         'save_limb': 'Save This Limb',
         'clear_current': 'Clear Current',
         
@@ -56,6 +89,13 @@ LANGUAGES = {
         'preset_saved': 'Preset saved!',
         'preset_loaded': 'Preset loaded! Limbs: ',
         'preset_error': 'Preset error: ',
+        'auto_load_preset': 'Load Preset Matching Scene',
+        'preset_no_match': 'No preset in the library matches the scene nodes',
+        'preset_matched': 'Preset loaded: {rig}, limbs: {limbs}',
+        'scene_loaded': 'Limbs loaded from scene: ',
+        'scene_incomplete': 'Limbs with missing or disconnected nodes: ',
+        'instantiate_namespaces': 'Apply Limbs to All Namespaces',
+        'instances_found': 'Namespaces: {namespaces}, limbs: {limbs}',
         
         # Action Section
         'actions': 'Matching Actions',
@@ -63,14 +103,51 @@ LANGUAGES = {
         'match_all_fk_to_ik': 'Match All FK to IK (Use for changing to FK Mode)',
         'match_sel_ik_to_fk': 'Selected: IK → FK (Use for changing to IK Mode)',
         'match_sel_fk_to_ik': 'Selected: FK → IK (Use for changing to FK Mode)',
+        'match_selection': 'Match Selected Controls (direction from switch attribute)',
+        'no_selection_limb': 'No limb found for the selected controls (or no switch attribute set)',
         'calibrate_all': 'Calibrate All Limbs',
         'calibrate_success': 'Calibration complete! Limbs: ',
         'calibrate_note': '* Put rig in bind pose before calibrating',
+        'calibrate_bind': 'Calibrate from Bind Data (no posing)',
+        'calibrate_bind_missing': 'No bind data for {limbs} limb(s) (see Script Editor); use Calibrate All Limbs in bind pose, or switch them fully to IK',
+        'calibrate_bind_tip': (
+            'IK controls are rarely in a bind pose or skinCluster: without a rest-pose snapshot '
+            '(saved by Calibrate All Limbs), a limb is calibrated only while it is fully in IK mode'
+        ),
+        
+        # Bake Section
+        'bake': 'Bake Frame Range',
+        'bake_range': 'Start / End',
+        'bake_selected_only': 'Selected Limb Only',
+        'bake_incremental': 'Only Re-bake Changed Frames',
+        'bake_up_to_date': 'Nothing changed since the last bake',
+        'bake_verify': 'Verify After Bake',
+        'bake_fast': 'Fast Bake (suspend viewport and autosave, DG evaluation)',
+        'bake_background': 'Run in Background (progress bar, press Esc to cancel)',
+        'task_busy': 'Another FK/IK operation is still running',
+        'task_cancelled': 'FK/IK Operation Cancelled',
+        'task_cancel_message': 'Roll back the chunks that were already written, or keep them?',
+        'task_rollback': 'Roll Back',
+        'task_keep': 'Keep Completed',
+        'task_rolled_back': 'Cancelled, all changes rolled back',
+        'task_kept': 'Cancelled, completed chunks kept (Undo Last Bake removes them)',
+        'verify_failed': 'Match error over tolerance: {limbs} limb(s), {frames} frame(s) (see Script Editor)',
+        'verify_passed': 'Verified: all frames within tolerance',
+        'bake_ik_to_fk': 'Bake IK to FK (Whole Range)',
+        'bake_fk_to_ik': 'Bake FK to IK (Whole Range)',
+        'bake_success': 'Bake complete! Keys: ',
+        'bake_nothing': 'Nothing to bake for the current limbs',
+        'undo_bake': 'Undo Last Bake',
+        'undo_bake_done': 'Last bake undone',
+        'match_switches': 'Match All FK/IK Switch Points',
+        'switches_matched': 'Switch points matched: {switches}, keys: {keys}',
+        'no_switches': 'No FK/IK switch points found (set the switch attribute of each limb)',
         
         # Settings
         'settings': 'Settings',
         'auto_key': 'Auto Keyframe',
         'use_matrix': 'Use Matrix Matching',
+        'profile': 'Print Profile Report',
         
         # Messages
         'no_selection': 'Please select objects first',
@@ -97,10 +174,14 @@ LANGUAGES = {
                      '7. Repeat for other limbs\n'
                      '8. Save All Limbs as preset (optional)\n'
                      '9. Put rig in Bind Pose → Calibrate All Limbs\n'
+                     '   (Limbs and calibration are also stored in the scene)\n'
                      'Animation FK/IK Switching:\n'
                      '• Load preset (optional)\n'
                      '• Key FKIK controller at current frame, then click Match\n'
-                     '• Move 1 frame, switch FKIK, then key again',
+                     '• Move 1 frame, switch FKIK, then key again\n'
+                     '• Bake Frame Range: match every frame in one pass\n'
+                     '• Switch points: set each limb\'s FK/IK attribute,\n'
+                     '   then Match All FK/IK Switch Points',
         
         # Author
         'author': 'Made by niexiongtao',
@@ -129,6 +210,10 @@ LANGUAGES = {
         'load_ik': '加载选中物体为 IK 控制器',
         'pole_vector': '肘/膝朝向控制器 (极向量)',
         'load_pv': '加载选中物体为朝向控制器',
+        'switch_attr': 'FKIK切换属性 (可选)',
+        'load_switch': '加载通道盒中选中的属性',
+        'switch_values': 'FK值 / IK值',
+        'no_switch_channel': '请在通道盒中选择FKIK切换属性',
         'save_limb': '保存此肢体',
         'clear_current': '清除当前',
         
@@ -139,6 +224,13 @@ LANGUAGES = {
         'preset_saved': '预设已保存！',
         'preset_loaded': '预设已加载！肢体数量: ',
         'preset_error': '预设错误: ',
+        'auto_load_preset': '加载与场景匹配的预设',
+        'preset_no_match': '预设库中没有与场景节点匹配的预设',
+        'preset_matched': '已加载预设: {rig}，肢体: {limbs}',
+        'scene_loaded': '已从场景加载肢体: ',
+        'scene_incomplete': '有节点缺失或连接断开的肢体: ',
+        'instantiate_namespaces': '应用肢体到所有命名空间',
+        'instances_found': '命名空间: {namespaces}，肢体: {limbs}',
         
         # Action Section
         'actions': '匹配操作',
@@ -146,14 +238,48 @@ LANGUAGES = {
         'match_all_fk_to_ik': '全部 FK 匹配到 IK (切换FK模式时使用)',
         'match_sel_ik_to_fk': '选中肢体: IK → FK (切换IK模式时使用)',
         'match_sel_fk_to_ik': '选中肢体: FK → IK (切换FK模式时使用)',
+        'match_selection': '匹配视图中选中的控制器（方向由切换属性决定）',
+        'no_selection_limb': '选中的控制器不属于任何肢体（或肢体没有设置切换属性）',
         'calibrate_all': '校准所有肢体',
         'calibrate_success': '校准完成！肢体数量: ',
         'calibrate_note': '* 校准前请将角色放到绑定姿势',
+        'calibrate_bind': '按绑定数据校准（不需要摆姿势）',
+        'calibrate_bind_missing': '{limbs} 个肢体没有绑定数据（详见脚本编辑器），请在绑定姿势下使用“校准所有肢体”，或把肢体完全切换到IK',
+        'calibrate_bind_tip': 'IK控制器很少在绑定姿势或蒙皮中：没有静止姿势快照（“校准所有肢体”时保存）时，只有完全处于IK模式的肢体可以校准',
+        
+        # Bake Section
+        'bake': '帧范围烘焙',
+        'bake_range': '起始 / 结束',
+        'bake_selected_only': '仅烘焙选中肢体',
+        'bake_incremental': '只重新烘焙改变了的帧',
+        'bake_up_to_date': '自上次烘焙后没有改变',
+        'bake_verify': '烘焙后校验',
+        'bake_fast': '快速烘焙（暂停视图刷新和自动保存，使用 DG 求值）',
+        'bake_background': '后台执行（显示进度，按 Esc 取消）',
+        'task_busy': '另一个FKIK操作仍在执行',
+        'task_cancelled': 'FKIK操作已取消',
+        'task_cancel_message': '回滚已经写入的部分，还是保留？',
+        'task_rollback': '回滚',
+        'task_keep': '保留已完成部分',
+        'task_rolled_back': '已取消，所有修改已回滚',
+        'task_kept': '已取消，保留已完成部分（可用“撤销上次烘焙”移除）',
+        'verify_failed': '匹配误差超出容差：{limbs} 个肢体，{frames} 帧（详见脚本编辑器）',
+        'verify_passed': '校验通过：所有帧都在容差以内',
+        'bake_ik_to_fk': '烘焙 IK 到 FK（整个范围）',
+        'bake_fk_to_ik': '烘焙 FK 到 IK（整个范围）',
+        'bake_success': '烘焙完成！关键帧数量: ',
+        'bake_nothing': '当前肢体没有可烘焙的控制器',
+        'undo_bake': '撤销上次烘焙',
+        'undo_bake_done': '已撤销上次烘焙',
+        'match_switches': '匹配所有FKIK切换点',
+        'switches_matched': '已匹配切换点: {switches}，关键帧: {keys}',
+        'no_switches': '没有找到FKIK切换点（请为肢体设置切换属性）',
         
         # Settings
         'settings': '设置',
         'auto_key': '自动打Key',
         'use_matrix': '使用矩阵匹配',
+        'profile': '打印性能分析报告',
         
         # Messages
         'no_selection': '请先选择物体',
@@ -180,10 +306,14 @@ LANGUAGES = {
                      '7. 重复添加其他肢体\n'
                      '8. 保存所有肢体为预设（可选）\n'
                      '9. 将角色放到绑定姿势 → 点击校准所有肢体\n'
+                     '   （肢体和校准数据同时保存在场景中）\n'
                      '动画阶段FKIK切换：\n'
                      '• 加载预设（可选）\n'
                      '• 切换前在当前帧给FKIK控制器k帧后点击匹配按钮\n'
-                     '• 后挪一帧切换FKIK属性后再给FKIK控制器k帧',
+                     '• 后挪一帧切换FKIK属性后再给FKIK控制器k帧\n'
+                     '• 帧范围烘焙：一次性匹配范围内的每一帧\n'
+                     '• 切换点：为肢体设置FKIK切换属性后，\n'
+                     '   点击匹配所有FKIK切换点',
         
         # Author
         'author': 'Made by niexiongtao',
@@ -192,33 +322,538 @@ LANGUAGES = {
 }
 
 
+# ============================================================================
+# 性能分析 / Profiling
+# ============================================================================
+
+# 分析阶段 / Profile stages
+PROFILE_STAGES = ('resolve', 'read', 'math', 'write', 'key')
+
+_profiler = None
+_PROFILED = []  # [(限定名, 阶段或操作名, 是否为操作)]
+
+
+def profiled(stage):
+    """
+    装饰器：标记热路径函数所属的阶段（resolve / read / math / write / key）
+    
+    装饰器不修改函数本身，只登记名称；enable_profiling() 时才替换为计时包装，
+    disable_profiling() 时换回原函数，因此关闭时没有任何额外开销
+    """
+    def decorator(func):
+        _PROFILED.append((func.__qualname__, stage, False))
+        return func
+    return decorator
+
+
+def profiled_operation(operation):
+    """装饰器：标记按肢体计时的操作（从参数中的 LimbData 取肢体名称，否则记为 '*'）"""
+    def decorator(func):
+        _PROFILED.append((func.__qualname__, operation, True))
+        return func
+    return decorator
+
+
+def _limb_label(args):
+    for arg in args[:2]:
+        if hasattr(arg, 'blend_joints'):
+            return arg.name
+    return '*'
+
+
+class Profiler:
+    """
+    分阶段计时器
+    
+    每次操作（一个肢体的一次匹配/校准）生成一条记录。阶段可以嵌套，但只统计自身时间，
+    例如 read 中的 resolve 不会被重复计入；操作中未归入其他阶段的时间计为 math。
+    """
+    
+    def __init__(self):
+        self.records = []
+        self._open = []    # 进行中的操作记录
+        self._stack = []   # [[阶段, 已累计的自身时间, 最近一次开始/恢复的时刻]]
+        self._starts = []
+        self._unscoped = None
+    
+    def begin(self, operation, limb):
+        self._open.append({'operation': operation, 'limb': limb, 'time': 0.0, 'stages': {}})
+        self._starts.append(time.perf_counter())
+        self.push('math')
+    
+    def end(self):
+        self.pop()
+        record = self._open.pop()
+        record['time'] = time.perf_counter() - self._starts.pop()
+        self.records.append(record)
+    
+    def push(self, stage):
+        now = time.perf_counter()
+        if self._stack:
+            parent = self._stack[-1]
+            parent[1] += now - parent[2]
+        self._stack.append([stage, 0.0, now])
+    
+    def pop(self):
+        now = time.perf_counter()
+        stage, elapsed, resumed = self._stack.pop()
+        entry = self._current_record()['stages'].setdefault(stage, [0.0, 0])
+        entry[0] += elapsed + now - resumed
+        entry[1] += 1
+        if self._stack:
+            self._stack[-1][2] = now
+    
+    def _current_record(self):
+        if self._open:
+            return self._open[-1]
+        if self._unscoped is None:
+            # 不属于任何肢体操作的阶段（例如烘焙内部）
+            self._unscoped = {'operation': '', 'limb': '*', 'time': 0.0, 'stages': {}}
+            self.records.append(self._unscoped)
+        return self._unscoped
+    
+    def report(self):
+        return ProfileReport(self.records)
+
+
+class ProfileReport:
+    """
+    分析结果
+    
+    records 中每条记录: {'operation', 'limb', 'time', 'stages': {阶段: [秒, 调用次数]}}
+    """
+    
+    def __init__(self, records):
+        self.records = [r for r in records if r['stages']]
+    
+    def __len__(self):
+        return len(self.records)
+    
+    def by_limb(self):
+        """按 (操作, 肢体) 汇总"""
+        summary = {}
+        for record in self.records:
+            entry = summary.setdefault(
+                (record['operation'], record['limb']), {'time': 0.0, 'count': 0, 'stages': {}}
+            )
+            entry['time'] += record['time']
+            entry['count'] += 1
+            for stage, (seconds, calls) in record['stages'].items():
+                stage_entry = entry['stages'].setdefault(stage, [0.0, 0])
+                stage_entry[0] += seconds
+                stage_entry[1] += calls
+        return summary
+    
+    def totals(self):
+        """所有记录按阶段汇总 {阶段: [秒, 调用次数]}"""
+        totals = {}
+        for record in self.records:
+            for stage, (seconds, calls) in record['stages'].items():
+                entry = totals.setdefault(stage, [0.0, 0])
+                entry[0] += seconds
+                entry[1] += calls
+        return totals
+    
+    def format(self, limit=None):
+        """
+        格式化为表格（打印到脚本编辑器），按总耗时降序
+        
+        每个阶段列为 "毫秒/调用次数"
+        """
+        rows = sorted(self.by_limb().items(), key=lambda item: -sum(s[0] for s in item[1]['stages'].values()))
+        if limit:
+            rows = rows[:limit]
+        
+        lines = [f'FK/IK profile: {len(self.records)} operation(s)']
+        header = f'{"operation":<16}{"limb":<24}{"runs":>5}{"total ms":>10}'
+        header += ''.join(f'{stage:>14}' for stage in PROFILE_STAGES)
+        lines.append(header)
+        for (operation, limb), entry in rows:
+            total = sum(seconds for seconds, calls in entry['stages'].values())
+            line = f'{operation or "-":<16}{limb:<24}{entry["count"]:>5}{total * 1000.0:>10.2f}'
+            for stage in PROFILE_STAGES:
+                seconds, calls = entry['stages'].get(stage, (0.0, 0))
+                line += f'{f"{seconds * 1000.0:.2f}/{calls}":>14}' if calls else f'{"-":>14}'
+            lines.append(line)
+        return '\n'.join(lines)
+    
+    def to_json_lines(self):
+        """每条记录一行 JSON"""
+        lines = []
+        for record in self.records:
+            stages = {stage: {'time': seconds, 'calls': calls} for stage, (seconds, calls) in record['stages'].items()}
+            lines.append(json.dumps(dict(record, stages=stages), ensure_ascii=False))
+        return '\n'.join(lines)
+    
+    def write_json_lines(self, file_path, append=True):
+        """导出为 JSON Lines 文件（默认追加）"""
+        if not self.records:
+            return
+        with open(file_path, 'a' if append else 'w', encoding='utf-8') as f:
+            f.write(self.to_json_lines() + '\n')
+
+
+def _wrap_stage(func, profiler, stage):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler.push(stage)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.pop()
+    return wrapper
+
+
+def _wrap_operation(func, profiler, operation):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler.begin(operation, _limb_label(args))
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.end()
+    return wrapper
+
+
+_profiled_originals = []
+
+
+def enable_profiling():
+    """
+    开启分析：把登记过的函数/方法替换为计时包装
+    
+    Returns:
+        Profiler: 当前的分析器（已开启时返回同一个）
+    """
+    global _profiler
+    if _profiler is not None:
+        return _profiler
+    
+    _profiler = Profiler()
+    namespace = globals()
+    for qualname, stage, is_operation in _PROFILED:
+        owner_name, _, name = qualname.rpartition('.')
+        owner = namespace[owner_name] if owner_name else None
+        original = getattr(owner, name) if owner is not None else namespace[name]
+        wrap = _wrap_operation if is_operation else _wrap_stage
+        wrapper = wrap(original, _profiler, stage)
+        if owner is not None:
+            setattr(owner, name, wrapper)
+        else:
+            namespace[name] = wrapper
+        _profiled_originals.append((owner, name, original))
+    return _profiler
+
+
+def disable_profiling():
+    """
+    关闭分析并还原原函数
+    
+    Returns:
+        ProfileReport 或 None（未开启时）
+    """
+    global _profiler
+    if _profiler is None:
+        return None
+    
+    namespace = globals()
+    while _profiled_originals:
+        owner, name, original = _profiled_originals.pop()
+        if owner is not None:
+            setattr(owner, name, original)
+        else:
+            namespace[name] = original
+    report = _profiler.report()
+    _profiler = None
+    return report
+
+
+@contextmanager
+def profiling():
+    """
+    上下文管理器：在代码块内开启分析
+    
+    用法:
+        with profiling() as profiler:
+            matcher.match_all(BAKE_IK_TO_FK)
+        print(profiler.report().format())
+    """
+    profiler = enable_profiling()
+    try:
+        yield profiler
+    finally:
+        disable_profiling()
+
+
+# ============================================================================
+# 节点解析缓存 / Node Resolver
+# ============================================================================
+
+class NodeResolver:
+    """
+    节点名称 → MObjectHandle / MDagPath / MPlug 缓存
+    
+    每个名称只通过 MSelectionList 解析一次，之后用 MObjectHandle.isValid() 快速校验。
+    重命名、删除、重新父子化以及新建/打开场景时通过回调使缓存失效。
+    """
+    
+    def __init__(self):
+        self._nodes = {}   # {名称: (MObjectHandle, MDagPath或None)}
+        self._plugs = {}   # {(名称, 属性): (MObjectHandle, MPlug)}
+        self._callback_ids = []
+        self._listeners = weakref.WeakSet()  # 需要重命名/删除通知的对象（例如 LimbIndex）
+        # 场景结构版本：节点增删、重命名、重新父子化、新建/打开场景时递增，
+        # 其他按场景结构缓存的结果（例如命名空间实例）用它判断是否过期
+        self.generation = 0
+        self.scenes = 0  # 新建/打开场景的次数（按场景缓存的引擎用它判断是否过期）
+    
+    def install_callbacks(self):
+        """注册失效回调"""
+        if self._callback_ids:
+            return
+        self._callback_ids = [
+            om2.MNodeMessage.addNameChangedCallback(om2.MObject(), self._on_name_changed),
+            om2.MDGMessage.addNodeRemovedCallback(self._on_node_removed, 'dependNode'),
+            om2.MDGMessage.addNodeAddedCallback(self._on_node_added, 'dagNode'),
+            om2.MDagMessage.addParentAddedCallback(self._on_parent_changed),
+            om2.MDagMessage.addParentRemovedCallback(self._on_parent_changed),
+            om2.MSceneMessage.addCallback(om2.MSceneMessage.kBeforeNew, self._on_scene_changed),
+            om2.MSceneMessage.addCallback(om2.MSceneMessage.kBeforeOpen, self._on_scene_changed),
+        ]
+    
+    def remove_callbacks(self):
+        """移除失效回调"""
+        for callback_id in self._callback_ids:
+            om2.MMessage.removeCallback(callback_id)
+        self._callback_ids = []
+    
+    def add_listener(self, listener):
+        """
+        注册重命名/删除通知：listener.node_renamed(旧名称, 新名称, 新的完整DAG路径或None)、
+        listener.node_removed(名称)
+        """
+        self._listeners.add(listener)
+    
+    def clear(self):
+        self.generation += 1
+        self._nodes.clear()
+        self._plugs.clear()
+    
+    def invalidate(self, name):
+        """使某个名称（包括以它为路径/命名空间组成部分的名称）的缓存失效"""
+        self.generation += 1
+        if not self._nodes and not self._plugs:
+            return
+        
+        def matches(key):
+            return key == name or name in key.replace(':', '|').split('|')
+        
+        for key in [k for k in self._nodes if matches(k)]:
+            del self._nodes[key]
+        for key in [k for k in self._plugs if matches(k[0])]:
+            del self._plugs[key]
+    
+    # ============ 回调 ============
+    
+    def _on_name_changed(self, node, prev_name, *args):
+        if prev_name:
+            self.invalidate(prev_name)
+            if self._listeners:
+                name = om2.MFnDependencyNode(node).name()
+                path = om2.MDagPath.getAPathTo(node).fullPathName() if node.hasFn(om2.MFn.kDagNode) else None
+                for listener in list(self._listeners):
+                    listener.node_renamed(prev_name, name, path)
+    
+    def _on_node_removed(self, node, *args):
+        name = om2.MFnDependencyNode(node).name()
+        self.invalidate(name)
+        for listener in list(self._listeners):
+            listener.node_removed(name)
+    
+    def _on_node_added(self, *args):
+        # 新节点不会使已解析的名称失效（例如加载引用），只更新结构版本
+        self.generation += 1
+    
+    def _on_parent_changed(self, *args):
+        # DAG路径改变，子级的路径也会一起变化，直接清空
+        self.clear()
+    
+    def _on_scene_changed(self, *args):
+        self.scenes += 1
+        self.clear()
+    
+    # ============ 查询 ============
+    
+    @profiled('resolve')
+    def resolve(self, name):
+        """
+        解析节点名称
+        
+        Returns:
+            (MObjectHandle, MDagPath或None)，节点不存在时返回 None
+        """
+        entry = self._nodes.get(name)
+        if entry is not None and entry[0].isValid():
+            return entry
+        
+        sel = om2.MSelectionList()
+        try:
+            sel.add(name)
+        except RuntimeError:
+            self._nodes.pop(name, None)
+            return None
+        
+        obj = sel.getDependNode(0)
+        dag_path = sel.getDagPath(0) if obj.hasFn(om2.MFn.kDagNode) else None
+        entry = (om2.MObjectHandle(obj), dag_path)
+        self._nodes[name] = entry
+        return entry
+    
+    def exists(self, name):
+        return bool(name) and self.resolve(name) is not None
+    
+    def dag_path(self, name):
+        entry = self.resolve(name)
+        return entry[1] if entry else None
+    
+    def path_name(self, name):
+        """唯一的节点路径名（用于需要字符串的 cmds 调用）"""
+        entry = self.resolve(name)
+        if entry is None:
+            return None
+        if entry[1] is not None:
+            return entry[1].partialPathName()
+        return om2.MFnDependencyNode(entry[0].object()).name()
+    
+    @profiled('resolve')
+    def plug(self, name, attr):
+        """获取缓存的 MPlug（例如 'worldMatrix[0]'、'rotate'）"""
+        key = (name, attr)
+        entry = self._plugs.get(key)
+        if entry is not None and entry[0].isValid():
+            return entry[1]
+        
+        node = self.resolve(name)
+        if node is None:
+            return None
+        
+        sel = om2.MSelectionList()
+        sel.add(f'{self.path_name(name)}.{attr}')
+        plug = sel.getPlug(0)
+        self._plugs[key] = (node[0], plug)
+        return plug
+
+
+_resolver = None
+
+
+def get_resolver():
+    """获取全局节点解析缓存（首次使用时注册失效回调）"""
+    global _resolver
+    if _resolver is None:
+        _resolver = NodeResolver()
+        _resolver.install_callbacks()
+    return _resolver
+
+
 # ============================================================================
 # 工具函数 / Utility Functions
 # ============================================================================
 
+@profiled('read')
+def read_matrix_plug(plug):
+    """读取矩阵属性（在当前 DG 上下文中求值）"""
+    return om2.MFnMatrixData(plug.asMObject()).matrix()
+
+
+def get_world_mmatrix(obj):
+    """获取世界矩阵 (MMatrix)"""
+    return read_matrix_plug(get_resolver().plug(obj, 'worldMatrix[0]'))
+
+
+def get_parent_mmatrix(obj):
+    """获取父级世界矩阵 (MMatrix)，无父级时为单位矩阵"""
+    return read_matrix_plug(get_resolver().plug(obj, 'parentMatrix[0]'))
+
+
 def get_world_position(obj):
     """获取世界空间位置"""
-    return cmds.xform(obj, query=True, worldSpace=True, translation=True)
+    m = get_world_mmatrix(obj)
+    return [m.getElement(3, 0), m.getElement(3, 1), m.getElement(3, 2)]
 
 
+@profiled('read')
 def get_world_rotation(obj):
-    """获取世界空间旋转"""
-    return cmds.xform(obj, query=True, worldSpace=True, rotation=True)
+    """获取世界空间旋转（角度，按物体的旋转顺序，与 xform -q -ws -ro 相同）"""
+    rotate_order = get_resolver().plug(obj, 'rotateOrder').asInt()
+    quat = om2.MTransformationMatrix(get_world_mmatrix(obj)).rotation(asQuaternion=True)
+    euler = quat.asEulerRotation().reorder(rotate_order)
+    return [euler.x * RAD_TO_DEG, euler.y * RAD_TO_DEG, euler.z * RAD_TO_DEG]
 
 
 def get_world_matrix(obj):
     """获取世界矩阵"""
-    return cmds.xform(obj, query=True, worldSpace=True, matrix=True)
+    return list(get_world_mmatrix(obj))
+
+
+@profiled('write')
+def set_local_translation(obj, translation):
+    """设置局部位移（内部单位），一次写入 translate 复合属性"""
+    values = [om2.MDistance.internalToUI(v) for v in (translation[0], translation[1], translation[2])]
+    cmds.setAttr(f'{get_resolver().path_name(obj)}.translate', *values)
+
+
+@profiled('write')
+def set_local_euler(obj, euler):
+    """设置局部旋转（MEulerRotation，弧度），一次写入 rotate 复合属性"""
+    cmds.setAttr(
+        f'{get_resolver().path_name(obj)}.rotate',
+        euler.x * RAD_TO_DEG, euler.y * RAD_TO_DEG, euler.z * RAD_TO_DEG
+    )
+
+
+def set_local_rotation(obj, quat):
+    """按物体的旋转顺序设置局部旋转"""
+    rotate_order = get_resolver().plug(obj, 'rotateOrder').asInt()
+    set_local_euler(obj, quat.asEulerRotation().reorder(rotate_order))
 
 
 def set_world_position(obj, pos):
-    """设置世界空间位置"""
-    cmds.xform(obj, worldSpace=True, translation=pos)
+    """
+    设置世界空间位置
+    
+    位移对世界位置是线性的，因此 新位移 = 当前位移 + (目标 - 当前) × 父级逆矩阵，
+    对带轴心偏移的控制器同样精确
+    """
+    resolver = get_resolver()
+    current = get_world_position(obj)
+    parent_inv = read_matrix_plug(resolver.plug(obj, 'parentInverseMatrix[0]'))
+    delta = om2.MVector(pos[0] - current[0], pos[1] - current[1], pos[2] - current[2]) * parent_inv
+    
+    translate = resolver.plug(obj, 'translate')
+    set_local_translation(obj, [translate.child(i).asDouble() + delta[i] for i in range(3)])
 
 
 def set_world_rotation(obj, rot):
-    """设置世界空间旋转"""
-    cmds.xform(obj, worldSpace=True, rotation=rot)
+    """
+    设置世界空间旋转（角度，按物体的旋转顺序）
+    
+    世界旋转 = rotateAxis × rotate × (jointOrient × 父级)，括号内不随 rotate 改变，
+    因此 新rotate = rotateAxis⁻¹ × 目标 × 当前世界⁻¹ × rotateAxis × 当前rotate，
+    不需要读取 jointOrient 和父级
+    """
+    resolver = get_resolver()
+    rotate_order = resolver.plug(obj, 'rotateOrder').asInt()
+    rotate = resolver.plug(obj, 'rotate')
+    rotate_axis = resolver.plug(obj, 'rotateAxis')
+    
+    target = om2.MEulerRotation(math.radians(rot[0]), math.radians(rot[1]), math.radians(rot[2]), rotate_order)
+    current = om2.MEulerRotation(*[rotate.child(i).asDouble() for i in range(3)], rotate_order)
+    axis = om2.MEulerRotation(*[rotate_axis.child(i).asDouble() for i in range(3)]).asQuaternion()
+    world = om2.MTransformationMatrix(get_world_mmatrix(obj)).rotation(asQuaternion=True)
+    
+    quat = axis.inverse() * target.asQuaternion() * world.inverse() * axis * current.asQuaternion()
+    set_local_euler(obj, quat.asEulerRotation().reorder(rotate_order).closestSolution(current))
 
 
 def match_transform_matrix(source, target, translate=True, rotate=True):
@@ -231,39 +866,28 @@ def match_transform_matrix(source, target, translate=True, rotate=True):
         translate: 是否匹配位移
         rotate: 是否匹配旋转
     """
-    if not cmds.objExists(source) or not cmds.objExists(target):
+    resolver = get_resolver()
+    if not resolver.exists(source) or not resolver.exists(target):
         return False
     
-    target_matrix = get_world_matrix(target)
-    parent = cmds.listRelatives(source, parent=True)
-    
-    if parent:
-        parent_matrix = cmds.xform(parent[0], query=True, worldSpace=True, matrix=True)
-        parent_m = om2.MMatrix(parent_matrix)
-        target_m = om2.MMatrix(target_matrix)
-        local_m = target_m * parent_m.inverse()
-        transform_m = om2.MTransformationMatrix(local_m)
-        
-        if rotate:
-            rotation = transform_m.rotation(asQuaternion=False)
-            cmds.setAttr(f'{source}.rotateX', rotation.x * RAD_TO_DEG)
-            cmds.setAttr(f'{source}.rotateY', rotation.y * RAD_TO_DEG)
-            cmds.setAttr(f'{source}.rotateZ', rotation.z * RAD_TO_DEG)
-        
-        if translate:
-            translation = transform_m.translation(om2.MSpace.kTransform)
-            cmds.setAttr(f'{source}.translateX', translation.x)
-            cmds.setAttr(f'{source}.translateY', translation.y)
-            cmds.setAttr(f'{source}.translateZ', translation.z)
-    else:
-        cmds.xform(source, worldSpace=True, matrix=target_matrix)
+    # 局部矩阵 = 目标世界矩阵 × 父级逆矩阵（无父级时父级为单位矩阵）
+    target_m = get_world_mmatrix(target)
+    parent_inv = read_matrix_plug(resolver.plug(source, 'parentInverseMatrix[0]'))
+    transform_m = om2.MTransformationMatrix(target_m * parent_inv)
+    
+    if rotate:
+        set_local_rotation(source, transform_m.rotation(asQuaternion=True))
+    
+    if translate:
+        set_local_translation(source, transform_m.translation(om2.MSpace.kTransform))
     
     return True
 
 
 def match_transform_simple(source, target, translate=True, rotate=True):
     """简单变换匹配"""
-    if not cmds.objExists(source) or not cmds.objExists(target):
+    resolver = get_resolver()
+    if not resolver.exists(source) or not resolver.exists(target):
         return False
     
     if translate:
@@ -292,11 +916,12 @@ def match_rotation_with_offset(source, target, offset_data=None):
     Returns:
         bool: 成功返回True，失败返回False
     """
-    if not cmds.objExists(source) or not cmds.objExists(target):
+    resolver = get_resolver()
+    if not resolver.exists(source) or not resolver.exists(target):
         return False
     
     # 获取目标（Blend骨骼）的世界旋转四元数
-    target_world_m = om2.MMatrix(get_world_matrix(target))
+    target_world_m = get_world_mmatrix(target)
     target_transform = om2.MTransformationMatrix(target_world_m)
     target_quat = target_transform.rotation(asQuaternion=True)
     
@@ -315,33 +940,18 @@ def match_rotation_with_offset(source, target, offset_data=None):
     else:
         final_quat = target_quat
     
-    # 将四元数转换为欧拉角
-    final_euler = final_quat.asEulerRotation()
+    # 考虑source的父级空间，计算局部旋转（无父级时父级为单位矩阵）
+    parent_transform = om2.MTransformationMatrix(get_parent_mmatrix(source))
+    parent_quat = parent_transform.rotation(asQuaternion=True)
     
-    # 考虑source的父级空间，计算局部旋转
-    parent = cmds.listRelatives(source, parent=True)
-    if parent:
-        # 获取父级的世界旋转
-        parent_world_m = om2.MMatrix(cmds.xform(parent[0], q=True, ws=True, m=True))
-        parent_transform = om2.MTransformationMatrix(parent_world_m)
-        parent_quat = parent_transform.rotation(asQuaternion=True)
-        
-        # 局部旋转 = 父级逆 × 世界旋转
-        local_quat = parent_quat.inverse() * final_quat
-        local_euler = local_quat.asEulerRotation()
-        
-        cmds.setAttr(f'{source}.rotateX', local_euler.x * RAD_TO_DEG)
-        cmds.setAttr(f'{source}.rotateY', local_euler.y * RAD_TO_DEG)
-        cmds.setAttr(f'{source}.rotateZ', local_euler.z * RAD_TO_DEG)
-    else:
-        # 无父级时，直接使用世界旋转
-        cmds.setAttr(f'{source}.rotateX', final_euler.x * RAD_TO_DEG)
-        cmds.setAttr(f'{source}.rotateY', final_euler.y * RAD_TO_DEG)
-        cmds.setAttr(f'{source}.rotateZ', final_euler.z * RAD_TO_DEG)
+    # 局部旋转 = 父级逆 × 世界旋转
+    local_quat = parent_quat.inverse() * final_quat
+    set_local_rotation(source, local_quat)
     
     return True
 
 
+@profiled('math')
 def calculate_pole_vector_position(start_pos, mid_pos, end_pos, distance=1.0):
     """计算极向量位置"""
     start = om2.MVector(start_pos)
@@ -367,9 +977,9 @@ def calculate_pole_vector_position(start_pos, mid_pos, end_pos, distance=1.0):
 
 
 def get_preset_directory():
-    """获取预设存储目录"""
-    script_dir = cmds.internalVar(userScriptDir=True)
-    preset_dir = os.path.join(script_dir, 'fkik_match_presets')
+    """获取预设存储目录（可用环境变量 FKIK_PRESET_LIBRARY 指定共享的预设库）"""
+    preset_dir = os.environ.get('FKIK_PRESET_LIBRARY') or os.path.join(
+        cmds.internalVar(userScriptDir=True), 'fkik_match_presets')
     if not os.path.exists(preset_dir):
         os.makedirs(preset_dir)
     return preset_dir
@@ -386,39 +996,3926 @@ def undo_chunk():
 
 
 # ============================================================================
-# 肢体数据类 / Limb Data Class
+# API 命令 / API Command
 # ============================================================================
 
-class LimbData:
-    """存储单个肢体的FK/IK配置"""
+# fkikMatch 命令插件（fkik_match_cmd.py）
+MATCH_COMMAND = 'fkikMatch'
+MATCH_COMMAND_PLUGIN = 'fkik_match_cmd'
+
+_command_matcher = None
+_scene_matcher = None  # (场景存储状态, FKIKMatcher)：界面关闭时从场景存储加载的引擎，热键和命令共用
+
+
+def match_command_loaded():
+    """
+    fkikMatch 命令插件是否已加载
     
-    def __init__(self, name=''):
-        self.name = name
-        self.blend_joints = []  # 融合骨骼（参考来源）
-        self.fk_controls = []   # FK控制器（匹配目标）
-        self.ik_control = None  # IK控制器
-        self.pole_vector = None # 极向量
-        self.rotation_offset = None  # 旋转偏移量 [rx, ry, rz]（校准时记录）
+    加载后界面的全部匹配、烘焙和切换点匹配通过命令执行，
+    所有修改在一个 MDGModifier / MAnimCurveChange 中，撤销队列中只有一步
+    """
+    return bool(cmds.pluginInfo(MATCH_COMMAND_PLUGIN, query=True, loaded=True))
+
+
+def set_command_matcher(matcher):
+    """指定 fkikMatch 命令使用的 FKIKMatcher（界面打开时为界面的引擎）"""
+    global _command_matcher
+    _command_matcher = matcher
+    # 通过 exec 启动工具时本模块是 __main__，而插件导入的是 universal_fkik_match，两处都要指定
+    module = sys.modules.get('universal_fkik_match')
+    if module is not None and vars(module) is not globals():
+        module._command_matcher = matcher
+
+
+def _scene_store_state():
+    """场景存储的状态：(打开场景的次数, 存储写入次数, 存储节点是否存在)，任何一项改变时缓存的引擎过期"""
+    resolver = get_resolver()
+    return resolver.scenes, _store_writes, resolver.resolve(SCENE_STORE_NODE) is not None
+
+
+def get_command_matcher():
+    """
+    fkikMatch 命令使用的 FKIKMatcher：已指定的引擎，否则从场景加载肢体
     
-    def to_dict(self):
-        return {
-            'name': self.name,
-            'blend_joints': self.blend_joints,
-            'fk_controls': self.fk_controls,
-            'ik_control': self.ik_control,
-            'pole_vector': self.pole_vector,
-            'rotation_offset': self.rotation_offset
-        }
+    从场景加载的引擎（及其反向索引）缓存在模块中，热键和命令共用；新建/打开场景、存储节点被删除
+    或被其他引擎写入时重新加载。引擎自己写入（烘焙指纹、重命名后的名称）不会使缓存过期
+    """
+    global _scene_matcher
+    if _command_matcher is not None:
+        return _command_matcher
+    state = _scene_store_state()
+    if _scene_matcher is not None:
+        cached_state, matcher = _scene_matcher
+        own_write = cached_state[0] == state[0] and _store_source == _limb_ids(matcher.get_limbs())
+        if cached_state == state or (own_write and state[2]):
+            _scene_matcher = (state, matcher)
+            return matcher
+    matcher = FKIKMatcher()
+    matcher.load_from_scene()
+    _scene_matcher = (state, matcher)
+    return matcher
+
+
+# ============================================================================
+# 关键帧写入 / Key Writer
+# ============================================================================
+
+class AnimCurveWriter:
+    """
+    批量关键帧写入器
+    
+    先收集所有 (节点, 属性, 帧, 值)，提交时每条曲线只调用一次 MFnAnimCurve.addKeys。
+    缺失的曲线自动创建；已有关键帧的帧只修改数值，保留原有切线设置。
+    整批修改记录在一个 MDGModifier（创建/连接曲线）和一个 MAnimCurveChange（关键帧）中，
+    可以通过 undo() / redo() 整体撤销或重做。
+    set_value 修改的属性当前值也记录在同一个 MDGModifier 中。
+    
+    数值使用内部单位：角度为弧度，长度为厘米。
+    """
+    
+    def __init__(self):
+        self._keys = {}  # {(节点, 属性): ([帧], [值])}
+        self._values = []  # [(节点, 属性, 值)]
+        self.modifier = None
+        self.change = None
+        self.fallback_plugs = []  # 被其他节点驱动（约束/动画层）的属性，改用 setKeyframe
+    
+    def __len__(self):
+        return sum(len(times) for times, values in self._keys.values())
+    
+    def add(self, node, attr, times, values):
+        """添加一组关键帧"""
+        entry = self._keys.setdefault((node, attr), ([], []))
+        entry[0].extend(times)
+        entry[1].extend(values)
+    
+    def add_key(self, node, attr, time_value, value):
+        """添加单个关键帧"""
+        self.add(node, attr, [time_value], [value])
+    
+    def set_value(self, node, attr, value):
+        """修改属性的当前值（相当于 setAttr），commit 时与关键帧一起写入"""
+        self._values.append((node, attr, value))
+    
+    @profiled('key')
+    def commit(self):
+        """
+        写入所有收集的关键帧
+        
+        Returns:
+            int: 写入的关键帧数量
+        """
+        if not self._keys and not self._values:
+            return 0
+        
+        resolver = get_resolver()
+        unit = om2.MTime.uiUnit()
+        if self.modifier is None:
+            self.modifier = om2.MDGModifier()
+            self.change = om2anim.MAnimCurveChange()
+        
+        # 属性值排在新建曲线之前：撤销时先断开曲线，再恢复原来的值
+        for node, attr, value in self._values:
+            plug = resolver.plug(node, attr)
+            if plug is not None:
+                self.modifier.newPlugValueDouble(plug, value)
+        
+        count = 0
+        for (node, attr), (times, values) in self._keys.items():
+            plug = resolver.plug(node, attr)
+            if plug is None:
+                continue
+            
+            curve = self._find_or_create_curve(plug)
+            if curve is None:
+                self._set_keyframes(node, attr, plug, times, values)
+                count += len(times)
+                continue
+            
+            curve_fn = om2anim.MFnAnimCurve(curve)
+            has_keys = curve_fn.numKeys > 0
+            new_times = om2.MTimeArray()
+            new_values = om2.MDoubleArray()
+            for frame, value in sorted(zip(times, values)):
+                mtime = om2.MTime(frame, unit)
+                index = curve_fn.find(mtime) if has_keys else None
+                if index is not None:
+                    # 已有关键帧：只改数值，保留切线
+                    curve_fn.setValue(index, value, self.change)
+                else:
+                    new_times.append(mtime)
+                    new_values.append(value)
+            
+            if len(new_times):
+                curve_fn.addKeys(
+                    new_times, new_values,
+                    om2anim.MFnAnimCurve.kTangentGlobal, om2anim.MFnAnimCurve.kTangentGlobal,
+                    True, self.change
+                )
+            count += len(times)
+        
+        # 连接新建的曲线，写入属性值
+        self.modifier.doIt()
+        self._keys.clear()
+        self._values = []
+        return count
+    
+    def undo(self):
+        """撤销整批写入"""
+        if self.change is not None:
+            self.change.undoIt()
+        if self.modifier is not None:
+            self.modifier.undoIt()
+    
+    def redo(self):
+        """重做整批写入"""
+        if self.modifier is not None:
+            self.modifier.doIt()
+        if self.change is not None:
+            self.change.redoIt()
+    
+    def _find_or_create_curve(self, plug):
+        """
+        查找驱动属性的动画曲线，没有输入连接时新建
+        
+        被其他节点（约束的 pairBlend、动画层等）驱动时返回 None
+        """
+        source = plug.source()
+        if not source.isNull:
+            node = source.node()
+            return node if node.hasFn(om2.MFn.kAnimCurve) else None
+        
+        curve_fn = om2anim.MFnAnimCurve()
+        return curve_fn.create(plug, curve_fn.timedAnimCurveTypeForPlug(plug), self.modifier)
+    
+    def _set_keyframes(self, node, attr, plug, times, values):
+        """回退：逐个 setKeyframe（数值转换为界面单位）"""
+        if (node, attr) not in self.fallback_plugs:
+            self.fallback_plugs.append((node, attr))
+        plug_name = f'{get_resolver().path_name(node)}.{attr}'
+        for frame, value in zip(times, values):
+            cmds.setKeyframe(plug_name, time=frame, value=to_ui_value(plug, value))
+
+
+def to_ui_value(plug, value):
+    """内部单位 → 界面单位（角度/长度属性）"""
+    attribute = plug.attribute()
+    if attribute.hasFn(om2.MFn.kUnitAttribute):
+        unit_type = om2.MFnUnitAttribute(attribute).unitType()
+        if unit_type == om2.MFnUnitAttribute.kAngle:
+            return om2.MAngle.internalToUI(value)
+        if unit_type == om2.MFnUnitAttribute.kDistance:
+            return om2.MDistance.internalToUI(value)
+    return value
+
+
+@profiled('key')
+def key_controls(nodes, attribute=None):
+    """一次 setKeyframe 调用为多个控制器打Key（当前帧，进入当前撤销块）"""
+    nodes = [node for node in nodes if node]
+    if not nodes:
+        return
+    if attribute:
+        cmds.setKeyframe(nodes, attribute=attribute)
+    else:
+        cmds.setKeyframe(nodes)
+
+
+# ============================================================================
+# 帧范围烘焙 / Frame Range Bake
+# ============================================================================
+
+BAKE_IK_TO_FK = 'ik_to_fk'
+BAKE_FK_TO_IK = 'fk_to_ik'
+
+
+def get_plug(node, attr):
+    """获取属性的 MPlug（经由解析缓存）"""
+    return get_resolver().plug(node, attr)
+
+
+@contextmanager
+def dg_time_context(frame):
+    """
+    上下文管理器：在指定帧的 DG 上下文中读取属性
+
+    不修改 currentTime，不触发视图刷新，只在读取时按该时间求值
+    """
+    context = om2.MDGContext(om2.MTime(frame, om2.MTime.uiUnit()))
+    previous = context.makeCurrent()
+    try:
+        yield context
+    finally:
+        previous.makeCurrent()
+
+
+def get_frame_range():
+    """获取时间滑块的播放范围"""
+    start = cmds.playbackOptions(query=True, minTime=True)
+    end = cmds.playbackOptions(query=True, maxTime=True)
+    return int(start), int(end)
+
+
+class MatchTarget:
+    """
+    一个需要写入位移/旋转的控制器
+
+    mode:
+        'ik' - IK控制器，对齐Blend末端（位置 + 带偏移的旋转）
+        'pv' - 极向量，位置由Blend链平面计算
+        'fk' - FK控制器，旋转（根部还有位移）对齐对应的Blend骨骼
+    """
+
+    def __init__(self, node, mode, sources, translate=False, rotate=True, offset=None):
+        self.node = node
+        self.mode = mode
+        self.sources = sources      # 参考的Blend骨骼
+        self.translate = translate
+        self.rotate = rotate
+        self.offset = offset        # IK旋转偏移（四元数或旧的矩阵格式）
+        self.rotate_order = 0
+        self.long_name = node
+        self.ancestor = None        # 同批次中最近的祖先目标（其改写会影响本目标的父级）
+        self.has_dependents = False
+
+
+def collect_match_targets(limbs, direction):
+    """
+    收集一组肢体在指定方向上需要写入的所有控制器
+
+    目标按层级深度排序，保证祖先控制器先于子控制器求解
+    """
+    resolver = get_resolver()
+    targets = []
+    for limb in limbs:
+        if not limb.blend_joints or not all(resolver.exists(j) for j in limb.blend_joints):
+            continue
+
+        if direction == BAKE_IK_TO_FK:
+            if not limb.ik_control or not resolver.exists(limb.ik_control):
+                continue
+            # 与 match_limb_ik_to_fk 一致：先极向量，再IK控制器
+            if limb.pole_vector and resolver.exists(limb.pole_vector) and len(limb.blend_joints) >= 3:
+                chain = [limb.blend_joints[0], limb.blend_joints[1], limb.blend_joints[-1]]
+                targets.append(MatchTarget(limb.pole_vector, 'pv', chain, translate=True, rotate=False))
+            targets.append(MatchTarget(
+                limb.ik_control, 'ik', [limb.blend_joints[-1]],
+                translate=True, rotate=True, offset=limb.rotation_offset
+            ))
+        else:
+            for i, fk_ctrl in enumerate(limb.fk_controls[:len(limb.blend_joints)]):
+                if resolver.exists(fk_ctrl):
+                    # 只有根部FK控制器需要匹配位移
+                    targets.append(MatchTarget(fk_ctrl, 'fk', [limb.blend_joints[i]], translate=(i == 0)))
+
+    # 去重（多个肢体共用同一个控制器时只写一次）
+    unique = {}
+    for target in targets:
+        target.long_name = resolver.dag_path(target.node).fullPathName()
+        unique.setdefault(target.long_name, target)
+    targets = sorted(unique.values(), key=lambda t: t.long_name.count('|'))
+
+    for target in targets:
+        if target.rotate:
+            target.rotate_order = resolver.plug(target.node, 'rotateOrder').asInt()
+
+        # 查找同批次中最近的祖先目标
+        path = target.long_name
+        while '|' in path:
+            path = path.rsplit('|', 1)[0]
+            if path in unique:
+                target.ancestor = unique[path]
+                target.ancestor.has_dependents = True
+                break
+
+    return targets
+
+
+@profiled('read')
+def sample_targets(targets, frames=None, as_arrays=False, known=None, outputs=None):
+    """
+    读取阶段：采样目标求解需要的全部数据
+
+    frames 为 None 时在当前帧读取一次；否则通过 MDGContext 按时间逐帧读取。
+    as_arrays 为 True 时（需要 NumPy）直接写入预先分配的连续 float64 数组，不生成 MMatrix 列表；
+    此时 known 中的节点（{节点: (N, 16) 数组}，例如缓存的Blend骨骼）不再读取，
+    outputs 中的节点读取到给定的数组中（例如新建的缓存条目）
+
+    Returns:
+        dict: {'world': {节点: [MMatrix]}, 'parent': {节点: [MMatrix]}, 'translate': {节点: [[x, y, z]]}}
+              as_arrays 时矩阵为 (N, 4, 4) 数组，位移为 (N, 3) 数组，并且 'arrays' 为 True
+    """
+    if as_arrays:
+        return _sample_target_arrays(targets, frames, known, outputs)
+
+    world_plugs, parent_plugs, translate_plugs = _sample_plugs(targets)
+
+    samples = {
+        'world': {node: [] for node in world_plugs},
+        'parent': {node: [] for node in parent_plugs},
+        'translate': {node: [] for node in translate_plugs},
+    }
+
+    def read():
+        for node, plug in world_plugs.items():
+            samples['world'][node].append(read_matrix_plug(plug))
+        for node, plug in parent_plugs.items():
+            samples['parent'][node].append(read_matrix_plug(plug))
+        for node, plug in translate_plugs.items():
+            samples['translate'][node].append([plug.child(i).asDouble() for i in range(3)])
+
+    if frames is None:
+        read()
+    else:
+        for frame in frames:
+            with dg_time_context(frame):
+                read()
+    return samples
+
+
+def _sample_plugs(targets):
+    """
+    采样需要读取的属性：{节点: 世界矩阵}、{节点: 父级矩阵}、{节点: 位移}
+    
+    需要世界矩阵的节点：所有参考骨骼 + 按世界位置对齐的控制器 + 有子级目标的控制器
+    """
+    matrix_nodes = {j for t in targets for j in t.sources}
+    matrix_nodes.update(t.node for t in targets if t.has_dependents or t.mode in ('pv', 'ik'))
+    return (
+        {node: get_plug(node, 'worldMatrix[0]') for node in matrix_nodes},
+        {t.node: get_plug(t.node, 'parentMatrix[0]') for t in targets},
+        {t.node: get_plug(t.node, 'translate') for t in targets if t.mode in ('pv', 'ik')},
+    )
+
+
+def _sample_target_arrays(targets, frames, known=None, outputs=None):
+    """按时间采样到连续的 float64 数组（每个节点一块 (N, 16) 缓冲区，逐帧原地填充）；frames 为 None 时在当前帧读取一行"""
+    kernel = get_kernel()
+    known = known or {}
+    outputs = outputs or {}
+    world_plugs, parent_plugs, translate_plugs = _sample_plugs(targets)
+    world_plugs = {node: plug for node, plug in world_plugs.items() if node not in known}
+    for node in outputs:
+        if node not in world_plugs and node not in known:
+            world_plugs[node] = get_plug(node, 'worldMatrix[0]')
+    count = 1 if frames is None else len(frames)
+    world = {node: outputs[node] if node in outputs else kernel.matrix_buffer(count) for node in world_plugs}
+    world.update(known)
+    parent = {node: kernel.matrix_buffer(count) for node in parent_plugs}
+    translate = {node: kernel.vector_buffer(count) for node in translate_plugs}
+    
+    for index in range(count):
+        with nullcontext() if frames is None else dg_time_context(frames[index]):
+            for node, plug in world_plugs.items():
+                world[node][index] = list(read_matrix_plug(plug))
+            for node, plug in parent_plugs.items():
+                parent[node][index] = list(read_matrix_plug(plug))
+            for node, plug in translate_plugs.items():
+                translate[node][index] = [plug.child(i).asDouble() for i in range(3)]
+    
+    return {
+        'world': {node: buffer.reshape(count, 4, 4) for node, buffer in world.items()},
+        'parent': {node: buffer.reshape(count, 4, 4) for node, buffer in parent.items()},
+        'translate': translate,
+        'arrays': True,
+    }
+
+
+def solve_target(target, world, parent_m, new_worlds, current_translate=None, previous_euler=None):
+    """
+    根据采样的世界矩阵计算单个目标的局部位移和旋转
+
+    计算方式与逐帧匹配函数一致（set_world_position / match_transform_matrix / match_rotation_with_offset）
+
+    Args:
+        target: MatchTarget
+        world: {节点: MMatrix} 本帧采样的世界矩阵
+        parent_m: 目标的父级世界矩阵（采样值）
+        new_worlds: {节点: MMatrix} 本帧已求解目标的新世界矩阵
+        current_translate: 目标当前的位移（'pv'/'ik' 按世界位置对齐时使用）
+        previous_euler: 上一帧的欧拉角，用于保持旋转连续
+
+    Returns:
+        (translate, euler): 局部位移 [x, y, z]（或None）和 MEulerRotation（或None）
+    """
+    original_parent = parent_m
+    if target.ancestor is not None:
+        # 祖先控制器在本批次中被改写：父级 = 相对矩阵 × 祖先的新世界矩阵
+        ancestor = target.ancestor.node
+        parent_m = original_parent * world[ancestor].inverse() * new_worlds[ancestor]
+    parent_inv = parent_m.inverse()
+
+    translate = None
+    world_pos = None
+    local_quat = None
+
+    if target.mode == 'pv':
+        positions = [om2.MTransformationMatrix(world[j]).translation(om2.MSpace.kWorld) for j in target.sources]
+        world_pos = om2.MPoint(calculate_pole_vector_position(*positions))
+
+    elif target.mode == 'ik':
+        target_m = world[target.sources[0]]
+        world_pos = om2.MPoint(om2.MTransformationMatrix(target_m).translation(om2.MSpace.kWorld))
+
+        offset_data = target.offset
+        if offset_data and len(offset_data) in (4, 16):
+            if len(offset_data) == 4:
+                offset_quat = om2.MQuaternion(offset_data[0], offset_data[1], offset_data[2], offset_data[3])
+                final_quat = offset_quat * om2.MTransformationMatrix(target_m).rotation(asQuaternion=True)
+            else:
+                final_quat = om2.MTransformationMatrix(om2.MMatrix(offset_data) * target_m).rotation(asQuaternion=True)
+            parent_quat = om2.MTransformationMatrix(parent_m).rotation(asQuaternion=True)
+            local_quat = parent_quat.inverse() * final_quat
+        else:
+            local_quat = om2.MTransformationMatrix(target_m * parent_inv).rotation(asQuaternion=True)
+
+    else:
+        local_m = om2.MTransformationMatrix(world[target.sources[0]] * parent_inv)
+        local_quat = local_m.rotation(asQuaternion=True)
+        if target.translate:
+            local_t = local_m.translation(om2.MSpace.kTransform)
+            translate = [local_t.x, local_t.y, local_t.z]
+
+    if world_pos is not None:
+        # 与 set_world_position 相同：位移对世界位置是线性的，对带轴心偏移的控制器同样精确
+        # 新位移 = 当前位移 + 目标点 × 新父级逆 − 当前位置 × 原父级逆
+        current_pos = om2.MPoint(om2.MTransformationMatrix(world[target.node]).translation(om2.MSpace.kWorld))
+        target_local = world_pos * parent_inv
+        current_local = current_pos * original_parent.inverse()
+        translate = [current_translate[i] + target_local[i] - current_local[i] for i in range(3)]
+
+    euler = None
+    if local_quat is not None:
+        euler = local_quat.asEulerRotation().reorder(target.rotate_order)
+        if previous_euler is not None:
+            euler = euler.closestSolution(previous_euler)
+
+    if target.has_dependents:
+        # 记录新的世界矩阵，供子级目标计算父级
+        local_tm = om2.MTransformationMatrix(world[target.node] * original_parent.inverse())
+        if local_quat is not None:
+            local_tm.setRotation(local_quat)
+        if target.mode == 'fk' and translate is not None:
+            local_tm.setTranslation(om2.MVector(translate), om2.MSpace.kTransform)
+        new_world = om2.MTransformationMatrix(local_tm.asMatrix() * parent_m)
+        if world_pos is not None:
+            new_world.setTranslation(om2.MVector(world_pos), om2.MSpace.kWorld)
+        new_worlds[target.node] = new_world.asMatrix()
+
+    return translate, euler
+
+
+def iter_solved_frames(targets, frames, samples, previous=None):
+    """
+    逐帧求解（om2）
+
+    previous 为 {节点: MEulerRotation}，分块烘焙时在块之间传递以保持旋转连续（原地更新）
+
+    Yields:
+        (帧, [(target, translate, euler)])，数值为内部单位
+    """
+    previous = {} if previous is None else previous
+    for index, frame in enumerate(frames):
+        world = {node: matrices[index] for node, matrices in samples['world'].items()}
+        new_worlds = {}
+        results = []
+        for target in targets:
+            current_translate = samples['translate'].get(target.node)
+            translate, euler = solve_target(
+                target, world, samples['parent'][target.node][index], new_worlds,
+                current_translate[index] if current_translate else None,
+                previous.get(target.node)
+            )
+            if euler is not None:
+                previous[target.node] = euler
+            results.append((target, translate, euler))
+        yield frame, results
+
+
+def channel_values(translate, euler):
+    """求解结果 → [(属性, 数值)]（内部单位）"""
+    values = []
+    if translate is not None:
+        values.extend(zip(('translateX', 'translateY', 'translateZ'), translate))
+    if euler is not None:
+        values.extend(zip(('rotateX', 'rotateY', 'rotateZ'), (euler.x, euler.y, euler.z)))
+    return values
+
+
+def solved_channels(target, keys, index=0):
+    """从 solve_targets 的结果中取出目标在第 index 帧的 (translate, euler)，与 iter_solved_frames 的格式相同"""
+    translate = euler = None
+    if (target.node, 'translateX') in keys:
+        translate = [keys[(target.node, attr)][1][index] for attr in TRANSLATE_ATTRS]
+    if (target.node, 'rotateX') in keys:
+        x, y, z = (keys[(target.node, attr)][1][index] for attr in ROTATE_ATTRS)
+        euler = om2.MEulerRotation(x, y, z, target.rotate_order)
+    return translate, euler
+
+
+def _solve_bake_per_frame(targets, frames, samples, previous=None):
+    """逐帧求解（om2），返回 {(节点, 属性): ([帧], [值])}，数值为内部单位"""
+    keys = {}
+    for frame, results in iter_solved_frames(targets, frames, samples, previous):
+        for target, translate, euler in results:
+            for attr, value in channel_values(translate, euler):
+                times, key_values = keys.setdefault((target.node, attr), ([], []))
+                times.append(frame)
+                key_values.append(value)
+    return keys
+
+
+# 计算阶段的工作线程数，1 表示只在主线程计算；可用环境变量 FKIK_SOLVE_WORKERS 指定
+SOLVE_WORKERS = max(1, int(os.environ.get('FKIK_SOLVE_WORKERS') or min(4, os.cpu_count() or 1)))
+# 一层目标的总行数（目标 × 帧）达到该值才分到线程池；更小的批次线程调度的开销超过收益
+SOLVE_PARALLEL_ROWS = 4096
+
+TRANSLATE_ATTRS = ('translateX', 'translateY', 'translateZ')
+ROTATE_ATTRS = ('rotateX', 'rotateY', 'rotateZ')
+
+_solve_pool = None
+
+
+def set_solve_workers(count):
+    """设置计算阶段的工作线程数（至少 1），关闭已有的线程池"""
+    global SOLVE_WORKERS, _solve_pool
+    SOLVE_WORKERS = max(1, int(count))
+    if _solve_pool is not None:
+        _solve_pool.shutdown()
+        _solve_pool = None
+    return SOLVE_WORKERS
+
+
+def _get_solve_pool():
+    global _solve_pool
+    if _solve_pool is None:
+        _solve_pool = ThreadPoolExecutor(SOLVE_WORKERS, thread_name_prefix='fkik_solve')
+    return _solve_pool
+
+
+def _solve_levels(targets):
+    """
+    把目标分成可以一起计算的批次，按层级返回 [[批次]]
+
+    层级为目标在同批次中祖先链的深度，同层的目标互不依赖；
+    同一批次的目标模式、旋转顺序、偏移格式和写入的通道相同，采样可以首尾拼接后一次计算
+    """
+    depths = {}
+    levels = []
+    for target in targets:
+        depth = 0 if target.ancestor is None else depths[target.ancestor] + 1
+        depths[target] = depth
+        offset = target.offset if target.mode == 'ik' else None
+        kind = (target.mode, target.rotate_order, len(offset) if offset and len(offset) in (4, 16) else 0,
+                target.translate, target.has_dependents)
+        if depth == len(levels):
+            levels.append({})
+        levels[depth].setdefault(kind, []).append(target)
+    return [list(level.values()) for level in levels]
+
+
+def _solve_batch(batch, samples, new_worlds, count):
+    """
+    计算一个批次：各目标的采样（每个 count 行）首尾拼接，一次计算后再按目标拆开
+
+    只做 NumPy 运算、不访问场景，可以在工作线程中执行
+
+    Returns:
+        (keys, worlds): {(节点, 属性): [值]}，有子级目标的目标的新世界矩阵 {节点: (count, 4, 4)}
+    """
+    kernel = get_kernel()
+    world_arrays = samples['world']
+    first = batch[0]
+
+    def stacked(nodes):
+        return kernel.stack_rows([world_arrays[node] for node in nodes])
+
+    original_parent = kernel.stack_rows([samples['parent'][t.node] for t in batch])
+    parent_m = original_parent
+    if first.ancestor is not None:
+        # 祖先控制器在本批次中被改写：父级 = 相对矩阵 × 祖先的新世界矩阵
+        parent_m = kernel.matrix_product(
+            kernel.local_matrices(original_parent, stacked(t.ancestor.node for t in batch)),
+            kernel.stack_rows([new_worlds[t.ancestor.node] for t in batch])
+        )
+    parent_inv = kernel.inverse_matrices(parent_m)
+
+    translate = None
+    world_pos = None
+    quats = None
+    if first.mode == 'pv':
+        chain = [stacked(t.sources[i] for t in batch) for i in range(3)]
+        world_pos = kernel.pole_vector_positions(*chain)
+
+    elif first.mode == 'ik':
+        end_m = stacked(t.sources[0] for t in batch)
+        world_pos = kernel.translations(end_m)
+        offset_size = len(first.offset) if first.offset else 0
+        if offset_size == 4:
+            offsets = kernel.repeat_rows([t.offset for t in batch], count)
+            quats = kernel.local_quaternions(kernel.apply_rotation_offset(offsets, end_m), parent_m)
+        elif offset_size == 16:
+            offsets = kernel.repeat_rows([t.offset for t in batch], count)
+            final_q = kernel.matrices_to_quaternions(kernel.matrix_product(offsets, end_m))
+            quats = kernel.local_quaternions(final_q, parent_m)
+        else:
+            quats = kernel.matrices_to_quaternions(kernel.matrix_product(end_m, parent_inv))
+
+    else:
+        local_m = kernel.matrix_product(stacked(t.sources[0] for t in batch), parent_inv)
+        quats = kernel.matrices_to_quaternions(local_m)
+        if first.translate:
+            translate = kernel.translations(local_m)
+
+    current_world = None
+    if world_pos is not None or first.has_dependents:
+        current_world = stacked(t.node for t in batch)
+
+    if world_pos is not None:
+        # 新位移 = 当前位移 + 目标点 × 新父级逆 − 当前位置 × 原父级逆
+        current_local = kernel.transform_points(
+            kernel.translations(current_world), kernel.inverse_matrices(original_parent)
+        )
+        translate = (kernel.stack_rows([samples['translate'][t.node] for t in batch])
+                     + kernel.transform_points(world_pos, parent_inv) - current_local)
+
+    new_world = None
+    if first.has_dependents:
+        original_local = kernel.local_matrices(current_world, original_parent)
+        new_local = kernel.compose_matrices(
+            quats if quats is not None else kernel.matrices_to_quaternions(original_local),
+            translate if first.mode == 'fk' and translate is not None else kernel.translations(original_local),
+            kernel.matrix_scales(original_local)
+        )
+        new_world = kernel.matrix_product(new_local, parent_m)
+        if world_pos is not None:
+            new_world[:, 3, :3] = world_pos
+
+    euler = None
+    if quats is not None:
+        euler = kernel.unwrap_euler(kernel.quaternions_to_euler(quats, first.rotate_order), len(batch), first.rotate_order)
+
+    keys = {}
+    worlds = {}
+    for index, target in enumerate(batch):
+        rows = slice(index * count, (index + 1) * count)
+        if new_world is not None:
+            worlds[target.node] = new_world[rows]
+        if translate is not None:
+            for axis, attr in enumerate(TRANSLATE_ATTRS):
+                keys[(target.node, attr)] = translate[rows, axis].tolist()
+        if euler is not None:
+            for axis, attr in enumerate(ROTATE_ATTRS):
+                keys[(target.node, attr)] = euler[rows, axis].tolist()
+    return keys, worlds
+
+
+def _solve_bake_vectorized(targets, frames, samples):
+    """
+    向量化求解（fkik_kernel）
+
+    目标按层级分批（见 _solve_levels），每批的整段帧一次计算；各层依次计算（子级需要祖先的新世界矩阵）。
+    一层的数据量足够大且 SOLVE_WORKERS 大于 1 时，批次按目标切分到线程池并行计算（NumPy 运算期间释放 GIL），
+    结果按目标顺序排列，与线程数无关。
+    与 solve_target 使用相同的公式，欧拉角通过展开保持连续，数值为内部单位。
+    samples 需要由 sample_targets(..., as_arrays=True) 采样
+    """
+    count = len(frames)
+    workers = SOLVE_WORKERS
+    new_worlds = {}
+    solved = {}
+    for level in _solve_levels(targets):
+        parallel = workers > 1 and sum(len(batch) for batch in level) * count >= SOLVE_PARALLEL_ROWS
+        parts = []
+        for batch in level:
+            pieces = min(workers, len(batch), len(batch) * count // SOLVE_PARALLEL_ROWS) if parallel else 1
+            size = -(-len(batch) // max(1, pieces))
+            parts.extend(batch[i:i + size] for i in range(0, len(batch), size))
+        solve = functools.partial(_solve_batch, samples=samples, new_worlds=new_worlds, count=count)
+        results = _get_solve_pool().map(solve, parts) if parallel and len(parts) > 1 else map(solve, parts)
+        for keys, worlds in results:
+            solved.update(keys)
+            new_worlds.update(worlds)
+
+    keys = {}
+    for target in targets:
+        for attr in TRANSLATE_ATTRS + ROTATE_ATTRS:
+            values = solved.get((target.node, attr))
+            if values is not None:
+                keys[(target.node, attr)] = (frames, values)
+    return keys
+
+
+@profiled('math')
+def solve_targets(targets, frames, samples, previous=None):
+    """
+    计算阶段：求解所有目标在所有帧上的数值
+
+    采样为 float64 数组时整段向量化并按批次并行（见 _solve_bake_vectorized），
+    否则逐帧 om2（previous 见 iter_solved_frames）
+
+    Returns:
+        dict: {(节点, 属性): ([帧], [值])}，数值为内部单位
+    """
+    if samples.get('arrays'):
+        return _solve_bake_vectorized(targets, frames, samples)
+    return _solve_bake_per_frame(targets, frames, samples, previous)
+
+
+# 流式烘焙每块的帧数（采样缓冲区和待写入的关键帧只保留一块，内存占用与镜头长度无关）
+BAKE_CHUNK_SIZE = 480
+
+
+def iter_baked_chunks(targets, frames, chunk_size=BAKE_CHUNK_SIZE, previous=None, timings=None, matrices=None):
+    """
+    流式烘焙：按固定大小的帧块采样并求解，每次产出一块的关键帧
+    
+    有 NumPy 时每块采样到连续的 float64 数组并向量化求解，否则逐帧 om2。
+    旋转在块之间保持连续：逐帧求解时传递上一帧的欧拉角，向量化求解时按需整块换成另一组等价解并平移 2π 的整数倍。
+    
+    Args:
+        targets: collect_match_targets 的结果
+        frames: 帧列表（连续片段）
+        chunk_size: 每块的帧数
+        previous: {(节点, 旋转属性): 值} 片段开始前一帧的旋转，用于衔接已有的关键帧
+        timings: 可选的 {'sample': 秒, 'solve': 秒}，累加各阶段耗时
+        matrices: {骨骼: ((N, 16) 数组, 是否已有数据)}，见 open_blend_cache；
+                  已有数据的骨骼直接读取数组，否则采样时顺便填入数组
+    
+    Yields:
+        (块的帧列表, {(节点, 属性): ([帧], [值])})，数值为内部单位
+    """
+    use_arrays = get_kernel() is not None
+    previous = dict(previous or {})
+    eulers = {}
+    rotate_orders = {target.node: target.rotate_order for target in targets if target.rotate}
+    for index in range(0, len(frames), max(1, chunk_size)):
+        chunk = frames[index:index + chunk_size]
+        end = index + len(chunk)
+        known = {node: buffer[index:end] for node, (buffer, cached) in (matrices or {}).items() if cached}
+        outputs = {node: buffer[index:end] for node, (buffer, cached) in (matrices or {}).items() if not cached}
+        time_start = time.perf_counter()
+        samples = sample_targets(targets, chunk, use_arrays, known, outputs)
+        time_sampled = time.perf_counter()
+        keys = solve_targets(targets, chunk, samples, eulers)
+        del samples
+        _align_rotation_keys(keys, previous, rotate_orders)
+        if timings is not None:
+            timings['sample'] = timings.get('sample', 0.0) + time_sampled - time_start
+            timings['solve'] = timings.get('solve', 0.0) + time.perf_counter() - time_sampled
+        yield chunk, keys
+
+
+# 各旋转顺序（rotateOrder 枚举）的中间轴，另一组等价解中该轴取 π − 角度，其余两轴 +π
+ROTATE_ORDER_MIDDLE_AXIS = (1, 2, 0, 2, 0, 1)
+
+
+def _euler_distance(a, b):
+    """各通道差值折算到 [-π, π] 后的绝对值之和（closestSolution 的比较标准）"""
+    return sum(abs(math.remainder(x - y, 2.0 * math.pi)) for x, y in zip(a, b))
+
+
+def _align_rotation_keys(keys, previous, rotate_orders=None):
+    """
+    使旋转与 previous 中前一帧的值连续；然后把每条曲线的最后一个值写回 previous
+
+    rotate_orders 为 {节点: 旋转顺序}：三个旋转通道都有前一帧的值时，如果第一帧的另一组等价解离前一帧更近，
+    整段换成另一组解（与 closestSolution 相同；段内已经连续，整段切换后仍然连续）。
+    之后每个通道整体平移 2π 的整数倍
+    """
+    for node, rotate_order in (rotate_orders or {}).items():
+        channels = [keys.get((node, attr)) for attr in ROTATE_ATTRS]
+        last = [previous.get((node, attr)) for attr in ROTATE_ATTRS]
+        if None in channels or None in last or not channels[0][1]:
+            continue
+        first = [values[0] for _, values in channels]
+        middle = ROTATE_ORDER_MIDDLE_AXIS[rotate_order]
+        alternate = [math.pi - value if axis == middle else value + math.pi for axis, value in enumerate(first)]
+        if _euler_distance(alternate, last) < _euler_distance(first, last):
+            for axis, (attr, (times, values)) in enumerate(zip(ROTATE_ATTRS, channels)):
+                if axis == middle:
+                    values = [math.pi - value for value in values]
+                else:
+                    values = [value + math.pi for value in values]
+                keys[(node, attr)] = (times, values)
+
+    for (node, attr), (times, values) in keys.items():
+        if attr not in ROTATE_ATTRS or not values:
+            continue
+        last = previous.get((node, attr))
+        if last is not None:
+            turns = round((last - values[0]) / (2.0 * math.pi))
+            if turns:
+                shift = turns * 2.0 * math.pi
+                values = [value + shift for value in values]
+                keys[(node, attr)] = (times, values)
+        previous[(node, attr)] = values[-1]
+
+
+def read_rotation_values(targets, frame):
+    """读取目标在某一帧的旋转值（内部单位），{(节点, 旋转属性): 值}"""
+    with dg_time_context(frame):
+        return {
+            (target.node, attr): get_plug(target.node, attr).asDouble()
+            for target in targets if target.rotate for attr in ROTATE_ATTRS
+        }
+
+
+# ============================================================================
+# 增量烘焙 / Incremental Bake
+# ============================================================================
+
+# 烘焙指纹的帧块大小（按绝对帧号对齐，不同范围的烘焙可以复用相同的块）
+BAKE_BLOCK_SIZE = 24
+
+
+def frame_blocks(frames, block_size=BAKE_BLOCK_SIZE):
+    """把帧列表按绝对帧号分块，返回 [[帧]]"""
+    blocks = {}
+    for frame in frames:
+        blocks.setdefault(frame // block_size, []).append(frame)
+    return list(blocks.values())
+
+
+def node_anim_curves(node):
+    """直接驱动节点属性的动画曲线 [(属性名, MFnAnimCurve)]，按属性名排序"""
+    entry = get_resolver().resolve(node)
+    if entry is None:
+        return []
+    curves = []
+    for plug in om2.MFnDependencyNode(entry[0].object()).getConnections():
+        if not plug.isDestination:
+            continue
+        source = plug.source()
+        if not source.isNull and source.node().hasFn(om2.MFn.kAnimCurve):
+            curves.append((plug.partialName(useLongNames=True), om2anim.MFnAnimCurve(source.node())))
+    return sorted(curves, key=lambda item: item[0])
+
+
+# 每个关键帧打包的数值个数：帧、值、入/出切线类型、入切线 (x, y)、出切线 (x, y)
+_KEY_FIELDS = 8
+
+
+class CurveTable:
+    """一条动画曲线的关键帧数据，打包为连续的 float64 数组（便于按块切片求摘要）"""
+    
+    volatile = False
+    
+    def __init__(self, label, curve_fn):
+        unit = om2.MTime.uiUnit()
+        self.label = label.encode()
+        self.times = [curve_fn.input(i).asUnits(unit) for i in range(curve_fn.numKeys)]
+        self.data = array.array('d')
+        for i in range(len(self.times)):
+            self.data.extend((self.times[i], curve_fn.value(i),
+                              curve_fn.inTangentType(i), curve_fn.outTangentType(i)))
+            self.data.extend(curve_fn.getTangentXY(i, True))
+            self.data.extend(curve_fn.getTangentXY(i, False))
+        self.cyclic = (curve_fn.preInfinityType != om2anim.MFnAnimCurve.kConstant
+                       or curve_fn.postInfinityType != om2anim.MFnAnimCurve.kConstant)
+    
+    def block_bytes(self, first, last):
+        """影响 [first, last] 的关键帧数据：块内关键帧加上两侧各一个相邻关键帧（循环曲线为整条）"""
+        if self.cyclic:
+            return self.data.tobytes()
+        lo = max(0, bisect.bisect_left(self.times, first) - 1)
+        hi = bisect.bisect_right(self.times, last) + 1
+        return memoryview(self.data)[lo * _KEY_FIELDS:hi * _KEY_FIELDS].tobytes()
+
+
+class UntrackedDrivers:
+    """曲线以外的时间驱动（time 节点、表达式）：指纹无法反映它的变化（见 limb_curve_tables）"""
+    
+    volatile = True
+
+
+# 无法用动画曲线描述的时间驱动
+UNTRACKED_DRIVER_TYPES = (om2.MFn.kTime, om2.MFn.kExpression)
+
+
+def limb_curve_tables(limb):
+    """
+    影响肢体烘焙结果的所有动画曲线（见 fingerprint_nodes），返回 CurveTable 列表
+    
+    肢体的上游有曲线以外的时间驱动时，列表中包含一个 UntrackedDrivers：
+    这时指纹为 None（每次都重新烘焙），也不使用矩阵缓存
+    """
+    nodes, untracked = fingerprint_nodes(limb)
+    tables = [
+        CurveTable(f'{node}.{attr}', curve_fn)
+        for node in nodes
+        for attr, curve_fn in node_anim_curves(node)
+    ]
+    if untracked:
+        tables.append(UntrackedDrivers())
+    return tables
+
+
+def fingerprint_nodes(limb):
+    """
+    影响肢体烘焙结果的节点：肢体引用的所有节点（来源和目标控制器、Blend骨骼、切换节点）及其上游（见 upstream_nodes）
+    
+    Returns:
+        (节点名称列表, 是否遇到曲线以外的时间驱动（UNTRACKED_DRIVER_TYPES）)
+    """
+    return upstream_nodes(limb.node_names())
+
+
+def upstream_nodes(names):
+    """
+    节点及其DAG父级，加上沿 DG 向上游遍历到的所有节点（约束目标、驱动关键帧的驱动者、中间的转换节点等）
+    
+    每个起点只遍历一次：起点为给定的节点和遍历中遇到的DAG节点的父级（世界矩阵随父级变化，但父级不是 DG 连接）。
+    遍历到的 DG 节点的上游已经包含在同一次遍历中，不再单独遍历；遇到之前作为起点遍历过的节点时剪枝。
+    节点按唯一名称记录（DAG节点为完整路径）
+    
+    Returns:
+        (节点名称列表, 是否遇到曲线以外的时间驱动（UNTRACKED_DRIVER_TYPES）)
+    """
+    resolver = get_resolver()
+    nodes = []
+    seen = set()
+    pending = []   # 等待遍历的起点 (唯一名称, MObject)
+    walked = set()  # 已经作为起点遍历过的节点（唯一名称）
+    
+    def add(obj):
+        """记录节点；DAG节点的父级作为新的起点。返回唯一名称"""
+        if not obj.hasFn(om2.MFn.kDagNode):
+            name = om2.MFnDependencyNode(obj).name()
+            if name not in seen:
+                seen.add(name)
+                nodes.append(name)
+            return name
+        parts = om2.MDagPath.getAPathTo(obj).fullPathName().split('|')
+        path = '|'.join(parts)
+        for depth in range(2, len(parts) + 1):
+            node = '|'.join(parts[:depth])
+            if node not in seen:
+                seen.add(node)
+                nodes.append(node)
+                if node != path:
+                    pending.append(node)
+        return path
+    
+    for name in names:
+        entry = resolver.resolve(name)
+        if entry is not None:
+            obj = entry[0].object()
+            pending.append(add(obj))
+    
+    untracked = False
+    while pending:
+        name = pending.pop()
+        entry = resolver.resolve(name)
+        if name in walked or entry is None:
+            continue
+        walked.add(name)
+        it = om2.MItDependencyGraph(
+            entry[0].object(), om2.MFn.kInvalid, om2.MItDependencyGraph.kUpstream,
+            om2.MItDependencyGraph.kDepthFirst, om2.MItDependencyGraph.kPlugLevel
+        )
+        it.next()  # 跳过起点
+        while not it.isDone():
+            obj = it.currentNode()
+            if obj.hasFn(om2.MFn.kAnimCurve):
+                # 曲线由它驱动的节点读取（node_anim_curves）；驱动关键帧的输入继续遍历
+                it.next()
+                continue
+            if any(obj.hasFn(fn) for fn in UNTRACKED_DRIVER_TYPES):
+                untracked = True
+            elif add(obj) in walked:
+                # 之前作为起点遍历过，它的上游已经全部记录
+                it.prune()
+            it.next()
+    return nodes, untracked
+
+
+@profiled('read')
+def limb_block_fingerprints(limb, direction, step, blocks, tables=None):
+    """
+    肢体在每个帧块上的指纹
+    
+    包含影响结果的所有动画曲线在块内（以及两侧各一个相邻关键帧）的关键帧时间、数值和切线，
+    再加上方向、帧间隔和校准数据。目标控制器的曲线也在其中，撤销烘焙或手动修改结果后同样会重新烘焙。
+    tables 为 limb_curve_tables 的结果，同一时刻的多次计算可以共用
+    
+    Returns:
+        list: 与 blocks 一一对应的摘要字符串；有曲线以外的时间驱动时全部为 None（总是需要重新烘焙）
+    """
+    tables = limb_curve_tables(limb) if tables is None else tables
+    if any(table.volatile for table in tables):
+        return [None] * len(blocks)
+    salt = repr((direction, step, limb.rotation_offset)).encode()
+    digests = [hashlib.blake2b(salt, digest_size=8) for _ in blocks]
+    for table in tables:
+        for digest, block in zip(digests, blocks):
+            digest.update(table.label)
+            digest.update(table.block_bytes(block[0], block[-1]))
+    return [digest.hexdigest() for digest in digests]
+
+
+def limb_curve_digest(limb, tables=None):
+    """肢体所有相关动画曲线（整条曲线）的摘要，用作矩阵缓存键的一部分；有曲线以外的时间驱动时为 None（不缓存）"""
+    tables = limb_curve_tables(limb) if tables is None else tables
+    if any(table.volatile for table in tables):
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    for table in tables:
+        digest.update(table.label)
+        digest.update(bytes([table.cyclic]))
+        digest.update(table.data.tobytes())
+    return digest.hexdigest()
+
+
+def _block_key(block):
+    return f'{block[0]}:{block[-1]}'
+
+
+def _frame_runs(frames, step):
+    """把帧列表拆分成连续的片段"""
+    runs = []
+    for frame in frames:
+        if runs and frame - runs[-1][-1] == step:
+            runs[-1].append(frame)
+        else:
+            runs.append([frame])
+    return runs
+
+
+# ============================================================================
+# 世界矩阵缓存 / World Matrix Cache
+# ============================================================================
+
+# 磁盘缓存上限（字节），超出后按最近使用时间淘汰
+MATRIX_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+_matrix_cache = None
+
+
+def get_matrix_cache():
+    """
+    按需创建Blend骨骼世界矩阵的磁盘缓存（fkik_cache，依赖 NumPy）
+    
+    目录默认为 Maya 用户目录下的 fkik_matrix_cache，可用环境变量 FKIK_MATRIX_CACHE 指定；
+    不可用或已通过 set_matrix_cache(None) 关闭时返回 None
+    """
+    global _matrix_cache
+    if _matrix_cache is None:
+        try:
+            import fkik_cache
+        except ImportError:
+            _matrix_cache = False
+        else:
+            directory = os.environ.get('FKIK_MATRIX_CACHE') or os.path.join(
+                cmds.internalVar(userAppDir=True), 'fkik_matrix_cache')
+            _matrix_cache = fkik_cache.MatrixCache(directory, MATRIX_CACHE_MAX_BYTES)
+    return _matrix_cache or None
+
+
+def set_matrix_cache(directory, max_bytes=MATRIX_CACHE_MAX_BYTES):
+    """指定缓存目录和上限；directory 为 None 时关闭缓存"""
+    global _matrix_cache
+    if directory is None:
+        _matrix_cache = False
+        return None
+    import fkik_cache
+    _matrix_cache = fkik_cache.MatrixCache(directory, max_bytes)
+    return _matrix_cache
+
+
+class BlendCacheEntry:
+    """一个肢体的Blend骨骼在一段帧上的缓存条目（(骨骼数, 帧数, 16) 数组）"""
+    
+    def __init__(self, limb, parts, key, array, cached):
+        self.limb = limb
+        self.parts = parts      # 除曲线摘要以外的键组成部分
+        self.key = key
+        self.array = array
+        self.cached = cached
+
+
+def open_blend_cache(limbs, frames, digests=None):
+    """
+    为一组肢体的Blend骨骼打开（或新建）帧列表上的缓存条目
+    
+    键由场景路径、骨骼的完整路径、帧列表和 limb_curve_digest 组成，
+    源动画改变后键随之改变，旧条目不会再被读取。场景未保存、少于两帧或没有 NumPy 时不缓存。
+    
+    Returns:
+        (matrices, entries)
+        matrices: {骨骼: ((N, 16) 数组, 是否已有数据)}，已有数据的数组是只读的内存映射
+        entries: BlendCacheEntry 列表，采样完成后交给 publish_blend_cache
+    digests 为可选的 {肢体名称: limb_curve_digest}，已经计算过时避免重复读取曲线
+    """
+    cache = get_matrix_cache()
+    if cache is None or len(frames) < 2 or get_kernel() is None:
+        return {}, []
+    scene = cmds.file(query=True, sceneName=True)
+    if not scene:
+        return {}, []
+    
+    resolver = get_resolver()
+    matrices = {}
+    entries = []
+    for limb in limbs:
+        joints = limb.blend_joints
+        if not joints or not all(resolver.exists(j) for j in joints) or any(j in matrices for j in joints):
+            # 与其他肢体共用的骨骼只缓存一次
+            continue
+        parts = (scene, tuple(resolver.dag_path(j).fullPathName() for j in joints),
+                 frames[0], frames[-1], len(frames))
+        digest = digests[limb.name] if digests and limb.name in digests else limb_curve_digest(limb)
+        if digest is None:
+            # 受曲线以外的时间驱动，缓存键无法反映变化
+            continue
+        key = cache.key(*parts, digest)
+        shape = (len(joints), len(frames), 16)
+        buffer = cache.open(key)
+        cached = buffer is not None and buffer.shape == shape
+        if not cached:
+            buffer = cache.create(shape)
+        for index, joint in enumerate(joints):
+            matrices[joint] = (buffer[index], cached)
+        entries.append(BlendCacheEntry(limb, parts, key, buffer, cached))
+    return matrices, entries
+
+
+def publish_blend_cache(entries):
+    """登记采样完成的新条目"""
+    cache = get_matrix_cache()
+    for entry in entries:
+        if not entry.cached:
+            cache.publish(entry.key, entry.array)
+            entry.cached = True
+
+
+def alias_blend_cache(entries, digests=None, written=()):
+    """
+    烘焙写入关键帧后，把条目登记到新的曲线摘要下，另一个方向的烘焙、校验和报告可以继续使用同一份采样
+    
+    written 为写入的节点（完整路径）。Blend骨骼的上游（见 upstream_nodes）包含写入的节点时不登记：
+    Blend骨骼跟随被烘焙的控制器（例如约束或 blendColors 驱动），写入后采样已经过期。
+    这样的条目只留在写入前的摘要下，写入改变了曲线摘要，不会再被读取
+    """
+    cache = get_matrix_cache()
+    written = set(written)
+    for entry in entries:
+        if entry.cached and written and not written.isdisjoint(upstream_nodes(entry.limb.blend_joints)[0]):
+            continue
+        if entry.cached:
+            digest = digests.get(entry.limb.name) if digests else None
+            digest = digest or limb_curve_digest(entry.limb)
+            if digest is not None:
+                cache.alias(entry.key, cache.key(*entry.parts, digest))
+
+
+def blend_world_matrices(limbs, frames):
+    """
+    Blend骨骼在帧列表上的世界矩阵 {骨骼: (N, 4, 4) float64 数组}（需要 NumPy）
+    
+    命中缓存时直接映射缓存文件（零拷贝），否则通过 MDGContext 采样并写入缓存
+    """
+    kernel = get_kernel()
+    resolver = get_resolver()
+    matrices, entries = open_blend_cache(limbs, frames)
+    buffers = {}
+    pending = {}
+    for limb in limbs:
+        for joint in limb.blend_joints:
+            if joint in buffers or not resolver.exists(joint):
+                continue
+            buffer, cached = matrices.get(joint) or (kernel.matrix_buffer(len(frames)), False)
+            buffers[joint] = buffer
+            if not cached:
+                pending[joint] = buffer
+    
+    sample_world_matrices(pending, frames)
+    publish_blend_cache(entries)
+    return {joint: buffer.reshape(len(frames), 4, 4) for joint, buffer in buffers.items()}
+
+
+@profiled('read')
+def sample_world_matrices(buffers, frames):
+    """通过 MDGContext 按时间把节点的世界矩阵逐帧写入 {节点: (N, 16) 数组}"""
+    if not buffers:
+        return
+    plugs = {node: get_plug(node, 'worldMatrix[0]') for node in buffers}
+    for index, frame in enumerate(frames):
+        with dg_time_context(frame):
+            for node, plug in plugs.items():
+                buffers[node][index] = list(read_matrix_plug(plug))
+
+
+@profiled_operation('bake')
+def bake_limbs(limbs, start, end, direction=BAKE_IK_TO_FK, step=1, incremental=False,
+               chunk_size=BAKE_CHUNK_SIZE):
+    """
+    在帧范围内批量烘焙匹配结果
+
+    1. 采样：通过 MDGContext 按时间读取所有需要的世界矩阵（不切换 currentTime，不刷新视图）
+    2. 求解：计算所有控制器的局部位移/旋转（有 NumPy 时整块向量化，否则逐帧 om2）
+    3. 写入：AnimCurveWriter 每块每条曲线一次 addKeys，整批可通过返回的 writer 撤销
+    前三步按 chunk_size 帧一块流式执行，内存占用与帧范围长度无关
+    4. 记录：每个肢体每个帧块的指纹保存在 LimbData.bake_fingerprints 中
+
+    有磁盘矩阵缓存时（见 open_blend_cache），Blend骨骼的世界矩阵直接从缓存文件映射，
+    未命中时采样结果同时写入缓存
+
+    Args:
+        limbs: LimbData 列表
+        start, end: 帧范围（包含两端）
+        direction: BAKE_IK_TO_FK（IK对齐FK）或 BAKE_FK_TO_IK（FK对齐IK）
+        step: 帧间隔
+        incremental: 只重新烘焙指纹与上次烘焙不同的帧块
+        chunk_size: 流式烘焙每块的帧数
+
+    Returns:
+        dict: 统计信息，没有可烘焙的目标时返回 None
+    """
+    return run_steps(iter_bake_limbs(limbs, start, end, direction, step, incremental, chunk_size))
+
+
+def iter_bake_limbs(limbs, start, end, direction=BAKE_IK_TO_FK, step=1, incremental=False,
+                    chunk_size=BAKE_CHUNK_SIZE, writer=None):
+    """
+    分块执行的 bake_limbs（生成器，见 ChunkedTask）
+    
+    每写入一块产出一次进度 (已完成的肢体帧, 总肢体帧)，结束时返回统计信息。
+    writer 为 None 时新建；中途关闭生成器时已写入的块留在 writer 中（可以 writer.undo() 回滚），
+    不记录指纹，下次增量烘焙会重新烘焙这些帧
+    """
+    targets = collect_match_targets(limbs, direction)
+    if not targets:
+        return None
+
+    step = max(1, int(step))
+    frames = list(range(int(start), int(end) + 1, step))
+    blocks = frame_blocks(frames)
+
+    # 0. 对比指纹，按需要重新烘焙的帧把肢体分组
+    time_start = time.perf_counter()
+    use_cache = get_matrix_cache() is not None and get_kernel() is not None
+    digests = {}
+    groups = {tuple(frames): limbs}
+    if incremental:
+        groups = {}
+        for limb in limbs:
+            stored = limb.bake_fingerprints.get(direction, {})
+            stored_blocks = stored.get('blocks', {}) if stored.get('step') == step else {}
+            tables = limb_curve_tables(limb)
+            if use_cache:
+                digests[limb.name] = limb_curve_digest(limb, tables)
+            fingerprints = limb_block_fingerprints(limb, direction, step, blocks, tables)
+            dirty = tuple(
+                frame
+                for block, fingerprint in zip(blocks, fingerprints)
+                if fingerprint is None or stored_blocks.get(_block_key(block)) != fingerprint
+                for frame in block
+            )
+            if dirty:
+                groups.setdefault(dirty, []).append(limb)
+    time_checked = time.perf_counter()
+
+    # 1-3. 按帧块流式采样、求解、写入（每个连续片段单独求解，每块每条曲线一次 addKeys）
+    timings = {'sample': 0.0, 'solve': 0.0, 'write': 0.0}
+    writer = AnimCurveWriter() if writer is None else writer
+    total = sum(len(dirty) * len(group) for dirty, group in groups.items())
+    key_count = 0
+    rebaked_frames = 0
+    done = 0
+    cache_entries = []
+    cache_hits = 0
+    for dirty, group in groups.items():
+        group_targets = targets if group is limbs else collect_match_targets(group, direction)
+        for run in _frame_runs(dirty, step):
+            # 从中间开始的片段与前一帧已有的关键帧衔接
+            previous = read_rotation_values(group_targets, run[0] - step) if run[0] > frames[0] else None
+            matrices, entries = open_blend_cache(group, run, digests)
+            cache_hits += sum(1 for entry in entries if entry.cached)
+            chunks = iter_baked_chunks(group_targets, run, chunk_size, previous, timings, matrices)
+            for chunk, keys in chunks:
+                time_write = time.perf_counter()
+                for (node, attr), (times, values) in keys.items():
+                    writer.add(node, attr, times, values)
+                key_count += writer.commit()
+                timings['write'] += time.perf_counter() - time_write
+                done += len(chunk) * len(group)
+                yield done, total
+            publish_blend_cache(entries)
+            cache_entries.extend(entries)
+        rebaked_frames += len(dirty) * len(group)
+    time_written = time.perf_counter()
+
+    # 4. 记录写入后的指纹（未重新烘焙的肢体指纹不变），并把缓存条目登记到写入后的曲线摘要
+    digests = {}
+    for limb in (limb for group in groups.values() for limb in group):
+        stored = limb.bake_fingerprints.get(direction)
+        if not stored or stored.get('step') != step:
+            stored = limb.bake_fingerprints[direction] = {'step': step, 'blocks': {}}
+        tables = limb_curve_tables(limb)
+        if cache_entries:
+            digests[limb.name] = limb_curve_digest(limb, tables)
+        fingerprints = limb_block_fingerprints(limb, direction, step, blocks, tables)
+        stored['blocks'].update((_block_key(block), fp) for block, fp in zip(blocks, fingerprints))
+    written = set()
+    if cache_entries:
+        resolver = get_resolver()
+        written = {resolver.dag_path(target.node).fullPathName() for target in targets}
+    alias_blend_cache(cache_entries, digests, written)
+    time_recorded = time.perf_counter()
+
+    return {
+        'targets': len(targets),
+        'frames': len(frames),
+        'keys': key_count,
+        'cache_hits': cache_hits,
+        'rebaked_frames': rebaked_frames,
+        'skipped_frames': len(frames) * len(limbs) - rebaked_frames,
+        'check_time': time_checked - time_start,
+        'sample_time': timings['sample'],
+        'solve_time': timings['solve'],
+        'write_time': timings['write'],
+        'fingerprint_time': time_recorded - time_written,
+        'writer': writer,
+    }
+
+
+# ============================================================================
+# 匹配校验 / Match Verification
+# ============================================================================
+
+# 默认容差：位置为场景单位，旋转和极向量平面为度
+VERIFY_POSITION_TOLERANCE = 0.01
+VERIFY_ROTATION_TOLERANCE = 0.1
+
+# 分组校验时每组的肢体数（每组采样一次）
+VERIFY_GROUP_SIZE = 16
+
+RESIDUAL_KINDS = ('position', 'rotation', 'pole')
+
+
+class LimbResiduals:
+    """
+    一个肢体在帧列表上的匹配残差
+    
+    residuals: {'position': (N,) 位置误差, 'rotation': (N,) 旋转误差（度）, 'pole': (N,) 极向量平面夹角（度）}，
+    没有对应控制器的项不存在
+    """
+    
+    def __init__(self, name, frames, residuals, tolerances):
+        self.name = name
+        self.frames = frames
+        self.residuals = residuals
+        self.tolerances = tolerances
+    
+    def stats(self):
+        """{项: {'max', 'mean', 'frame'（最大误差所在帧）}}"""
+        stats = {}
+        for kind, values in self.residuals.items():
+            index = int(values.argmax())
+            stats[kind] = {'max': float(values[index]), 'mean': float(values.mean()), 'frame': self.frames[index]}
+        return stats
+    
+    def failed_frames(self):
+        """任意一项超出容差的帧"""
+        failed = None
+        for kind, values in self.residuals.items():
+            over = values > self.tolerances[kind]
+            failed = over if failed is None else failed | over
+        if failed is None:
+            return []
+        return [frame for frame, bad in zip(self.frames, failed.tolist()) if bad]
+
+
+class VerifyReport:
+    """匹配校验结果，每个肢体一个 LimbResiduals"""
+    
+    def __init__(self, direction, frames, limbs, tolerances):
+        self.direction = direction
+        self.frames = frames
+        self.limbs = limbs
+        self.tolerances = tolerances
+    
+    def __len__(self):
+        return len(self.limbs)
+    
+    @property
+    def failed(self):
+        """有帧超出容差的肢体 {名称: [帧]}"""
+        failed = {}
+        for limb in self.limbs:
+            frames = limb.failed_frames()
+            if frames:
+                failed[limb.name] = frames
+        return failed
+    
+    @property
+    def passed(self):
+        return not self.failed
+    
+    def worst(self):
+        """所有肢体中每一项的最大误差 {项: 值}"""
+        worst = {}
+        for limb in self.limbs:
+            for kind, entry in limb.stats().items():
+                worst[kind] = max(worst.get(kind, 0.0), entry['max'])
+        return worst
+    
+    def format(self):
+        """
+        格式化为表格（打印到脚本编辑器）
+        
+        每一项列为 "最大/平均"，超出容差的帧合并为连续的范围
+        """
+        failed = self.failed
+        lines = [
+            f'FK/IK verify ({self.direction}): {len(self.limbs)} limb(s) x {len(self.frames)} frame(s), '
+            f'{len(failed)} over tolerance '
+            f'(position {self.tolerances["position"]:g}, rotation {self.tolerances["rotation"]:g} deg)'
+        ]
+        header = f'{"limb":<24}' + ''.join(f'{f"{kind} max/mean":>26}' for kind in RESIDUAL_KINDS) + '  frames over'
+        lines.append(header)
+        for limb in self.limbs:
+            stats = limb.stats()
+            line = f'{limb.name:<24}'
+            for kind in RESIDUAL_KINDS:
+                entry = stats.get(kind)
+                cell = f'{entry["max"]:.2e}/{entry["mean"]:.2e}' if entry else '-'
+                line += f'{cell:>26}'
+            line += '  ' + (_format_frame_runs(failed[limb.name]) if limb.name in failed else '-')
+            lines.append(line)
+        return '\n'.join(lines)
+    
+    def to_dict(self):
+        failed = self.failed
+        return {
+            'direction': self.direction,
+            'frames': [self.frames[0], self.frames[-1], len(self.frames)] if self.frames else [],
+            'tolerances': dict(self.tolerances),
+            'limbs': {
+                limb.name: {'stats': limb.stats(), 'failed_frames': failed.get(limb.name, [])}
+                for limb in self.limbs
+            },
+        }
+
+
+def _format_frame_runs(frames):
+    """帧列表合并为连续的范围，例如 [1, 2, 3, 7] → '1-3, 7'"""
+    runs = []
+    for frame in frames:
+        if runs and frame - runs[-1][1] <= 1:
+            runs[-1][1] = frame
+        else:
+            runs.append([frame, frame])
+    return ', '.join(f'{first:g}' if first == last else f'{first:g}-{last:g}' for first, last in runs)
+
+
+def verify_nodes(limb, direction):
+    """校验需要读取的控制器（与匹配写入的控制器相同）"""
+    if direction == BAKE_IK_TO_FK:
+        nodes = [limb.ik_control] if limb.ik_control else []
+        if limb.pole_vector and len(limb.blend_joints) >= 3:
+            nodes.append(limb.pole_vector)
+        return nodes
+    return list(limb.fk_controls[:len(limb.blend_joints)])
+
+
+@profiled('math')
+def limb_residuals(limb, direction, blend, controls):
+    """
+    计算一个肢体在所有帧上的残差（向量化）
+    
+    IK → FK: IK控制器位置与Blend末端的距离，IK旋转与 rotation_offset × Blend末端旋转的夹角，
+             极向量平面与Blend链平面的夹角（与 calculate_pole_vector_position 使用同一个平面）
+    FK → IK: FK末端控制器位置与Blend末端的距离，每个FK控制器与对应Blend骨骼旋转夹角的最大值
+    
+    Args:
+        blend: {骨骼: (N, 4, 4) 世界矩阵}
+        controls: {控制器: (N, 4, 4) 世界矩阵}
+    
+    Returns:
+        {项: (N,) 数组}，角度为度
+    """
+    kernel = get_kernel()
+    joints = [blend[j] for j in limb.blend_joints]
+    residuals = {}
+    if direction == BAKE_IK_TO_FK:
+        ik_m = controls.get(limb.ik_control)
+        if ik_m is not None:
+            residuals['position'] = kernel.distances(kernel.translations(ik_m), kernel.translations(joints[-1]))
+            offset_data = limb.rotation_offset
+            if offset_data and len(offset_data) == 16:
+                expected = kernel.matrices_to_quaternions(kernel.matrix_product(offset_data, joints[-1]))
+            else:
+                expected = kernel.apply_rotation_offset(
+                    offset_data if offset_data and len(offset_data) == 4 else None, joints[-1])
+            residuals['rotation'] = kernel.quaternion_angles(kernel.matrices_to_quaternions(ik_m), expected) * RAD_TO_DEG
+        pv_m = controls.get(limb.pole_vector)
+        if pv_m is not None and len(joints) >= 3:
+            residuals['pole'] = kernel.pole_plane_angles(
+                joints[0], joints[1], joints[-1], kernel.translations(pv_m)) * RAD_TO_DEG
+    else:
+        pairs = [(controls[c], joint) for c, joint in zip(limb.fk_controls, joints) if c in controls]
+        if pairs:
+            residuals['position'] = kernel.distances(
+                kernel.translations(pairs[-1][0]), kernel.translations(pairs[-1][1]))
+            rotation = None
+            for ctrl_m, joint_m in pairs:
+                angles = kernel.quaternion_angles(
+                    kernel.matrices_to_quaternions(ctrl_m), kernel.matrices_to_quaternions(joint_m)) * RAD_TO_DEG
+                rotation = angles if rotation is None else rotation.clip(min=angles)
+            residuals['rotation'] = rotation
+    return residuals
+
+
+@profiled_operation('verify')
+def verify_limbs(limbs, direction, start=None, end=None, step=1,
+                 position_tolerance=VERIFY_POSITION_TOLERANCE, rotation_tolerance=VERIFY_ROTATION_TOLERANCE):
+    """
+    校验匹配结果：在帧范围内比较匹配后的控制器与Blend骨骼，统计每个肢体的残差
+    
+    所有帧通过 MDGContext 采样到连续数组后整体计算，不切换当前帧；
+    Blend骨骼的世界矩阵通过 blend_world_matrices 读取，烘焙后通常直接命中磁盘缓存。
+    需要 NumPy（fkik_kernel）
+    
+    Args:
+        limbs: LimbData 列表
+        direction: 要校验的匹配方向（BAKE_IK_TO_FK 校验IK控制器和极向量，BAKE_FK_TO_IK 校验FK控制器）
+        start, end: 帧范围（包含两端），为 None 时只校验当前帧
+        step: 帧间隔
+        position_tolerance: 位置容差（场景单位）
+        rotation_tolerance: 旋转和极向量平面的容差（度）
+    
+    Returns:
+        VerifyReport，NumPy 不可用时返回 None
+    """
+    return run_steps(iter_verify_limbs(limbs, direction, start, end, step, position_tolerance, rotation_tolerance))
+
+
+def iter_verify_limbs(limbs, direction, start=None, end=None, step=1,
+                      position_tolerance=VERIFY_POSITION_TOLERANCE, rotation_tolerance=VERIFY_ROTATION_TOLERANCE,
+                      group_size=VERIFY_GROUP_SIZE):
+    """
+    分组执行的 verify_limbs（生成器，见 ChunkedTask）
+    
+    每校验 group_size 个肢体产出一次进度 (已完成的肢体帧, 总肢体帧)，结束时返回 VerifyReport
+    """
+    kernel = get_kernel()
+    if kernel is None:
+        return None
+    if start is None:
+        frames = [cmds.currentTime(query=True)]
+    else:
+        frames = list(range(int(start), int(end if end is not None else start) + 1, max(1, int(step))))
+    
+    resolver = get_resolver()
+    checked = []
+    for limb in limbs:
+        if not limb.blend_joints or not all(resolver.exists(j) for j in limb.blend_joints):
+            continue
+        nodes = [node for node in verify_nodes(limb, direction) if resolver.exists(node)]
+        if not nodes:
+            continue
+        checked.append((limb, nodes))
+    
+    tolerances = {'position': position_tolerance, 'rotation': rotation_tolerance, 'pole': rotation_tolerance}
+    total = len(checked) * len(frames)
+    results = []
+    for index in range(0, len(checked), max(1, group_size)):
+        group = checked[index:index + max(1, group_size)]
+        group_limbs = [limb for limb, nodes in group]
+        blend = blend_world_matrices(group_limbs, frames)
+        buffers = {node: kernel.matrix_buffer(len(frames)) for limb, nodes in group for node in nodes}
+        sample_world_matrices(buffers, frames)
+        controls = {node: buffer.reshape(len(frames), 4, 4) for node, buffer in buffers.items()}
+        results.extend(
+            LimbResiduals(limb.name, frames, limb_residuals(limb, direction, blend, controls), tolerances)
+            for limb in group_limbs
+        )
+        yield len(results) * len(frames), total
+    return VerifyReport(direction, frames, results, tolerances)
+
+
+# ============================================================================
+# 快速烘焙 / Fast Bake
+# ============================================================================
+
+# 快速烘焙期间使用的求值模式：采样通过 MDGContext 进行（总是 DG 求值），
+# 写入会新建曲线连接（每次都让 Evaluation Manager 重建图、让缓存播放重新填充），
+# 因此 DG 模式既是结果正确的参考模式，也是批量写入时最快的模式
+FAST_BAKE_EVALUATION = 'off'
+
+
+def _query_value(value):
+    """cmds 查询有时返回单元素列表"""
+    return value[0] if isinstance(value, (list, tuple)) and value else value
+
+
+def _fast_bake_settings(evaluation):
+    """
+    快速烘焙需要修改的场景设置 [(名称, 查询函数, 设置函数, 快速烘焙时的值)]
+    
+    按应用顺序排列，恢复时倒序：先关闭缓存播放再切换求值模式，最后暂停刷新
+    """
+    return [
+        ('autoSave', lambda: cmds.autoSave(query=True, enable=True),
+         lambda value: cmds.autoSave(enable=value), False),
+        ('autoKeyframe', lambda: cmds.autoKeyframe(query=True, state=True),
+         lambda value: cmds.autoKeyframe(state=value), False),
+        ('cachedPlayback', lambda: cmds.evaluator(name='cache', query=True, enable=True),
+         lambda value: cmds.evaluator(name='cache', enable=value), False),
+        ('evaluationManager', lambda: cmds.evaluationManager(query=True, mode=True),
+         lambda value: cmds.evaluationManager(mode=value), evaluation),
+        ('refreshSuspended', lambda: cmds.refresh(query=True, suspend=True),
+         lambda value: cmds.refresh(suspend=value), True),
+    ]
+
+
+class FastBakeReport:
+    """
+    一次快速烘焙的记录
+    
+    changes: [(设置, 原来的值, 快速烘焙时的值)]，只包含实际修改过的设置
+    baseline: 同样工作量的普通烘焙耗时（秒），没有参考时为 None
+    baseline_estimated: baseline 是按之前某次普通烘焙（可能是其他肢体）每个肢体帧的耗时推算的，
+        不是同一范围的实测（compare_fast_bake）
+    """
+    
+    def __init__(self):
+        self.changes = []
+        self.elapsed = 0.0
+        self.baseline = None
+        self.baseline_estimated = False
+    
+    @property
+    def saved(self):
+        """与普通烘焙相比节省的时间（秒），没有参考时为 None"""
+        return None if self.baseline is None else self.baseline - self.elapsed
+    
+    def format(self):
+        settings = ', '.join(f'{name} {before} -> {after}' for name, before, after in self.changes) or 'no changes'
+        text = f'FK/IK fast bake: {self.elapsed:.3f}s ({settings})'
+        if self.baseline is not None and self.baseline_estimated:
+            text += (f', normal run ~{self.baseline:.3f}s (estimated from an earlier normal bake), '
+                     f'saved ~{self.saved:.3f}s (estimate)')
+        elif self.baseline is not None:
+            text += f', normal run {self.baseline:.3f}s (measured), saved {self.saved:.3f}s'
+        return text
+
+
+@contextmanager
+def fast_bake(evaluation=FAST_BAKE_EVALUATION, report=None):
+    """
+    上下文管理器：多帧操作期间暂停视图刷新、切换求值模式、关闭自动保存/自动关键帧和缓存播放
+    
+    退出时（包括异常）按相反顺序恢复所有修改过的设置；当前环境没有的设置（例如 mayapy 中的视图刷新）直接跳过。
+    
+    Args:
+        evaluation: 烘焙期间的 Evaluation Manager 模式（'off' 为 DG，见 FAST_BAKE_EVALUATION）
+        report: 累加到已有的 FastBakeReport（ChunkedTask 每个时间片各应用一次），None 时新建
+    
+    Yields:
+        FastBakeReport
+    """
+    if report is None:
+        report = FastBakeReport()
+    applied = []
+    time_start = time.perf_counter()
+    try:
+        for name, query, apply, value in _fast_bake_settings(evaluation):
+            try:
+                before = _query_value(query())
+                if before == value:
+                    continue
+                apply(value)
+            except (RuntimeError, TypeError, AttributeError):
+                continue
+            applied.append((name, apply, before))
+            if all(change[0] != name for change in report.changes):
+                report.changes.append((name, before, value))
+        yield report
+    finally:
+        for name, apply, before in reversed(applied):
+            try:
+                apply(before)
+            except RuntimeError:
+                cmds.warning(f'FK/IK fast bake: could not restore {name} to {before}')
+        report.elapsed += time.perf_counter() - time_start
+
+
+@contextmanager
+def suspended_refresh():
+    """上下文管理器：暂停视图刷新，退出时恢复；已经暂停或当前环境没有视图时不做修改"""
+    try:
+        suspended = not _query_value(cmds.refresh(query=True, suspend=True))
+        if suspended:
+            cmds.refresh(suspend=True)
+    except (RuntimeError, TypeError, AttributeError):
+        suspended = False
+    try:
+        yield
+    finally:
+        if suspended:
+            cmds.refresh(suspend=False)
+
+
+def compare_fast_bake(limbs, start, end, direction=BAKE_IK_TO_FK, step=1, evaluation=FAST_BAKE_EVALUATION):
+    """
+    测量快速烘焙节省的时间：先普通烘焙并撤销，再在 fast_bake 中烘焙同样的范围（保留结果）
+    
+    两次都关闭磁盘矩阵缓存，避免第二次直接命中第一次的采样
+    
+    Returns:
+        dict: {'normal', 'fast', 'saved'}（秒）、'report'（FastBakeReport）、'stats'（快速烘焙的统计）
+    """
+    global _matrix_cache
+    cache = _matrix_cache
+    _matrix_cache = False
+    try:
+        time_start = time.perf_counter()
+        stats = bake_limbs(limbs, start, end, direction, step)
+        normal = time.perf_counter() - time_start
+        if stats:
+            stats['writer'].undo()
+        
+        with fast_bake(evaluation) as report:
+            stats = bake_limbs(limbs, start, end, direction, step)
+    finally:
+        _matrix_cache = cache
+    report.baseline = normal
+    return {'normal': normal, 'fast': report.elapsed, 'saved': report.saved, 'report': report, 'stats': stats}
+
+
+# ============================================================================
+# 两阶段匹配计划 / Two-Phase Match Plan
+# ============================================================================
+
+class MatchPlan:
+    """
+    "全部匹配" 的两阶段执行计划
+    
+    编译时收集所有肢体的目标控制器；执行时先在一个读取阶段采样全部矩阵，
+    再计算，最后在一个写入阶段写入全部数值。读取期间不写入任何属性，
+    因此 DG 只需求值一次，共用父级的肢体也不会读到已被修改的姿势。
+    """
+    
+    def __init__(self, limbs, direction):
+        time_start = time.perf_counter()
+        self.direction = direction
+        self.targets = collect_match_targets(limbs, direction)
+        self.samples = None
+        self.results = []
+        self.writer = None  # 通过 AnimCurveWriter 写入时的 writer（可整体撤销）
+        self.timings = {'compile': time.perf_counter() - time_start}
+    
+    def read(self):
+        """读取阶段：在当前帧采样所有目标需要的矩阵（有 NumPy 时直接采样为数组）"""
+        time_start = time.perf_counter()
+        self.samples = sample_targets(self.targets, as_arrays=get_kernel() is not None)
+        self.timings['read'] = time.perf_counter() - time_start
+    
+    def solve(self):
+        """
+        计算阶段：有 NumPy 时所有肢体的目标分批一次计算（可在工作线程中并行，见 solve_targets），
+        否则逐个目标 om2。只访问采样数据，不读写场景
+        """
+        time_start = time.perf_counter()
+        if self.samples.get('arrays'):
+            keys = solve_targets(self.targets, [None], self.samples)
+            self.results = [(target, *solved_channels(target, keys)) for target in self.targets]
+        else:
+            frame, self.results = next(iter_solved_frames(self.targets, [None], self.samples))
+        self.timings['solve'] = time.perf_counter() - time_start
+    
+    def write(self, auto_key=False, writer=None):
+        """
+        写入阶段：每个控制器一次 translate、一次 rotate，最后一次 setKeyframe
+        
+        给出 writer（AnimCurveWriter）时所有属性值和关键帧都记录在 writer 中，
+        整批可以通过 writer 撤销（fkikMatch 命令使用），只为写入的通道打Key
+        """
+        time_start = time.perf_counter()
+        if writer is not None:
+            self.writer = writer
+            frame = cmds.currentTime(query=True)
+            for target, translate, euler in self.results:
+                for attr, value in channel_values(translate, euler):
+                    writer.set_value(target.node, attr, value)
+                    if auto_key:
+                        writer.add_key(target.node, attr, frame, value)
+            writer.commit()
+            self.timings['write'] = time.perf_counter() - time_start
+            return
+        
+        for target, translate, euler in self.results:
+            if translate is not None:
+                set_local_translation(target.node, translate)
+            if euler is not None:
+                set_local_euler(target.node, euler)
+        
+        if auto_key:
+            nodes = [target.node for target, translate, euler in self.results]
+            if self.direction == BAKE_IK_TO_FK:
+                key_controls(nodes)
+            else:
+                key_controls(nodes, attribute='rotate')
+        self.timings['write'] = time.perf_counter() - time_start
+    
+    @profiled_operation('match_all')
+    def execute(self, auto_key=False, writer=None):
+        """
+        依次执行读取、计算、写入
+        
+        Returns:
+            dict: 各阶段耗时（秒）
+        """
+        self.read()
+        self.solve()
+        self.write(auto_key, writer)
+        return self.timings
+    
+    def format_timings(self):
+        return ', '.join(f'{phase} {seconds * 1000.0:.1f}ms' for phase, seconds in self.timings.items())
+
+
+# ============================================================================
+# 分块执行 / Chunked Execution
+# ============================================================================
+
+# 分块任务每次空闲回调最多占用的时间（秒），之后把控制权交还给 Maya（视图、菜单、Esc）
+TASK_SLICE_SECONDS = 0.1
+# 后台烘焙每块的帧数：比同步烘焙小，保证一块能在一个时间片内完成
+TASK_BAKE_CHUNK_SIZE = BAKE_BLOCK_SIZE
+# 分组 "全部匹配" 时每组的最多肢体数（同一命名空间的肢体总在同一组）
+MATCH_GROUP_SIZE = 32
+
+_active_task = None
+
+
+def run_steps(steps):
+    """同步执行分块生成器，返回其结果"""
+    while True:
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+
+
+def iter_match_limbs(limbs, direction, auto_key=False, writer=None, group_size=MATCH_GROUP_SIZE):
+    """
+    分组执行的 "全部匹配"（生成器，见 ChunkedTask）
+    
+    同一命名空间（角色）的肢体在同一个 MatchPlan 中读取和写入，角色之间互不影响；
+    每执行一组产出一次进度 (已匹配的肢体, 总肢体)，结束时返回 MatchPlan 列表。
+    所有修改记录在 writer（AnimCurveWriter）中
+    """
+    writer = AnimCurveWriter() if writer is None else writer
+    by_namespace = {}
+    for limb in limbs:
+        by_namespace.setdefault(limb.namespace or namespace_of(limb.name), []).append(limb)
+    groups = []
+    for namespace_limbs in by_namespace.values():
+        if groups and len(groups[-1]) + len(namespace_limbs) <= group_size:
+            groups[-1].extend(namespace_limbs)
+        else:
+            groups.append(list(namespace_limbs))
+    
+    plans = []
+    done = 0
+    for group in groups:
+        plan = MatchPlan(group, direction)
+        plan.execute(auto_key, writer)
+        plans.append(plan)
+        done += len(group)
+        yield done, len(limbs)
+    return plans
+
+
+def active_task():
+    """正在执行的 ChunkedTask，没有时为 None"""
+    return _active_task
+
+
+class ChunkedTask:
+    """
+    在 Maya 空闲时分块执行的长时间操作
+    
+    steps 为生成器，每完成一块产出 (已完成, 总数)，结束时返回结果（见 iter_bake_limbs）。
+    每次空闲回调（evalDeferred lowestPriority）连续执行若干块，用完 slice_seconds 后交还控制权，
+    期间 progressWindow 显示进度、吞吐量（肢体帧/秒）和预计剩余时间。
+    视图刷新（fast_report 不为 None 时为全部 fast_bake 设置）只在每个时间片内修改，
+    两个时间片之间场景恢复原来的设置，用户可以正常工作。
+    
+    取消或出错时先关闭生成器（fast_bake 等上下文在此恢复设置），取消后 choose_rollback() 返回 True 时
+    调用 rollback() 撤销已完成的块，否则保留。同一时间只能执行一个任务；batch 模式下同步执行
+    
+    Args:
+        steps: 分块生成器
+        title: 进度窗口标题
+        on_done: on_done(result)，完成后调用
+        on_cancel: on_cancel(rolled_back)，取消后调用
+        rollback: 撤销已完成的块，例如 writer.undo
+        choose_rollback: 取消时询问用户，返回 True 回滚、False 保留
+        slice_seconds: 每个时间片的预算
+        fast_report: 每个时间片在 fast_bake 中执行，设置的修改和耗时累加到这个 FastBakeReport
+    """
+    
+    def __init__(self, steps, title, on_done=None, on_cancel=None, rollback=None, choose_rollback=None,
+                 slice_seconds=TASK_SLICE_SECONDS, fast_report=None):
+        self.steps = steps
+        self.title = title
+        self.on_done = on_done
+        self.on_cancel = on_cancel
+        self.rollback = rollback
+        self.choose_rollback = choose_rollback
+        self.slice_seconds = slice_seconds
+        self.fast_report = fast_report
+        self.done = 0
+        self.total = 0
+        self.time_start = None
+        self.result = None
+        self.state = 'pending'  # pending / running / done / cancelled / failed
+    
+    @property
+    def elapsed(self):
+        return 0.0 if self.time_start is None else time.perf_counter() - self.time_start
+    
+    @property
+    def throughput(self):
+        """每秒完成的单位数"""
+        elapsed = self.elapsed
+        return self.done / elapsed if elapsed > 0 else 0.0
+    
+    @property
+    def eta(self):
+        """预计剩余时间（秒），还没有进度时为 None"""
+        rate = self.throughput
+        return (self.total - self.done) / rate if rate > 0 else None
+    
+    def format_status(self):
+        eta = self.eta
+        eta = '--' if eta is None else f'{eta:.1f}s'
+        return f'{self.done:,}/{self.total:,} limb-frames   {self.throughput:,.0f} frames/s   ETA {eta}'
+    
+    def start(self):
+        """
+        开始执行
+        
+        Returns:
+            bool: 另一个任务正在执行时为 False
+        """
+        global _active_task
+        if _active_task is not None:
+            return False
+        self.time_start = time.perf_counter()
+        self.state = 'running'
+        if cmds.about(batch=True):
+            with self._slice_settings():
+                result = run_steps(self.steps)
+            self._finish(result)
+            return True
+        _active_task = self
+        cmds.progressWindow(title=self.title, progress=0, status=self.format_status(), isInterruptable=True)
+        cmds.evalDeferred(self._tick, lowestPriority=True)
+        return True
+    
+    def cancel(self):
+        """请求取消，在下一个时间片开始时生效"""
+        self.state = 'cancelling'
+    
+    def _slice_settings(self):
+        """一个时间片内生效的场景设置"""
+        return suspended_refresh() if self.fast_report is None else fast_bake(report=self.fast_report)
+    
+    def _run_slice(self):
+        """
+        连续执行若干块，直到用完时间片或请求取消
+        
+        Returns:
+            bool: 生成器已结束时为 True（结果保存在 self.result）
+        """
+        slice_end = time.perf_counter() + self.slice_seconds
+        while self.state != 'cancelling':
+            if cmds.progressWindow(query=True, isCancelled=True):
+                self.state = 'cancelling'
+                break
+            try:
+                self.done, self.total = next(self.steps)
+            except StopIteration as stop:
+                self.result = stop.value
+                return True
+            if time.perf_counter() >= slice_end:
+                break
+        return False
+    
+    def _tick(self):
+        """一个时间片：执行若干块（期间暂停视图刷新），更新进度，然后重新排队"""
+        try:
+            with self._slice_settings():
+                finished = self._run_slice()
+            if finished:
+                self._finish(self.result)
+            elif self.state == 'cancelling':
+                self._cancel()
+            else:
+                progress = int(100 * self.done / self.total) if self.total else 100
+                cmds.progressWindow(edit=True, progress=progress, status=self.format_status())
+                cmds.evalDeferred(self._tick, lowestPriority=True)
+        except Exception:
+            # 已完成的块保留，可以通过 rollback 撤销
+            self.state = 'failed'
+            self.steps.close()
+            self._close()
+            raise
+    
+    def _close(self):
+        global _active_task
+        if _active_task is self:
+            _active_task = None
+            cmds.progressWindow(endProgress=True)
+    
+    def _finish(self, result):
+        self.result = result
+        self.state = 'done'
+        self._close()
+        if self.on_done:
+            self.on_done(result)
+    
+    def _cancel(self):
+        self.steps.close()
+        self._close()
+        rolled_back = bool(self.rollback and self.choose_rollback and self.choose_rollback())
+        if rolled_back:
+            self.rollback()
+        self.state = 'cancelled'
+        if self.on_cancel:
+            self.on_cancel(rolled_back)
+
+
+# ============================================================================
+# FK/IK 切换点 / Switch Points
+# ============================================================================
+
+def read_curve_keys(plug):
+    """
+    读取驱动属性的动画曲线的关键帧
+    
+    Returns:
+        ([帧], [值]) 或 None（属性没有被动画曲线驱动）
+    """
+    source = plug.source()
+    if source.isNull or not source.node().hasFn(om2.MFn.kAnimCurve):
+        return None
+    curve_fn = om2anim.MFnAnimCurve(source.node())
+    unit = om2.MTime.uiUnit()
+    times = [curve_fn.input(i).asUnits(unit) for i in range(curve_fn.numKeys)]
+    values = [curve_fn.value(i) for i in range(curve_fn.numKeys)]
+    return times, values
+
+
+class SwitchPoint:
+    """
+    切换属性动画中的一次 FK/IK 切换
+    
+    hold_frame 是仍然完全处于旧模式的最后一帧，switch_frame 是切换到新模式的关键帧。
+    direction 为需要执行的匹配：IK→FK 切换时 BAKE_FK_TO_IK（FK对齐），反之 BAKE_IK_TO_FK。
+    """
+    
+    def __init__(self, limb, hold_frame, switch_frame, direction):
+        self.limb = limb
+        self.hold_frame = hold_frame
+        self.switch_frame = switch_frame
+        self.direction = direction
+
+
+def switch_is_ik(limb, value):
+    """切换属性的值是否处于IK模式（阈值为 FK值 和 IK值 的中点）"""
+    threshold = (limb.switch_fk_value + limb.switch_ik_value) * 0.5
+    return (value - threshold) * (limb.switch_ik_value - threshold) > 0
+
+
+def current_match_direction(limb):
+    """
+    按切换属性的当前值判断切换模式前需要的匹配方向
+    
+    处于IK模式时返回 BAKE_FK_TO_IK（FK对齐IK，准备切换到FK），处于FK模式时返回 BAKE_IK_TO_FK；
+    没有切换属性或节点不存在时返回 None
+    """
+    if not limb.switch_attr:
+        return None
+    node, _, attr = limb.switch_attr.partition('.')
+    plug = get_plug(node, attr) if get_resolver().exists(node) else None
+    if plug is None:
+        return None
+    return BAKE_FK_TO_IK if switch_is_ik(limb, plug.asDouble()) else BAKE_IK_TO_FK
+
+
+def find_switch_points(limb, start=None, end=None):
+    """
+    扫描肢体切换属性的动画曲线，找出所有 FK/IK 切换点
+    
+    阈值为 FK值 和 IK值 的中点。阶梯（stepped）切换时保持帧为切换关键帧的前一帧，
+    线性等渐变切换时为上一个关键帧。
+    
+    Returns:
+        list: SwitchPoint 列表（按时间排序）
+    """
+    if not limb.switch_attr:
+        return []
+    node, _, attr = limb.switch_attr.partition('.')
+    plug = get_plug(node, attr) if get_resolver().exists(node) else None
+    keys = read_curve_keys(plug) if plug is not None else None
+    if not keys:
+        return []
+    
+    def is_ik(value):
+        return switch_is_ik(limb, value)
+    
+    curve_fn = om2anim.MFnAnimCurve(plug.source().node())
+    unit = om2.MTime.uiUnit()
+    times, values = keys
+    points = []
+    for i in range(1, len(times)):
+        was_ik = is_ik(values[i - 1])
+        if was_ik == is_ik(values[i]):
+            continue
+        switch_frame = times[i]
+        if (start is not None and switch_frame < start) or (end is not None and switch_frame > end):
+            continue
+        
+        # 切换前一帧仍为旧值（阶梯切换）时，用前一帧作为保持帧
+        hold_frame = times[i - 1]
+        previous = switch_frame - 1
+        if previous > hold_frame and abs(curve_fn.evaluate(om2.MTime(previous, unit)) - values[i - 1]) < 1e-6:
+            hold_frame = previous
+        
+        direction = BAKE_FK_TO_IK if was_ik else BAKE_IK_TO_FK
+        points.append(SwitchPoint(limb, hold_frame, switch_frame, direction))
+    return points
+
+
+def match_switch_points(limbs, start=None, end=None):
+    """
+    在所有切换点上执行对应方向的匹配，并一次性写入所需的关键帧
+    
+    每个切换点：
+        - 新模式控制器按保持帧的Blend姿势求解，在保持帧和切换帧写入相同数值
+        - 旧模式控制器在保持帧打Key，锁定切换前的姿势
+    
+    切换点按保持帧的时间顺序处理，每个时间点写入后再采样下一个，
+    后面的切换能读到前面切换写入的关键帧。所有写入共用一个 AnimCurveWriter，可整批撤销。
+    
+    Returns:
+        dict: 统计信息，没有切换点时返回 None
+    """
+    points = [point for limb in limbs for point in find_switch_points(limb, start, end)]
+    if not points:
+        return None
+    
+    groups = {}  # {(保持帧, 切换帧, 方向): [LimbData]}
+    for point in points:
+        groups.setdefault((point.hold_frame, point.switch_frame, point.direction), []).append(point.limb)
+    
+    writer = AnimCurveWriter()
+    key_count = 0
+    for (hold_frame, switch_frame, direction), group in sorted(groups.items()):
+        # 旧模式控制器：在保持帧锁定当前值
+        opposite = BAKE_IK_TO_FK if direction == BAKE_FK_TO_IK else BAKE_FK_TO_IK
+        with dg_time_context(hold_frame):
+            for target in collect_match_targets(group, opposite):
+                attrs = []
+                if target.translate:
+                    attrs.extend(('translateX', 'translateY', 'translateZ'))
+                if target.rotate:
+                    attrs.extend(('rotateX', 'rotateY', 'rotateZ'))
+                for attr in attrs:
+                    writer.add_key(target.node, attr, hold_frame, get_plug(target.node, attr).asDouble())
+        
+        # 新模式控制器：按保持帧的Blend姿势求解
+        targets = collect_match_targets(group, direction)
+        if targets:
+            samples = sample_targets(targets, [hold_frame])
+            frame, results = next(iter_solved_frames(targets, [hold_frame], samples))
+            for target, translate, euler in results:
+                for attr, value in channel_values(translate, euler):
+                    writer.add(target.node, attr, [hold_frame, switch_frame], [value, value])
+        
+        key_count += writer.commit()
+    
+    return {
+        'switches': len(points),
+        'limbs': len({point.limb.name for point in points}),
+        'keys': key_count,
+        'points': [(p.limb.name, p.hold_frame, p.switch_frame, p.direction) for p in points],
+        'writer': writer,
+    }
+
+
+# ============================================================================
+# 肢体数据类 / Limb Data Class
+# ============================================================================
+
+class LimbData:
+    """存储单个肢体的FK/IK配置（大量肢体的批量计算见 LimbTable）"""
+    
+    __slots__ = (
+        'name', 'blend_joints', 'fk_controls', 'ik_control', 'pole_vector', 'rotation_offset', 'rest_matrices',
+        'namespace', 'switch_attr', 'switch_fk_value', 'switch_ik_value', 'bake_fingerprints',
+    )
+    
+    def __init__(self, name=''):
+        self.name = name
+        self.blend_joints = []  # 融合骨骼（参考来源）
+        self.fk_controls = []   # FK控制器（匹配目标）
+        self.ik_control = None  # IK控制器
+        self.pole_vector = None # 极向量
+        self.rotation_offset = None  # 旋转偏移量 [rx, ry, rz]（校准时记录）
+        self.rest_matrices = None  # 静止姿势快照：IK控制器 + 末端Blend骨骼的世界矩阵（32个值）
+        self.namespace = ''     # 由模板实例化时所在的命名空间
+        self.switch_attr = None      # FK/IK 切换属性 'node.attr'（用于切换点检测）
+        self.switch_fk_value = 0.0   # 切换属性为FK时的值
+        self.switch_ik_value = 1.0   # 切换属性为IK时的值
+        self.bake_fingerprints = {}  # 增量烘焙指纹 {方向: {'step': 帧间隔, 'blocks': {'首帧:末帧': 摘要}}}
+    
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'blend_joints': self.blend_joints,
+            'fk_controls': self.fk_controls,
+            'ik_control': self.ik_control,
+            'pole_vector': self.pole_vector,
+            'rotation_offset': self.rotation_offset,
+            'rest_matrices': self.rest_matrices,
+            'namespace': self.namespace,
+            'switch_attr': self.switch_attr,
+            'switch_fk_value': self.switch_fk_value,
+            'switch_ik_value': self.switch_ik_value,
+            'bake_fingerprints': self.bake_fingerprints
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        limb = cls(data.get('name', ''))
+        limb.blend_joints = data.get('blend_joints', [])
+        limb.fk_controls = data.get('fk_controls', [])
+        limb.ik_control = data.get('ik_control')
+        limb.pole_vector = data.get('pole_vector')
+        limb.rotation_offset = data.get('rotation_offset')
+        limb.rest_matrices = data.get('rest_matrices')
+        limb.namespace = data.get('namespace', '')
+        limb.switch_attr = data.get('switch_attr')
+        limb.switch_fk_value = data.get('switch_fk_value', 0.0)
+        limb.switch_ik_value = data.get('switch_ik_value', 1.0)
+        limb.bake_fingerprints = data.get('bake_fingerprints', {})
+        return limb
+    
+    def copy(self):
+        """复制肢体（列表和指纹各自独立，不经过 to_dict / from_dict）"""
+        limb = LimbData(self.name)
+        limb.blend_joints = list(self.blend_joints)
+        limb.fk_controls = list(self.fk_controls)
+        limb.ik_control = self.ik_control
+        limb.pole_vector = self.pole_vector
+        limb.rotation_offset = list(self.rotation_offset) if self.rotation_offset else self.rotation_offset
+        limb.rest_matrices = list(self.rest_matrices) if self.rest_matrices else self.rest_matrices
+        limb.namespace = self.namespace
+        limb.switch_attr = self.switch_attr
+        limb.switch_fk_value = self.switch_fk_value
+        limb.switch_ik_value = self.switch_ik_value
+        limb.bake_fingerprints = {
+            direction: dict(stored, blocks=dict(stored.get('blocks', {})))
+            for direction, stored in self.bake_fingerprints.items()
+        }
+        return limb
+    
+    def node_names(self):
+        """肢体引用的所有节点名称（不包括链中缺失的位置）"""
+        names = [name for name in list(self.blend_joints) + list(self.fk_controls) if name]
+        names.extend(name for name in (self.ik_control, self.pole_vector) if name)
+        if self.switch_attr:
+            names.append(self.switch_attr.split('.')[0])
+        return names
+    
+    def rename_nodes(self, renamed):
+        """
+        按 {旧名称: 新名称} 替换肢体中引用的节点（名称与 node_names() 中的写法相同，见 renamed_aliases）
+        
+        Returns:
+            bool: 是否有引用被修改
+        """
+        def rename(name):
+            if not name:
+                return name
+            node, dot, attr = name.partition('.')
+            return renamed.get(node, node) + dot + attr
+        
+        before = self.node_names()
+        self.blend_joints = [rename(name) for name in self.blend_joints]
+        self.fk_controls = [rename(name) for name in self.fk_controls]
+        self.ik_control = rename(self.ik_control)
+        self.pole_vector = rename(self.pole_vector)
+        self.switch_attr = rename(self.switch_attr)
+        return self.node_names() != before
+    
+    def template_name(self):
+        """去掉命名空间前缀后的肢体名称（命名空间取实例的命名空间，或第一个节点的命名空间）"""
+        nodes = self.node_names()
+        namespace = self.namespace or (namespace_of(nodes[0]) if nodes else '')
+        prefix = f'{namespace}:'
+        return self.name[len(prefix):] if namespace and self.name.startswith(prefix) else self.name
+    
+    def relative(self):
+        """转换为与命名空间无关的模板（节点名称去掉命名空间和DAG路径）"""
+        template = LimbData(self.template_name())
+        template.blend_joints = [strip_namespace(name) if name else name for name in self.blend_joints]
+        template.fk_controls = [strip_namespace(name) if name else name for name in self.fk_controls]
+        template.ik_control = strip_namespace(self.ik_control) if self.ik_control else None
+        template.pole_vector = strip_namespace(self.pole_vector) if self.pole_vector else None
+        template.rotation_offset = list(self.rotation_offset) if self.rotation_offset else None
+        template.switch_attr = strip_namespace(self.switch_attr) if self.switch_attr else None
+        template.switch_fk_value = self.switch_fk_value
+        template.switch_ik_value = self.switch_ik_value
+        return template
+    
+    def in_namespace(self, namespace):
+        """由模板生成指定命名空间中的实例（肢体名称为 命名空间:名称）"""
+        def resolve(name):
+            return f'{namespace}:{name}' if namespace and name else name
+        
+        limb = LimbData(resolve(self.name))
+        limb.blend_joints = [resolve(name) for name in self.blend_joints]
+        limb.fk_controls = [resolve(name) for name in self.fk_controls]
+        limb.ik_control = resolve(self.ik_control)
+        limb.pole_vector = resolve(self.pole_vector)
+        limb.rotation_offset = list(self.rotation_offset) if self.rotation_offset else None
+        limb.namespace = namespace
+        limb.switch_attr = resolve(self.switch_attr)
+        limb.switch_fk_value = self.switch_fk_value
+        limb.switch_ik_value = self.switch_ik_value
+        return limb
+
+
+# 单位四元数（没有旋转偏移的肢体）
+IDENTITY_QUATERNION = (0.0, 0.0, 0.0, 1.0)
+
+
+class LimbTable:
+    """
+    肢体的紧凑表示（struct-of-arrays），用于成百上千个肢体的批量计算
+    
+    节点名称去重后编号（nodes[编号] / node_id(名称)），同名节点只保存一份；骨骼链按偏移量存放在一维数组中：
+    第 i 个肢体的 Blend骨骼编号为 blend_ids[blend_offsets[i]:blend_offsets[i + 1]]，FK控制器同理。
+    IK控制器、极向量、切换属性节点每个肢体一个编号（没有时为 -1）。
+    旋转偏移为连续的 N×4 float64 缓冲区（四元数 x, y, z, w），没有四元数偏移的肢体为单位四元数、
+    has_offset 为 0；offset_rows() 零拷贝地得到 (N, 4) 数组。
+    
+    表是只读快照：由 LimbData 构建，修改偏移后通过 apply_offsets 写回
+    """
+    
+    __slots__ = (
+        'names', 'nodes', '_node_ids', 'blend_offsets', 'blend_ids', 'fk_offsets', 'fk_ids',
+        'ik_ids', 'pole_ids', 'switch_ids', 'switch_attrs', 'switch_values', 'rotation_offsets', 'has_offset',
+        '_rows',
+    )
+    
+    def __init__(self, limbs=()):
+        self.names = []
+        self.nodes = []
+        self._node_ids = None
+        self.blend_offsets = array.array('i', [0])
+        self.blend_ids = array.array('i')
+        self.fk_offsets = array.array('i', [0])
+        self.fk_ids = array.array('i')
+        self.ik_ids = array.array('i')
+        self.pole_ids = array.array('i')
+        self.switch_ids = array.array('i')
+        self.switch_attrs = []
+        self.switch_values = array.array('d')  # 每个肢体 [FK值, IK值]
+        self.rotation_offsets = array.array('d')
+        self.has_offset = array.array('b')
+        self._rows = None
+        
+        ids = {}
+        
+        def node_id(name):
+            index = ids.get(name)
+            if index is None:
+                index = ids[name] = len(self.nodes)
+                self.nodes.append(name)
+            return index
+        
+        for limb in limbs:
+            self.names.append(limb.name)
+            self.blend_ids.extend(node_id(name) for name in limb.blend_joints)
+            self.blend_offsets.append(len(self.blend_ids))
+            self.fk_ids.extend(node_id(name) for name in limb.fk_controls)
+            self.fk_offsets.append(len(self.fk_ids))
+            self.ik_ids.append(node_id(limb.ik_control) if limb.ik_control else -1)
+            self.pole_ids.append(node_id(limb.pole_vector) if limb.pole_vector else -1)
+            switch_node, _, switch_attr = (limb.switch_attr or '').partition('.')
+            self.switch_ids.append(node_id(switch_node) if switch_node else -1)
+            self.switch_attrs.append(switch_attr or None)
+            self.switch_values.extend((limb.switch_fk_value, limb.switch_ik_value))
+            offset = limb.rotation_offset
+            quaternion = offset is not None and len(offset) == 4
+            self.rotation_offsets.extend(offset if quaternion else IDENTITY_QUATERNION)
+            self.has_offset.append(1 if quaternion else 0)
+    
+    def node_id(self, name):
+        """节点名称的编号，表中没有时为 -1"""
+        if self._node_ids is None:
+            self._node_ids = {node: index for index, node in enumerate(self.nodes)}
+        return self._node_ids.get(name, -1)
+    
+    def __len__(self):
+        return len(self.names)
+    
+    def __iter__(self):
+        return (LimbView(self, index) for index in range(len(self.names)))
+    
+    def view(self, index):
+        """第 index 个肢体的轻量视图（不复制数据）"""
+        return LimbView(self, index)
+    
+    def index(self, name):
+        return self.names.index(name)
+    
+    def chain_ids(self, kind, index):
+        """第 index 个肢体的 'blend' 或 'fk' 链的节点编号"""
+        offsets, ids = (self.blend_offsets, self.blend_ids) if kind == 'blend' else (self.fk_offsets, self.fk_ids)
+        return ids[offsets[index]:offsets[index + 1]]
+    
+    def end_ids(self, kind='blend'):
+        """每个肢体 'blend' 或 'fk' 链末端的节点编号（链为空时为 -1）"""
+        offsets, ids = (self.blend_offsets, self.blend_ids) if kind == 'blend' else (self.fk_offsets, self.fk_ids)
+        return array.array('i', (ids[end - 1] if end > start else -1 for start, end in zip(offsets, offsets[1:])))
+    
+    def offset_rows(self):
+        """旋转偏移的 (N, 4) 数组（零拷贝，写入直接修改表），NumPy 不可用时返回 None"""
+        if self._rows is None:
+            kernel = get_kernel()
+            if kernel is None:
+                return None
+            self._rows = kernel.buffer_rows(self.rotation_offsets, 4)
+        return self._rows
+    
+    def apply_offsets(self, limbs, mask=None):
+        """
+        把表中的旋转偏移写回 LimbData（names 顺序对应，mask 为需要写回的肢体，None 为 has_offset 的肢体）
+        """
+        values = self.rotation_offsets
+        for index, limb in enumerate(limbs):
+            if mask[index] if mask is not None else self.has_offset[index]:
+                limb.rotation_offset = list(values[index * 4:index * 4 + 4])
+
+
+class LimbView:
+    """LimbTable 中单个肢体的只读视图，节点名称在访问时由编号还原"""
+    
+    __slots__ = ('table', 'index')
+    
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+    
+    @property
+    def name(self):
+        return self.table.names[self.index]
+    
+    def _node(self, ids):
+        index = ids[self.index]
+        return self.table.nodes[index] if index >= 0 else None
+    
+    @property
+    def blend_joints(self):
+        return [self.table.nodes[i] for i in self.table.chain_ids('blend', self.index)]
+    
+    @property
+    def fk_controls(self):
+        return [self.table.nodes[i] for i in self.table.chain_ids('fk', self.index)]
+    
+    @property
+    def ik_control(self):
+        return self._node(self.table.ik_ids)
+    
+    @property
+    def pole_vector(self):
+        return self._node(self.table.pole_ids)
+    
+    @property
+    def switch_attr(self):
+        node = self._node(self.table.switch_ids)
+        attr = self.table.switch_attrs[self.index]
+        return f'{node}.{attr}' if node and attr else None
+    
+    @property
+    def rotation_offset(self):
+        if not self.table.has_offset[self.index]:
+            return None
+        return list(self.table.rotation_offsets[self.index * 4:self.index * 4 + 4])
+
+
+@profiled_operation('calibrate')
+def calibrate_limbs(limbs, table=None):
+    """
+    批量校准旋转偏移（需要 NumPy）
+    
+    在当前帧一次采样所有 IK控制器 和 末端Blend骨骼 的世界矩阵，用 offset_quaternions 一次算出 (N, 4) 偏移
+    写入 LimbTable，再写回 LimbData（同时保存静止姿势快照）。结果与逐肢体的 calibrate_limb 相同
+    
+    Args:
+        limbs: LimbData 列表
+        table: 由 limbs 构建的 LimbTable（None 时新建）
+    
+    Returns:
+        int: 校准成功的肢体数量
+    """
+    kernel = get_kernel()
+    resolver = get_resolver()
+    table = LimbTable(limbs) if table is None else table
+    ik_ids = table.ik_ids
+    end_ids = table.end_ids('blend')
+    valid = array.array('b', (
+        ik >= 0 and end >= 0 and resolver.exists(table.nodes[ik]) and resolver.exists(table.nodes[end])
+        for ik, end in zip(ik_ids, end_ids)
+    ))
+    rows = [index for index, ok in enumerate(valid) if ok]
+    if not rows:
+        return 0
+    
+    buffers = {table.nodes[node]: kernel.matrix_buffer(1) for index in rows for node in (ik_ids[index], end_ids[index])}
+    sample_world_matrices(buffers, [cmds.currentTime(query=True)])
+    ik_m = kernel.as_matrix_array([buffers[table.nodes[ik_ids[index]]] for index in rows])
+    blend_m = kernel.as_matrix_array([buffers[table.nodes[end_ids[index]]] for index in rows])
+    
+    table.offset_rows()[rows] = kernel.offset_quaternions(ik_m, blend_m)
+    for index in rows:
+        table.has_offset[index] = 1
+    table.apply_offsets(limbs, valid)
+    for index in rows:
+        limbs[index].rest_matrices = (buffers[table.nodes[ik_ids[index]]][0].tolist()
+                                      + buffers[table.nodes[end_ids[index]]][0].tolist())
+    return len(rows)
+
+
+# ============================================================================
+# 场景存储 / Scene Storage
+# ============================================================================
+
+# 场景中保存肢体数据的 network 节点
+SCENE_STORE_NODE = 'fkikMatch_data'
+SCENE_STORE_VERSION = 1
+
+
+@contextmanager
+def without_undo():
+    """上下文管理器：块内的命令不进入撤销队列（工具元数据不应被动画撤销影响）"""
+    state = cmds.undoInfo(query=True, stateWithoutFlush=True)
+    cmds.undoInfo(stateWithoutFlush=False)
+    try:
+        yield
+    finally:
+        cmds.undoInfo(stateWithoutFlush=state)
+
+
+def _add_message_attr(node, attr, multi=False):
+    if not cmds.attributeQuery(attr, node=node, exists=True):
+        cmds.addAttr(node, longName=attr, attributeType='message', multi=multi)
+
+
+def _add_typed_attr(node, attr, data_type):
+    if not cmds.attributeQuery(attr, node=node, exists=True):
+        cmds.addAttr(node, longName=attr, dataType=data_type)
+
+
+def _clear_inputs(plug):
+    """断开（多重）message 属性的所有输入并删除多余的元素"""
+    indices = cmds.getAttr(plug, multiIndices=True) or []
+    for index in indices:
+        cmds.removeMultiInstance(f'{plug}[{index}]', b=True)
+
+
+def _create_store_node():
+    node = cmds.createNode('network', name=SCENE_STORE_NODE, skipSelect=True)
+    cmds.addAttr(node, longName='fkikStoreVersion', attributeType='long', defaultValue=SCENE_STORE_VERSION)
+    _add_message_attr(node, 'limbs', multi=True)
+    return node
+
+
+def _create_limb_node(name):
+    """
+    每个肢体一个 network 节点：名称、校准四元数（doubleArray）和到控制器的 message 连接
+    
+    节点名称中的 ':'、'|'、空格等替换为 '_'（实例化的肢体名称带命名空间，例如 charA:L_Arm），
+    肢体的真实名称保存在 limbName 中
+    """
+    node = cmds.createNode('network', name=re.sub(r'[^0-9A-Za-z_]', '_', f'fkikLimb_{name}'), skipSelect=True)
+    _add_typed_attr(node, 'limbName', 'string')
+    _add_typed_attr(node, 'rotationOffset', 'doubleArray')
+    _add_typed_attr(node, 'restMatrices', 'doubleArray')
+    _add_message_attr(node, 'blendJoints', multi=True)
+    _add_message_attr(node, 'fkControls', multi=True)
+    _add_chain_name_attrs(node)
+    _add_message_attr(node, 'ikControl')
+    _add_message_attr(node, 'poleVector')
+    _add_switch_attrs(node)
+    _add_typed_attr(node, 'bakeFingerprints', 'string')
+    return node
+
+
+def _add_switch_attrs(node):
+    """FK/IK 切换属性：message 连接到所在节点 + 属性名 + [FK值, IK值]"""
+    _add_message_attr(node, 'switchNode')
+    _add_typed_attr(node, 'switchAttrName', 'string')
+    _add_typed_attr(node, 'switchValues', 'doubleArray')
+
+
+# 链中缺失的位置在列表中的显示
+MISSING_NODE_LABEL = '<missing>'
+
+# 链（多重 message 属性）及保存写入时名称的 stringArray 属性
+CHAIN_ATTRS = (('blendJoints', 'blendJointNames'), ('fkControls', 'fkControlNames'))
+
+
+def _add_chain_name_attrs(node):
+    """链的名称列表：节点不存在（无法连接）时保留原位置，读取时链之间不会错位"""
+    for _, names_attr in CHAIN_ATTRS:
+        _add_typed_attr(node, names_attr, 'stringArray')
+
+
+def _write_limb_node(node, limb):
+    cmds.setAttr(f'{node}.limbName', limb.name, type='string')
+    cmds.setAttr(f'{node}.rotationOffset', list(limb.rotation_offset or []), type='doubleArray')
+    
+    # 旧版本创建的节点可能还没有链名称、切换属性、烘焙指纹和静止姿势快照
+    _add_chain_name_attrs(node)
+    for (attr, names_attr), names in zip(CHAIN_ATTRS, (limb.blend_joints, limb.fk_controls)):
+        _clear_inputs(f'{node}.{attr}')
+        # 每个元素按原索引连接；不存在的节点只保存名称，不压缩列表
+        for index, name in enumerate(names):
+            if name and cmds.objExists(name):
+                cmds.connectAttr(f'{name}.message', f'{node}.{attr}[{index}]', force=True)
+        cmds.setAttr(f'{node}.{names_attr}', len(names), *[name or '' for name in names], type='stringArray')
+    
+    _add_switch_attrs(node)
+    _add_typed_attr(node, 'bakeFingerprints', 'string')
+    _add_typed_attr(node, 'restMatrices', 'doubleArray')
+    cmds.setAttr(f'{node}.restMatrices', list(limb.rest_matrices or []), type='doubleArray')
+    cmds.setAttr(f'{node}.bakeFingerprints', json.dumps(limb.bake_fingerprints), type='string')
+    switch_node, _, switch_attr = (limb.switch_attr or '').partition('.')
+    cmds.setAttr(f'{node}.switchAttrName', switch_attr, type='string')
+    cmds.setAttr(f'{node}.switchValues', [limb.switch_fk_value, limb.switch_ik_value], type='doubleArray')
+    
+    for attr, name in (('ikControl', limb.ik_control), ('poleVector', limb.pole_vector),
+                       ('switchNode', switch_node)):
+        sources = cmds.listConnections(f'{node}.{attr}', source=True, destination=False, plugs=True) or []
+        for source in sources:
+            cmds.disconnectAttr(source, f'{node}.{attr}')
+        if name and cmds.objExists(name):
+            cmds.connectAttr(f'{name}.message', f'{node}.{attr}', force=True)
+
+
+# 场景存储的写入次数，以及最近一次写入的肢体（id），get_command_matcher 用来判断缓存的引擎是否过期
+_store_writes = 0
+_store_source = None
+
+
+def _limb_ids(limbs):
+    return frozenset(id(limb) for limb in limbs)
+
+
+def write_scene_limbs(limbs):
+    """
+    把肢体定义和校准数据写入场景中的 network 节点
+    
+    已有的肢体节点按名称原地更新，多余的删除；控制器通过 message 连接引用，
+    重命名后仍然有效。写入不进入撤销队列。
+    
+    Args:
+        limbs: LimbData 列表（保持顺序）
+    """
+    global _store_writes, _store_source
+    _store_writes += 1
+    _store_source = _limb_ids(limbs)
+    with without_undo():
+        root = SCENE_STORE_NODE if cmds.objExists(SCENE_STORE_NODE) else _create_store_node()
+        
+        existing = {}
+        for node in cmds.listConnections(f'{root}.limbs', source=True, destination=False) or []:
+            existing[cmds.getAttr(f'{node}.limbName')] = node
+        
+        _clear_inputs(f'{root}.limbs')
+        for index, limb in enumerate(limbs):
+            node = existing.pop(limb.name, None) or _create_limb_node(limb.name)
+            _write_limb_node(node, limb)
+            cmds.connectAttr(f'{node}.message', f'{root}.limbs[{index}]', force=True)
+        
+        if existing:
+            cmds.delete(list(existing.values()))
+
+
+def _source_name(plug):
+    """message 属性输入节点的唯一名称，没有连接时返回 None"""
+    source = plug.source()
+    if source.isNull:
+        return None
+    obj = source.node()
+    if obj.hasFn(om2.MFn.kDagNode):
+        return om2.MDagPath.getAPathTo(obj).partialPathName()
+    return om2.MFnDependencyNode(obj).name()
+
+
+def _source_names(plug, stored_names=None):
+    """
+    多重 message 属性按逻辑索引读取的节点名称，与其他链保持位置对应
+    
+    没有连接的元素（节点缺失或连接断开）不压缩列表：使用写入时保存的名称，没有时为 None
+    
+    Returns:
+        (名称列表, 是否所有元素都有连接)
+    """
+    stored_names = stored_names or []
+    connected = {plug.elementByPhysicalIndex(i).logicalIndex() for i in range(plug.numElements())}
+    count = max(len(stored_names), max(connected) + 1 if connected else 0)
+    names = []
+    complete = True
+    for index in range(count):
+        name = _source_name(plug.elementByLogicalIndex(index)) if index in connected else None
+        if name is None:
+            complete = False
+            name = stored_names[index] if index < len(stored_names) and stored_names[index] else None
+        names.append(name)
+    return names, complete
+
+
+def _string_array(node_fn, attr):
+    if not node_fn.hasAttribute(attr):
+        return []
+    data = node_fn.findPlug(attr, False).asMObject()
+    return list(om2.MFnStringArrayData(data).array()) if not data.isNull() else []
+
+
+def read_scene_limbs(incomplete=None):
+    """
+    从场景中的 network 节点读取肢体（通过 API 直接读取连接，不解析 JSON）
+    
+    Args:
+        incomplete: 可选列表，收集链中有节点缺失或连接断开的肢体名称（缺失的位置保留名称或 None）
+    
+    Returns:
+        list: LimbData 列表；场景中没有存储节点时返回 None
+    """
+    sel = om2.MSelectionList()
+    try:
+        sel.add(SCENE_STORE_NODE)
+    except RuntimeError:
+        return None
+    
+    root_plug = om2.MFnDependencyNode(sel.getDependNode(0)).findPlug('limbs', False)
+    limbs = []
+    for i in range(root_plug.numElements()):
+        source = root_plug.elementByPhysicalIndex(i).source()
+        if source.isNull:
+            continue
+        node_fn = om2.MFnDependencyNode(source.node())
+        
+        limb = LimbData(node_fn.findPlug('limbName', False).asString())
+        chains = [
+            _source_names(node_fn.findPlug(attr, False), _string_array(node_fn, names_attr))
+            for attr, names_attr in CHAIN_ATTRS
+        ]
+        (limb.blend_joints, blend_complete), (limb.fk_controls, fk_complete) = chains
+        if incomplete is not None and not (blend_complete and fk_complete):
+            incomplete.append(limb.name)
+        limb.ik_control = _source_name(node_fn.findPlug('ikControl', False))
+        limb.pole_vector = _source_name(node_fn.findPlug('poleVector', False))
+        
+        data = node_fn.findPlug('rotationOffset', False).asMObject()
+        offset = list(om2.MFnDoubleArrayData(data).array()) if not data.isNull() else []
+        limb.rotation_offset = offset or None
+        limb.namespace = namespace_of(limb.name)
+        
+        if node_fn.hasAttribute('switchNode'):
+            switch_node = _source_name(node_fn.findPlug('switchNode', False))
+            switch_attr = node_fn.findPlug('switchAttrName', False).asString()
+            if switch_node and switch_attr:
+                limb.switch_attr = f'{switch_node}.{switch_attr}'
+            data = node_fn.findPlug('switchValues', False).asMObject()
+            values = list(om2.MFnDoubleArrayData(data).array()) if not data.isNull() else []
+            if len(values) == 2:
+                limb.switch_fk_value, limb.switch_ik_value = values
+        if node_fn.hasAttribute('restMatrices'):
+            data = node_fn.findPlug('restMatrices', False).asMObject()
+            rest = list(om2.MFnDoubleArrayData(data).array()) if not data.isNull() else []
+            limb.rest_matrices = rest if len(rest) == 32 else None
+        if node_fn.hasAttribute('bakeFingerprints'):
+            limb.bake_fingerprints = json.loads(node_fn.findPlug('bakeFingerprints', False).asString() or '{}')
+        limbs.append(limb)
+    return limbs
+
+
+def delete_scene_limbs():
+    """删除场景中的肢体存储节点"""
+    if not cmds.objExists(SCENE_STORE_NODE):
+        return
+    with without_undo():
+        nodes = cmds.listConnections(f'{SCENE_STORE_NODE}.limbs', source=True, destination=False) or []
+        cmds.delete(nodes + [SCENE_STORE_NODE])
+
+
+# ============================================================================
+# 命名空间实例 / Namespace Instancing
+# ============================================================================
+
+def namespace_of(name):
+    """节点的命名空间（'shot:charA:L_arm' → 'shot:charA'，根命名空间为 ''）"""
+    return name.split('|')[-1].rpartition(':')[0]
+
+
+def strip_namespace(name):
+    """去掉命名空间和DAG路径（'charA:grp|charA:L_arm' → 'L_arm'）"""
+    return name.split('|')[-1].rpartition(':')[2]
+
+
+_instance_cache = {}
+
+
+def find_limb_instances(templates, namespaces=None):
+    """
+    查找场景中所有包含模板节点的命名空间，生成肢体实例
+    
+    所有模板节点名称通过一次 cmds.ls(recursive=True) 在全部命名空间中查询。
+    每个命名空间的校验结果（哪些模板节点齐全）按场景结构版本（NodeResolver.generation）缓存，
+    结构不变时重复调用不再查询场景。
+    
+    Args:
+        templates: 模板 LimbData 列表（节点名称不含命名空间）
+        namespaces: 只使用这些命名空间（None 为全部）
+    
+    Returns:
+        dict: {命名空间: [LimbData 实例]}，按命名空间排序；只包含节点齐全的肢体
+    """
+    resolver = get_resolver()
+    key = (
+        tuple((t.name, tuple(t.node_names())) for t in templates),
+        tuple(namespaces) if namespaces is not None else None,
+    )
+    cached = _instance_cache.get(key)
+    if cached is not None and cached[0] == resolver.generation:
+        valid = cached[1]
+    else:
+        relative_names = sorted({name for template in templates for name in template.node_names()})
+        found = {}  # {命名空间: {相对名称}}
+        for node in cmds.ls(relative_names, recursive=True) or []:
+            found.setdefault(namespace_of(node), set()).add(strip_namespace(node))
+        
+        if namespaces is not None:
+            found = {ns: names for ns, names in found.items() if ns in set(namespaces)}
+        
+        # {命名空间: [节点齐全的模板索引]}
+        valid = {}
+        for namespace in sorted(found):
+            names = found[namespace]
+            indices = [i for i, t in enumerate(templates) if all(n in names for n in t.node_names())]
+            if indices:
+                valid[namespace] = indices
+        
+        _instance_cache.clear()
+        _instance_cache[key] = (resolver.generation, valid)
+    
+    return {namespace: [templates[i].in_namespace(namespace) for i in indices] for namespace, indices in valid.items()}
+
+
+# ============================================================================
+# 预设库 / Preset Library
+# ============================================================================
+
+# 索引文件（位于预设目录中，共享目录中的所有用户共用）
+PRESET_INDEX_FILE = '.fkik_preset_index.json'
+PRESET_INDEX_VERSION = 1
+# 内存中保留的已解析预设数量（最近使用）
+PRESET_CACHE_SIZE = 16
+
+_preset_library = None
+
+
+class PresetMatch:
+    """PresetLibrary.match_scene() 的一项结果"""
+
+    def __init__(self, name, entry, coverage, namespaces):
+        self.name = name                # 预设文件（相对于预设目录）
+        self.entry = entry              # 索引条目
+        self.coverage = coverage        # 场景中存在的节点比例
+        self.namespaces = namespaces    # 节点齐全的命名空间（根命名空间为 ''）
+
+    @property
+    def complete(self):
+        return bool(self.namespaces)
+
+
+class PresetLibrary:
+    """
+    预设目录的索引
+
+    索引文件记录每个预设的角色名称、肢体数量、节点名称及其指纹、修改时间和大小。
+    refresh() 只重新解析修改时间或大小改变的预设，索引有变化时原子地写回；
+    load() 按需解析单个预设，解析结果按最近使用保留 cache_size 个；
+    match_scene() 用一次 cmds.ls 查询所有预设的节点，结果按场景结构版本缓存
+    """
+
+    def __init__(self, directory, cache_size=PRESET_CACHE_SIZE):
+        self.directory = directory
+        self.cache_size = cache_size
+        self.entries = {}       # {预设文件: 索引条目}
+        self._index_mtime = None
+        self._version = 0       # 索引内容的版本（match_scene 缓存用）
+        self._parsed = {}       # {路径: ((修改时间, 大小), {肢体名称: LimbData})}，按使用顺序
+        self._matches = None    # ((场景结构版本, 索引版本), [PresetMatch])
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, PRESET_INDEX_FILE)
+
+    def _path(self, name):
+        """预设的规范化绝对路径（解析结果缓存的键），同一个文件无论怎样书写只缓存一次"""
+        return os.path.normcase(os.path.realpath(os.path.join(self.directory, name)))
+
+    # ============ 索引 ============
+
+    def _read_index(self):
+        """索引文件被修改过（例如其他用户更新了共享目录）时重新读取"""
+        try:
+            mtime = os.path.getmtime(self.index_path)
+        except OSError:
+            return
+        if mtime == self._index_mtime:
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._index_mtime = mtime
+        if data.get('version') == PRESET_INDEX_VERSION:
+            self.entries = data.get('presets', {})
+            self._version += 1
+
+    def _write_index(self):
+        """原子地写回索引（先写临时文件再替换）；目录只读时索引只保留在内存中"""
+        temp_path = f'{self.index_path}.{os.getpid()}.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': PRESET_INDEX_VERSION, 'presets': self.entries}, f, ensure_ascii=False)
+            os.replace(temp_path, self.index_path)
+            self._index_mtime = os.path.getmtime(self.index_path)
+        except OSError:
+            pass
+
+    def _scan(self):
+        """目录（包括子目录）中的所有预设：{预设文件: os.stat_result}"""
+        files = {}
+        for root, dirs, names in os.walk(self.directory):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for file_name in names:
+                if not file_name.endswith('.json') or file_name.startswith('.'):
+                    continue
+                path = os.path.join(root, file_name)
+                try:
+                    files[os.path.relpath(path, self.directory).replace(os.sep, '/')] = os.stat(path)
+                except OSError:
+                    continue
+        return files
+
+    @staticmethod
+    def _index_entry(name, limbs, stat):
+        """预设的索引条目；nodes 为节点名称（去掉DAG路径），template 表示节点不含命名空间"""
+        nodes = sorted({node.split('|')[-1] for limb in limbs.values() for node in limb.node_names()})
+        return {
+            'rig': os.path.splitext(os.path.basename(name))[0],
+            'limbs': len(limbs),
+            'nodes': nodes,
+            'fingerprint': hashlib.sha1('\n'.join(nodes).encode('utf-8')).hexdigest()[:16],
+            'template': not any(':' in node for node in nodes),
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+        }
+
+    def refresh(self):
+        """
+        同步索引与目录：新增或修改过的预设重新解析，已删除的移除
+
+        Returns:
+            int: 重新索引的预设数量
+        """
+        self._read_index()
+        files = self._scan()
+        removed = [name for name in self.entries if name not in files]
+        for name in removed:
+            del self.entries[name]
+
+        reindexed = 0
+        for name, stat in files.items():
+            entry = self.entries.get(name)
+            if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+                continue
+            try:
+                limbs = self._parse(self._path(name), stat)
+            except (OSError, ValueError, KeyError, TypeError, AttributeError):
+                # 不是有效的预设：记录为空条目，文件不变时不再解析
+                limbs = {}
+            self.entries[name] = self._index_entry(name, limbs, stat)
+            reindexed += 1
+
+        if removed or reindexed:
+            self._version += 1
+            self._write_index()
+        return reindexed
+
+    # ============ 加载 ============
+
+    def _parse(self, path, stat):
+        """解析预设并放入缓存；path 为 _path() 规范化后的路径"""
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        limbs = {name: LimbData.from_dict(limb_data) for name, limb_data in data.items()}
+        self._parsed[path] = ((stat.st_mtime, stat.st_size), limbs)
+        while len(self._parsed) > self.cache_size:
+            del self._parsed[next(iter(self._parsed))]
+        return limbs
+
+    def load(self, name):
+        """
+        按需解析预设，文件未修改时使用内存中的结果
+
+        Args:
+            name: 索引中的预设文件，或任意预设路径
+
+        Returns:
+            dict: {肢体名称: LimbData}（副本，可以自由修改）
+        """
+        path = self._path(name)
+        stat = os.stat(path)
+        cached = self._parsed.pop(path, None)
+        if cached is not None and cached[0] == (stat.st_mtime, stat.st_size):
+            self._parsed[path] = cached
+            limbs = cached[1]
+        else:
+            limbs = self._parse(path, stat)
+        return {limb_name: limb.copy() for limb_name, limb in limbs.items()}
+
+    # ============ 场景匹配 ============
+
+    def match_scene(self):
+        """
+        按场景中的节点为所有预设评分
+
+        所有预设的节点名称通过一次 cmds.ls(recursive=True) 在全部命名空间中查询；
+        结果按场景结构版本（NodeResolver.generation）和索引版本缓存。
+        模板预设在节点齐全的每个命名空间中匹配，其他预设要求节点名称完全一致。
+
+        Returns:
+            list: [PresetMatch]，节点齐全的在前，然后按节点比例、节点数量（越具体越靠前）、修改时间排序
+        """
+        self.refresh()
+        key = (get_resolver().generation, self._version)
+        if self._matches is not None and self._matches[0] == key:
+            return self._matches[1]
+
+        entries = {name: entry for name, entry in self.entries.items() if entry['nodes']}
+        relative_names = sorted({strip_namespace(node) for entry in entries.values() for node in entry['nodes']})
+        found = set()       # 场景中存在的节点名称（去掉DAG路径）
+        namespaces = {}     # {相对名称: {命名空间}}
+        for node in (cmds.ls(relative_names, recursive=True) or []) if relative_names else []:
+            node = node.split('|')[-1]
+            found.add(node)
+            namespaces.setdefault(strip_namespace(node), set()).add(namespace_of(node))
+
+        matches = []
+        for name, entry in entries.items():
+            nodes = entry['nodes']
+            if entry['template']:
+                present = [namespaces.get(node, set()) for node in nodes]
+                coverage = sum(1 for node_namespaces in present if node_namespaces) / len(nodes)
+                complete = sorted(set.intersection(*present))
+            else:
+                coverage = sum(1 for node in nodes if node in found) / len(nodes)
+                complete = sorted({namespace_of(node) for node in nodes}) if coverage == 1.0 else []
+            matches.append(PresetMatch(name, entry, coverage, complete))
+
+        matches.sort(key=lambda m: (not m.complete, -m.coverage, -len(m.entry['nodes']), -m.entry['mtime'], m.name))
+        self._matches = (key, matches)
+        return matches
+
+    def select(self):
+        """与场景匹配的最佳预设（节点齐全），没有时返回 None"""
+        matches = self.match_scene()
+        return matches[0] if matches and matches[0].complete else None
+
+
+def get_preset_library():
+    """预设目录（get_preset_directory）的预设库，目录改变时重新创建"""
+    global _preset_library
+    directory = get_preset_directory()
+    if _preset_library is None or _preset_library.directory != directory:
+        _preset_library = PresetLibrary(directory)
+    return _preset_library
+
+
+# ============================================================================
+# 绑定姿势校准 / Bind Pose Calibration
+# ============================================================================
+
+# 绑定矩阵的来源
+BIND_SOURCE_SNAPSHOT = 'snapshot'
+BIND_SOURCE_DAGPOSE = 'dagPose'
+BIND_SOURCE_SKIN = 'bindPreMatrix'
+BIND_SOURCE_IK_OFFSET = 'ikOffset'  # 完全处于IK模式时：末端Blend骨骼的绑定矩阵 + IK控制器相对它的当前偏移
+
+
+def matrix_values(matrix):
+    """MMatrix → 16 个值的列表（行主序，可以再用 om2.MMatrix 还原）"""
+    return [matrix.getElement(row, col) for row in range(4) for col in range(4)]
+
+
+def rotation_offset_from_matrices(ik_matrix, blend_matrix):
+    """
+    IK控制器 和 末端Blend骨骼 世界矩阵之间的纯旋转偏移（四元数 [x, y, z, w]）
+    
+    offset_quat = IK_quat × Blend_quat⁻¹，只捕捉旋转差异，不受位移影响
+    """
+    ik_quat = om2.MTransformationMatrix(ik_matrix).rotation(asQuaternion=True)
+    blend_quat = om2.MTransformationMatrix(blend_matrix).rotation(asQuaternion=True)
+    offset_quat = ik_quat * blend_quat.inverse()
+    return [offset_quat.x, offset_quat.y, offset_quat.z, offset_quat.w]
+
+
+def _depend_node(name):
+    sel = om2.MSelectionList()
+    sel.add(name)
+    return om2.MFnDependencyNode(sel.getDependNode(0))
+
+
+def _bind_ik_offset_usable(limb):
+    """肢体是否完全处于IK模式（切换属性等于IK值），此时末端Blend骨骼跟随IK链，可以代替IK骨骼"""
+    if not limb.switch_attr or not all(get_resolver().exists(node) for node in (limb.ik_control, limb.blend_joints[-1])):
+        return False
+    node, _, attr = limb.switch_attr.partition('.')
+    plug = get_plug(node, attr) if get_resolver().exists(node) else None
+    return plug is not None and abs(plug.asDouble() - limb.switch_ik_value) < 1e-6
+
+
+def _bind_from_ik_offset(limb, blend_bind=None):
+    """
+    没有IK控制器绑定数据时的回退：IK控制器的绑定矩阵 = 相对末端Blend骨骼的当前偏移 × 该骨骼的绑定矩阵
+    
+    Returns:
+        (IK控制器矩阵, Blend骨骼矩阵, 来源)
+    """
+    blend_end = limb.blend_joints[-1]
+    blend_current = get_world_mmatrix(blend_end)
+    blend_matrix, blend_source = blend_bind or (blend_current, None)
+    ik_matrix = get_world_mmatrix(limb.ik_control) * blend_current.inverse() * blend_matrix
+    source = BIND_SOURCE_IK_OFFSET if blend_source is None else f'{BIND_SOURCE_IK_OFFSET}+{blend_source}'
+    return ik_matrix, blend_matrix, source
+
+
+@profiled('read')
+def read_bind_matrices(nodes, poses=None):
+    """
+    从绑定数据批量读取节点在绑定姿势下的世界矩阵，不改变当前姿势
+    
+    来源按优先级：dagPose 节点（bindPose 优先，其次其他保存的姿势，members[i] 对应 worldMatrix[i]），
+    skinCluster 的 bindPreMatrix（matrix[i] 的输入骨骼，取逆）。每个 dagPose / skinCluster 只遍历一次
+    
+    Args:
+        nodes: 节点名称
+        poses: 只使用这些 dagPose 节点（None 为场景中全部）
+    
+    Returns:
+        dict: {节点名称: (MMatrix, 来源)}，没有绑定数据的节点不在其中
+    """
+    resolver = get_resolver()
+    wanted = {resolver.path_name(name): name for name in nodes if resolver.exists(name)}
+    found = {}
+    
+    def collect(fn, members_attr, matrix_attr, source, invert):
+        members = fn.findPlug(members_attr, False)
+        matrices = fn.findPlug(matrix_attr, False)
+        for i in range(members.numElements()):
+            member = members.elementByPhysicalIndex(i)
+            name = wanted.get(_source_name(member))
+            if name is None or name in found:
+                continue
+            matrix = om2.MFnMatrixData(matrices.elementByLogicalIndex(member.logicalIndex()).asMObject()).matrix()
+            found[name] = (matrix.inverse() if invert else matrix, source)
+    
+    pose_fns = [_depend_node(pose) for pose in (cmds.ls(type='dagPose') or [] if poses is None else poses)]
+    pose_fns.sort(key=lambda fn: not fn.findPlug('bindPose', False).asBool())
+    for fn in pose_fns:
+        collect(fn, 'members', 'worldMatrix', BIND_SOURCE_DAGPOSE, False)
+    
+    if len(found) < len(wanted):
+        for skin in cmds.ls(type='skinCluster') or []:
+            collect(_depend_node(skin), 'matrix', 'bindPreMatrix', BIND_SOURCE_SKIN, True)
+    return found
+
+
+# ============================================================================
+# 反向索引 / Reverse Index
+# ============================================================================
+
+class LimbRegistry(dict):
+    """
+    {肢体名称: LimbData}，每次增删或替换肢体时递增 version
+    
+    FKIKMatcher.limbs 总是 LimbRegistry，LimbIndex 用 version 判断是否需要重建
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = 0
+    
+    def __setitem__(self, key, value):
+        self.version += 1
+        super().__setitem__(key, value)
+    
+    def __delitem__(self, key):
+        self.version += 1
+        super().__delitem__(key)
+    
+    def pop(self, *args):
+        self.version += 1
+        return super().pop(*args)
+    
+    def popitem(self):
+        self.version += 1
+        return super().popitem()
+    
+    def setdefault(self, key, default=None):
+        self.version += 1
+        return super().setdefault(key, default)
+    
+    def update(self, *args, **kwargs):
+        self.version += 1
+        super().update(*args, **kwargs)
+    
+    def clear(self):
+        self.version += 1
+        super().clear()
+
+
+def renamed_aliases(names, old, new, path=None):
+    """
+    节点 old 改名为 new 后，names 中指向它（或它的子级）的写法及其新写法
+    
+    名称可以是短名称、部分DAG路径或完整DAG路径：其中等于 old 的路径段替换为 new。
+    DAG节点（path 为改名后的完整路径）只替换新写法解析到该节点或其子级的名称，
+    不会误改其他层级下的同名节点
+    
+    Returns:
+        dict: {旧写法: 新写法}
+    """
+    resolver = get_resolver()
+    renamed = {}
+    for name in names:
+        segments = name.split('|')
+        if old not in segments:
+            continue
+        candidate = '|'.join(new if segment == old else segment for segment in segments)
+        if path is not None:
+            dag_path = resolver.dag_path(candidate)
+            full = dag_path.fullPathName() if dag_path is not None else None
+            if full is None or (full != path and not full.startswith(f'{path}|')):
+                continue
+        renamed[name] = candidate
+    return renamed
+
+
+class LimbIndex:
+    """
+    节点名称 → 肢体名称 的反向索引（Blend骨骼、FK/IK控制器、极向量、切换属性节点）
+    
+    肢体集合改变（LimbRegistry.version）后的第一次查询时重建一次，之后每个节点 O(1) 查找。
+    通过 NodeResolver 的回调保持最新：重命名时同时更新索引中的所有写法（短名称、DAG路径）
+    和肢体中保存的名称，并在空闲时把新名称写回场景存储节点；
+    删除的节点暂存，撤销删除后再次查询时恢复
+    """
+    
+    def __init__(self):
+        self._nodes = {}    # {节点名称（以及DAG路径的最后一段）: [肢体名称]}
+        self._removed = {}  # 已删除的节点 {名称: [肢体名称]}
+        self._limbs = None
+        self._version = None
+        self.builds = 0
+        self.store_dirty = False  # 重命名后场景存储中的名称还没有更新
+    
+    def _sync(self, limbs):
+        if self._limbs is limbs and self._version == limbs.version:
+            return
+        self._nodes = {}
+        self._removed = {}
+        for limb in limbs.values():
+            for node in limb.node_names():
+                for key in {node, node.rpartition('|')[2]}:
+                    names = self._nodes.setdefault(key, [])
+                    if limb.name not in names:
+                        names.append(limb.name)
+        self._limbs = limbs
+        self._version = limbs.version
+        self.builds += 1
+        get_resolver().add_listener(self)
+    
+    def lookup(self, limbs, nodes):
+        """
+        节点所属的肢体名称（按节点顺序，去重）
+        
+        Args:
+            limbs: LimbRegistry
+            nodes: 节点名称（例如 cmds.ls(selection=True)，可以是DAG路径）
+        """
+        self._sync(limbs)
+        found = {}
+        for node in nodes:
+            for key in (node, node.rpartition('|')[2]):
+                names = self._nodes.get(key)
+                if names is None and key in self._removed and get_resolver().exists(key):
+                    names = self._nodes[key] = self._removed.pop(key)
+                if names:
+                    found.update(dict.fromkeys(names))
+                    break
+        return [name for name in found if name in limbs]
+    
+    # ============ NodeResolver 通知 ============
+    
+    def node_renamed(self, old, new, path=None):
+        renamed = renamed_aliases(list(self._nodes), old, new, path)
+        if not renamed:
+            return
+        limb_names = {}
+        for key, alias in renamed.items():
+            names = self._nodes.pop(key)
+            target = self._nodes.setdefault(alias, [])
+            target.extend(name for name in names if name not in target)
+            limb_names.update(dict.fromkeys(names))
+        changed = False
+        for name in limb_names:
+            limb = self._limbs.get(name)
+            if limb is not None and limb.rename_nodes(renamed):
+                changed = True
+        if changed and not self.store_dirty:
+            # 回调中不修改场景，空闲时再写回（batch 模式下调用 save_to_scene）
+            self.store_dirty = True
+            cmds.evalDeferred(self.flush_store, lowestPriority=True)
+    
+    def flush_store(self):
+        """把重命名后的肢体写回已有的场景存储节点；肢体集合已经替换（界面会另外保存）时跳过"""
+        if not self.store_dirty:
+            return
+        self.store_dirty = False
+        if self._limbs is not None and self._version == self._limbs.version and cmds.objExists(SCENE_STORE_NODE):
+            write_scene_limbs(list(self._limbs.values()))
+    
+    def node_removed(self, name):
+        names = self._nodes.pop(name, None)
+        if names is not None:
+            self._removed[name] = names
+
+
+# ============================================================================
+# 匹配引擎 / Matching Engine
+# ============================================================================
+
+class FKIKMatcher:
+    """
+    无界面的 FK/IK 匹配引擎
+    
+    管理肢体注册、匹配、烘焙、校准和预设读写，不调用任何界面命令，
+    可以直接在 mayapy、农场任务或热键中使用。FKIKMatchUI 只是委托给它。
+    
+    用法:
+        matcher = FKIKMatcher()
+        matcher.load_preset('C:/presets/hero.json')
+        matcher.match_all(BAKE_IK_TO_FK)
+        matcher.bake(1, 120, BAKE_FK_TO_IK)
+    """
+    
+    def __init__(self, limbs=None):
+        self.index = LimbIndex()  # 节点名称 → 肢体（match_selection 使用）
+        self.limbs = {}  # {name: LimbData}
+        self.templates = {}  # {name: LimbData} 与命名空间无关的模板（instantiate 使用）
+        self.last_result = None  # fkikMatch 命令最近一次的结果（MatchPlan 或统计信息）
+        self.task_writer = None  # 等待 fkikMatch -task 放入撤销队列的后台任务 writer
+        self.incomplete_limbs = []  # 从场景加载时链中有节点缺失的肢体
+        self.bake_rates = {}  # {是否快速烘焙: 每个肢体帧的秒数}，用于估算快速烘焙节省的时间
+        for limb in limbs or []:
+            self.add_limb(limb)
+    
+    # ============ 肢体注册 ============
+    
+    @property
+    def limbs(self):
+        """{name: LimbData}（LimbRegistry，赋值普通字典时自动转换）"""
+        return self._limbs
+    
+    @limbs.setter
+    def limbs(self, value):
+        self._limbs = value if isinstance(value, LimbRegistry) else LimbRegistry(value)
+    
+    def add_limb(self, limb):
+        """注册（或替换）一个肢体"""
+        self.limbs[limb.name] = limb
+        return limb
+    
+    def remove_limb(self, name):
+        return self.limbs.pop(name, None)
+    
+    def get_limbs(self, names=None):
+        """按名称获取肢体列表，names 为 None 时返回全部"""
+        if names is None:
+            return list(self.limbs.values())
+        return [self.limbs[name] for name in names if name in self.limbs]
+    
+    def limbs_for_nodes(self, nodes=None):
+        """节点（默认为当前选择）所属的肢体，通过反向索引查找，不遍历所有肢体"""
+        if nodes is None:
+            nodes = cmds.ls(selection=True) or []
+        return self.get_limbs(self.index.lookup(self.limbs, nodes))
+    
+    # ============ 预设 ============
+    
+    def to_dict(self):
+        return {name: limb.to_dict() for name, limb in self.limbs.items()}
+    
+    def save_preset(self, file_path, template=False):
+        """
+        保存所有肢体到 JSON 预设
+        
+        template 为 True 时保存与命名空间无关的模板，可以用 instantiate() 应用到任意数量的引用角色
+        """
+        data = self.to_dict()
+        if template:
+            templates = list(self.templates.values()) or [limb.relative() for limb in self.get_limbs()]
+            data = {t.name: t.to_dict() for t in templates}
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+    
+    def load_preset(self, file_path):
+        """
+        从 JSON 预设加载肢体（替换当前所有肢体），未修改的预设使用预设库中已解析的结果
+
+        Returns:
+            int: 加载的肢体数量
+        """
+        self.limbs = get_preset_library().load(os.path.abspath(file_path))
+        self.templates = {}
+        return len(self.limbs)
+
+    def load_matching_preset(self, library=None):
+        """
+        从预设库中选择与场景节点匹配的预设并加载（见 PresetLibrary.select）
+
+        模板预设应用到节点齐全的所有命名空间，其他预设直接加载
+
+        Returns:
+            PresetMatch: 加载的预设，没有匹配的预设时为 None
+        """
+        library = library or get_preset_library()
+        match = library.select()
+        if match is None:
+            return None
+
+        limbs = library.load(match.name)
+        if match.entry['template'] and match.namespaces != ['']:
+            self.instantiate(list(limbs.values()), match.namespaces)
+        else:
+            self.limbs = limbs
+            self.templates = {}
+        return match
+    
+    def save_to_scene(self):
+        """把所有肢体（包括校准数据）保存到场景中的 network 节点，随场景文件一起保存"""
+        write_scene_limbs(self.get_limbs())
+        self.index.store_dirty = False
+    
+    def load_from_scene(self):
+        """
+        从场景中的 network 节点加载肢体（替换当前所有肢体）
+        
+        链中有节点缺失的肢体名称记录在 incomplete_limbs 中（缺失的位置不压缩，链之间不会错位）
+        
+        Returns:
+            int: 加载的肢体数量；场景中没有存储节点或没有肢体时返回 None 且不修改当前肢体
+                 （例如上一个镜头加载的预设继续使用）
+        """
+        incomplete = []
+        limbs = read_scene_limbs(incomplete)
+        if not limbs:
+            return None
+        self.limbs = {limb.name: limb for limb in limbs}
+        self.incomplete_limbs = incomplete
+        return len(self.limbs)
+    
+    # ============ 命名空间实例 ============
+    
+    def instantiate(self, templates=None, namespaces=None):
+        """
+        把模板应用到场景中的每个命名空间（例如多个引用的同一角色）
+        
+        templates 为 None 时使用上次的模板，没有模板时用当前肢体去掉命名空间生成。
+        当前肢体被替换为所有实例，之后的匹配、烘焙、校准一次处理全部实例。
+        
+        Args:
+            templates: LimbData 列表（可以带命名空间，会自动转换为模板）
+            namespaces: 只使用这些命名空间（None 为全部）
+        
+        Returns:
+            dict: {命名空间: [实例肢体名称]}
+        """
+        if templates is None:
+            templates = list(self.templates.values()) or self.get_limbs()
+        self.templates = {}
+        for limb in templates:
+            template = limb.relative()
+            self.templates.setdefault(template.name, template)
+        
+        instances = find_limb_instances(list(self.templates.values()), namespaces)
+        self.limbs = {limb.name: limb for limbs in instances.values() for limb in limbs}
+        return {namespace: [limb.name for limb in limbs] for namespace, limbs in instances.items()}
+    
+    def get_namespace_limbs(self, namespaces):
+        """指定命名空间中的肢体名称（用于 match_all / bake / calibrate 的 names 参数）"""
+        namespaces = set(namespaces)
+        return [name for name, limb in self.limbs.items() if limb.namespace in namespaces]
+    
+    # ============ 单个肢体匹配 ============
+    
+    @profiled_operation('match_ik_to_fk')
+    def match_limb_ik_to_fk(self, limb, use_matrix=True, auto_key=False):
+        """
+        匹配单个肢体的IK到FK
+        
+        核心逻辑：将IK控制器移动到Blend末端的位置
+        """
+        if not limb.blend_joints:
+            return False
+        
+        resolver = get_resolver()
+        if not limb.ik_control or not resolver.exists(limb.ik_control):
+            return False
+        
+        # 参考末端 = Blend骨骼的最后一个
+        ref_end = limb.blend_joints[-1]
+        
+        if not resolver.exists(ref_end):
+            return False
+        
+        target_pos = get_world_position(ref_end)
+
+        # 0. 优先设置极向量 (PV)
+        # 必须先设置PV，因为PV的位置决定了IK链的平面朝向
+        # 如果后设置PV，会导致IK Solver更新骨骼，从而改变末端骨骼的旋转，导致之前的旋转设置失效
+        if limb.pole_vector and resolver.exists(limb.pole_vector) and len(limb.blend_joints) >= 3:
+            pv_pos = calculate_pole_vector_position(
+                get_world_position(limb.blend_joints[0]),
+                get_world_position(limb.blend_joints[1]),
+                get_world_position(limb.blend_joints[-1])
+            )
+            set_world_position(limb.pole_vector, pv_pos)
+        
+        # 混合匹配策略：
+        # 位置：使用简单世界空间匹配（直接复制）
+        # 旋转：使用预校准偏移矩阵匹配（补偿IK控制器和Blend骨骼的朝向差异）
+        
+        # 1. 匹配位置 - 简单世界空间
+        set_world_position(limb.ik_control, target_pos)
+        
+        # 2. 匹配旋转 - 使用四元数偏移补偿IK控制器和Blend骨骼的朝向差异
+        if limb.rotation_offset:
+            match_rotation_with_offset(limb.ik_control, ref_end, limb.rotation_offset)
+        else:
+            # 没有校准数据时回退到直接匹配
+            match_transform_matrix(limb.ik_control, ref_end, translate=False, rotate=True)
+        
+        # 打Key（极向量和IK控制器一次调用）
+        if auto_key:
+            key_controls(self._ik_key_nodes(limb))
+        
+        return True
+    
+    @profiled_operation('match_fk_to_ik')
+    def match_limb_fk_to_ik(self, limb, use_matrix=True, auto_key=False):
+        """
+        匹配单个肢体的FK到IK
+        
+        核心逻辑：将FK控制器旋转匹配到对应的Blend骨骼
+        """
+        if not limb.fk_controls or not limb.blend_joints:
+            return False
+        
+        resolver = get_resolver()
+        
+        # 遍历FK控制器，匹配到对应的Blend骨骼
+        for i, fk_ctrl in enumerate(limb.fk_controls):
+            if not resolver.exists(fk_ctrl):
+                continue
+            if i < len(limb.blend_joints):
+                blend_jnt = limb.blend_joints[i]
+                if resolver.exists(blend_jnt):
+                    if use_matrix:
+                        # 只有第一个FK控制器(根部)需要匹配位移，其他只匹配旋转
+                        match_transform_matrix(fk_ctrl, blend_jnt, translate=(i == 0), rotate=True)
+                    else:
+                        if i == 0:
+                            set_world_position(fk_ctrl, get_world_position(blend_jnt))
+                        set_world_rotation(fk_ctrl, get_world_rotation(blend_jnt))
+        
+        if auto_key:
+            key_controls(self._fk_key_nodes(limb), attribute='rotate')
+        
+        return True
+    
+    def _ik_key_nodes(self, limb):
+        """IK -> FK 匹配后需要打Key的控制器"""
+        resolver = get_resolver()
+        nodes = []
+        if limb.pole_vector and resolver.exists(limb.pole_vector) and len(limb.blend_joints) >= 3:
+            nodes.append(limb.pole_vector)
+        nodes.append(limb.ik_control)
+        return nodes
+    
+    def _fk_key_nodes(self, limb):
+        """FK -> IK 匹配后需要打Key的控制器"""
+        resolver = get_resolver()
+        return [ctrl for ctrl in limb.fk_controls if resolver.exists(ctrl)]
+    
+    # ============ 批量匹配 / 烘焙 ============
+    
+    def match_all(self, direction, names=None, use_matrix=True, auto_key=False, writer=None):
+        """
+        在当前帧匹配多个肢体（单个撤销块）
+        
+        矩阵匹配使用两阶段 MatchPlan；FK -> IK 的简单世界空间匹配逐肢体执行。
+        给出 writer 时总是使用 MatchPlan，所有修改记录在 writer 中而不是撤销块中
+        
+        Returns:
+            MatchPlan 或 None（逐肢体执行时）
+        """
+        limbs = self.get_limbs(names)
+        if writer is not None:
+            plan = MatchPlan(limbs, direction)
+            plan.execute(auto_key, writer)
+            return plan
+        
+        with undo_chunk():
+            if direction == BAKE_IK_TO_FK or use_matrix:
+                plan = MatchPlan(limbs, direction)
+                plan.execute(auto_key)
+                return plan
+            
+            # 简单世界空间匹配依赖逐个写入后的求值结果，保持逐肢体执行
+            keyed = []
+            for limb in limbs:
+                if self.match_limb_fk_to_ik(limb, use_matrix, auto_key=False) and auto_key:
+                    keyed.extend(self._fk_key_nodes(limb))
+            key_controls(keyed, attribute='rotate')
+        return None
+    
+    def match_selection(self, nodes=None, use_matrix=True, auto_key=False, direction=None):
+        """
+        匹配选中控制器所属的肢体（"匹配选择" 热键，见 match_selection 函数）
+        
+        每个肢体的方向由切换属性的当前值决定（见 current_match_direction）；
+        给出 direction 时所有肢体使用该方向。没有切换属性又没有给出方向的肢体跳过
+        
+        Returns:
+            dict: {方向: [肢体名称]}
+        """
+        by_direction = {}
+        for limb in self.limbs_for_nodes(nodes):
+            limb_direction = direction or current_match_direction(limb)
+            if limb_direction:
+                by_direction.setdefault(limb_direction, []).append(limb.name)
+        with undo_chunk():
+            for limb_direction, names in by_direction.items():
+                self.match_all(limb_direction, names, use_matrix, auto_key)
+        return by_direction
+    
+    def table(self, names=None):
+        """当前肢体的 LimbTable 快照（批量计算使用，见 LimbTable）"""
+        return LimbTable(self.get_limbs(names))
+    
+    def iter_match_all(self, direction, names=None, auto_key=False, writer=None):
+        """分组执行的 match_all（生成器，见 iter_match_limbs），所有修改记录在 writer 中"""
+        return iter_match_limbs(self.get_limbs(names), direction, auto_key, writer)
+    
+    @profiled_operation('bake')
+    def bake(self, start, end, direction, names=None, step=1, incremental=False, fast=False):
+        """
+        在帧范围内烘焙匹配结果，参见 bake_limbs
+        
+        fast 为 True 时在 fast_bake 中执行，统计信息中的 'fast_bake' 为 FastBakeReport；
+        之前有普通烘焙时按其每个肢体帧的耗时估算节省的时间（report.baseline_estimated 为 True）
+        """
+        return run_steps(self.iter_bake(start, end, direction, names, step, incremental, fast))
+    
+    def iter_bake(self, start, end, direction, names=None, step=1, incremental=False, fast=False,
+                  writer=None, chunk_size=BAKE_CHUNK_SIZE, fast_report=None):
+        """
+        分块执行的 bake（生成器，见 iter_bake_limbs 和 ChunkedTask），取消时 fast_bake 的设置同样会恢复
+        
+        交给 ChunkedTask 时传入 fast_report（同一个对象也交给 ChunkedTask）：生成器不打开 fast_bake，
+        由 ChunkedTask 只在每个时间片内应用，空闲时场景保持原来的求值模式和自动关键帧等设置。
+        耗时只统计生成器实际执行的时间，不包括时间片之间的空闲
+        """
+        steps = iter_bake_limbs(self.get_limbs(names), start, end, direction, step, incremental, chunk_size, writer)
+        elapsed = 0.0
+        context = fast_bake() if fast and fast_report is None else nullcontext(fast_report)
+        try:
+            with context as report:
+                while True:
+                    time_start = time.perf_counter()
+                    try:
+                        progress = next(steps)
+                    except StopIteration as stop:
+                        stats = stop.value
+                        break
+                    finally:
+                        elapsed += time.perf_counter() - time_start
+                    yield progress
+        finally:
+            steps.close()
+        if stats and stats['rebaked_frames']:
+            normal_rate = self.bake_rates.get(False)
+            self.bake_rates[bool(fast)] = elapsed / stats['rebaked_frames']
+            if fast:
+                if normal_rate is not None:
+                    report.baseline = normal_rate * stats['rebaked_frames']
+                    report.baseline_estimated = True
+                stats['fast_bake'] = report
+        return stats
+    
+    def match_switches(self, names=None, start=None, end=None, fast=False):
+        """在切换属性动画的每个切换点执行匹配，参见 match_switch_points"""
+        with fast_bake() if fast else nullcontext() as report:
+            stats = match_switch_points(self.get_limbs(names), start, end)
+        if stats and fast:
+            stats['fast_bake'] = report
+        return stats
+    
+    def verify(self, direction, start=None, end=None, names=None, step=1,
+               position_tolerance=VERIFY_POSITION_TOLERANCE, rotation_tolerance=VERIFY_ROTATION_TOLERANCE):
+        """校验匹配结果的残差，参见 verify_limbs"""
+        return verify_limbs(self.get_limbs(names), direction, start, end, step, position_tolerance, rotation_tolerance)
+    
+    def iter_verify(self, direction, start=None, end=None, names=None, step=1,
+                    position_tolerance=VERIFY_POSITION_TOLERANCE, rotation_tolerance=VERIFY_ROTATION_TOLERANCE):
+        """分组执行的 verify（生成器，见 iter_verify_limbs）"""
+        return iter_verify_limbs(
+            self.get_limbs(names), direction, start, end, step, position_tolerance, rotation_tolerance)
+    
+    # ============ 校准 ============
+    
+    def calibrate(self, names=None):
+        """
+        校准肢体的旋转偏移
+        
+        在绑定姿势（T-Pose）下执行，记录 IK控制器 和 Blend骨骼 之间的旋转差
+        这个差值会在匹配时应用，确保旋转正确传递
+        
+        NumPy 可用时所有肢体一次采样、一次计算（见 calibrate_limbs），否则逐肢体执行
+        
+        Returns:
+            int: 校准成功的肢体数量
+        """
+        limbs = self.get_limbs(names)
+        if get_kernel() is not None:
+            return calibrate_limbs(limbs)
+        return sum(1 for limb in limbs if self.calibrate_limb(limb))
+    
+    @profiled_operation('calibrate')
+    def calibrate_limb(self, limb):
+        """校准单个肢体，成功时写入 limb.rotation_offset"""
+        resolver = get_resolver()
+        
+        # 检查必要的对象是否存在
+        if not limb.ik_control or not resolver.exists(limb.ik_control):
+            return False
+        
+        if not limb.blend_joints or len(limb.blend_joints) == 0:
+            return False
+        
+        ref_end = limb.blend_joints[-1]
+        if not resolver.exists(ref_end):
+            return False
+        
+        # 提取纯旋转（四元数）- 避免位移干扰，存储四元数的4个分量 [x, y, z, w]
+        ik_matrix = get_world_mmatrix(limb.ik_control)
+        blend_matrix = get_world_mmatrix(ref_end)
+        limb.rotation_offset = rotation_offset_from_matrices(ik_matrix, blend_matrix)
+        # 同时保存静止姿势快照，之后 calibrate_from_bind 不需要再摆姿势
+        limb.rest_matrices = matrix_values(ik_matrix) + matrix_values(blend_matrix)
+        return True
+    
+    @profiled_operation('calibrate')
+    def calibrate_from_bind(self, names=None, poses=None):
+        """
+        按绑定数据校准旋转偏移：不需要把角色放到绑定姿势，不修改当前姿势和撤销队列
+        
+        IK控制器 和 末端Blend骨骼 的绑定世界矩阵依次取自：肢体保存的静止姿势快照（calibrate / capture_rest_pose），
+        dagPose，skinCluster 的 bindPreMatrix（见 read_bind_matrices）。所有肢体的节点一次批量读取
+        
+        IK控制器几乎不在 dagPose / bindPreMatrix 中。没有快照时，完全处于IK模式的肢体（末端Blend骨骼跟随IK）
+        用末端Blend骨骼的绑定矩阵（没有时用当前矩阵）乘以IK控制器相对它的当前偏移作为IK控制器的绑定矩阵；
+        其他肢体需要先保存快照
+        
+        Args:
+            names: 肢体名称（None 为全部）
+            poses: 只使用这些 dagPose 节点（None 为场景中全部）
+        
+        Returns:
+            dict: {'calibrated': {肢体名称: 来源}, 'missing': {肢体名称: [没有绑定数据的节点]}}
+        """
+        limbs = [limb for limb in self.get_limbs(names) if limb.ik_control and limb.blend_joints]
+        nodes = {node for limb in limbs if not limb.rest_matrices for node in (limb.ik_control, limb.blend_joints[-1])}
+        bind = read_bind_matrices(nodes, poses) if nodes else {}
+        
+        result = {'calibrated': {}, 'missing': {}}
+        for limb in limbs:
+            if limb.rest_matrices:
+                ik_matrix = om2.MMatrix(limb.rest_matrices[:16])
+                blend_matrix = om2.MMatrix(limb.rest_matrices[16:])
+                source = BIND_SOURCE_SNAPSHOT
+            elif limb.ik_control not in bind and _bind_ik_offset_usable(limb):
+                ik_matrix, blend_matrix, source = _bind_from_ik_offset(limb, bind.get(limb.blend_joints[-1]))
+            else:
+                missing = [node for node in (limb.ik_control, limb.blend_joints[-1]) if node not in bind]
+                if missing:
+                    result['missing'][limb.name] = missing
+                    continue
+                (ik_matrix, ik_source), (blend_matrix, blend_source) = bind[limb.ik_control], bind[limb.blend_joints[-1]]
+                source = ik_source if ik_source == blend_source else f'{ik_source}+{blend_source}'
+            limb.rotation_offset = rotation_offset_from_matrices(ik_matrix, blend_matrix)
+            result['calibrated'][limb.name] = source
+        return result
     
-    @classmethod
-    def from_dict(cls, data):
-        limb = cls(data.get('name', ''))
-        limb.blend_joints = data.get('blend_joints', [])
-        limb.fk_controls = data.get('fk_controls', [])
-        limb.ik_control = data.get('ik_control')
-        limb.pole_vector = data.get('pole_vector')
-        limb.rotation_offset = data.get('rotation_offset')
-        return limb
+    def capture_rest_pose(self, names=None):
+        """
+        把当前姿势保存为肢体的静止姿势快照（IK控制器和末端Blend骨骼的世界矩阵）
+        
+        绑定师在绑定姿势下执行一次并保存到场景，之后 calibrate_from_bind 直接使用快照
+        
+        Returns:
+            int: 保存了快照的肢体数量
+        """
+        resolver = get_resolver()
+        count = 0
+        for limb in self.get_limbs(names):
+            nodes = (limb.ik_control, limb.blend_joints[-1] if limb.blend_joints else None)
+            if not all(node and resolver.exists(node) for node in nodes):
+                continue
+            limb.rest_matrices = matrix_values(get_world_mmatrix(nodes[0])) + matrix_values(get_world_mmatrix(nodes[1]))
+            count += 1
+        return count
 
 
 # ============================================================================
@@ -433,8 +4930,10 @@ class FKIKMatchUI:
     def __init__(self, language='en'):
         self.language = language
         
-        # 所有肢体列表
-        self.limbs = {}  # {name: LimbData}
+        # 匹配引擎（肢体列表、匹配、烘焙、校准、预设）
+        self.engine = FKIKMatcher()
+        # fkikMatch 命令使用同一个引擎
+        set_command_matcher(self.engine)
         
         # 当前编辑的肢体
         self.current_limb = LimbData()
@@ -446,10 +4945,34 @@ class FKIKMatchUI:
         self.fk_list = None
         self.ik_field = None
         self.pv_field = None
+        self.switch_field = None
+        self.switch_values_field = None
         self.auto_key_cb = None
         self.use_matrix_cb = None
+        self.profile_cb = None
+        self.bake_range_field = None
+        self.bake_selected_cb = None
+        self.bake_incremental_cb = None
+        self.bake_verify_cb = None
+        self.bake_fast_cb = None
+        self.bake_background_cb = None
+        
+        # 上次烘焙的关键帧写入器（用于整批撤销）
+        self.last_bake_writer = None
         
         self.create_ui()
+        
+        # 场景中保存了肢体数据时直接加载
+        self.load_from_scene()
+    
+    @property
+    def limbs(self):
+        """所有肢体 {name: LimbData}（保存在引擎中）"""
+        return self.engine.limbs
+    
+    @limbs.setter
+    def limbs(self, value):
+        self.engine.limbs = value
     
     def get_text(self, key):
         return LANGUAGES[self.language].get(key, key)
@@ -535,6 +5058,20 @@ class FKIKMatchUI:
         self.pv_field = cmds.textField(editable=True)
         cmds.button(label=self.get_text('load_pv'), command=self.load_pole_vector)
         
+        cmds.separator(height=8, style='in')
+        
+        # FK/IK 切换属性
+        cmds.text(label=self.get_text('switch_attr') + ':', align='left')
+        self.switch_field = cmds.textField(editable=True)
+        cmds.button(label=self.get_text('load_switch'), command=self.load_switch_attr)
+        self.switch_values_field = cmds.floatFieldGrp(
+            numberOfFields=2,
+            label=self.get_text('switch_values'),
+            value1=0.0,
+            value2=1.0,
+            columnWidth3=(100, 120, 120)
+        )
+        
         cmds.separator(height=10, style='none')
         
         cmds.rowLayout(numberOfColumns=2, columnWidth2=(180, 180))
@@ -601,6 +5138,8 @@ class FKIKMatchUI:
         cmds.button(label=self.get_text('save_preset'), command=self.save_preset, width=170, backgroundColor=(0.3, 0.5, 0.3))
         cmds.button(label=self.get_text('load_preset'), command=self.load_preset, width=170, backgroundColor=(0.3, 0.3, 0.5))
         cmds.setParent('..')
+        cmds.button(label=self.get_text('auto_load_preset'), command=self.auto_load_preset)
+        cmds.button(label=self.get_text('instantiate_namespaces'), command=self.instantiate_namespaces)
         cmds.setParent('..')
         
         # ============ 匹配操作 ============
@@ -637,6 +5176,11 @@ class FKIKMatchUI:
             command=self.match_selected_fk_to_ik,
             height=35
         )
+        cmds.button(
+            label=self.get_text('match_selection'),
+            command=self.match_viewport_selection,
+            height=35
+        )
         
         cmds.separator(height=10, style='in')
         
@@ -648,6 +5192,58 @@ class FKIKMatchUI:
             height=35,
             backgroundColor=(0.5, 0.5, 0.7)
         )
+        cmds.button(
+            label=self.get_text('calibrate_bind'),
+            annotation=self.get_text('calibrate_bind_tip'),
+            command=self.calibrate_from_bind,
+            height=30
+        )
+        
+        cmds.setParent('..')
+        cmds.setParent('..')
+        
+        # ============ 帧范围烘焙 ============
+        cmds.frameLayout(
+            label=self.get_text('bake'),
+            collapsable=True,
+            collapse=True,
+            marginWidth=10,
+            marginHeight=10
+        )
+        cmds.columnLayout(adjustableColumn=True, rowSpacing=5)
+        
+        start, end = get_frame_range()
+        self.bake_range_field = cmds.intFieldGrp(
+            numberOfFields=2,
+            label=self.get_text('bake_range'),
+            value1=start,
+            value2=end,
+            columnWidth3=(100, 120, 120)
+        )
+        self.bake_selected_cb = cmds.checkBox(label=self.get_text('bake_selected_only'), value=False)
+        self.bake_incremental_cb = cmds.checkBox(label=self.get_text('bake_incremental'), value=False)
+        self.bake_verify_cb = cmds.checkBox(label=self.get_text('bake_verify'), value=True)
+        self.bake_fast_cb = cmds.checkBox(label=self.get_text('bake_fast'), value=True)
+        self.bake_background_cb = cmds.checkBox(label=self.get_text('bake_background'), value=False)
+        cmds.button(
+            label=self.get_text('bake_ik_to_fk'),
+            command=self.bake_ik_to_fk,
+            height=35,
+            backgroundColor=(0.3, 0.6, 0.4)
+        )
+        cmds.button(
+            label=self.get_text('bake_fk_to_ik'),
+            command=self.bake_fk_to_ik,
+            height=35,
+            backgroundColor=(0.6, 0.4, 0.3)
+        )
+        cmds.button(
+            label=self.get_text('match_switches'),
+            command=self.match_switches,
+            height=35,
+            backgroundColor=(0.4, 0.5, 0.6)
+        )
+        cmds.button(label=self.get_text('undo_bake'), command=self.undo_last_bake)
         
         cmds.setParent('..')
         cmds.setParent('..')
@@ -657,6 +5253,7 @@ class FKIKMatchUI:
         cmds.columnLayout(adjustableColumn=True)
         self.auto_key_cb = cmds.checkBox(label=self.get_text('auto_key'), value=False)
         self.use_matrix_cb = cmds.checkBox(label=self.get_text('use_matrix'), value=True)
+        self.profile_cb = cmds.checkBox(label=self.get_text('profile'), value=False)
         cmds.setParent('..')
         cmds.setParent('..')
         
@@ -681,6 +5278,10 @@ class FKIKMatchUI:
         cmds.text(label=self.get_text('contact'), align='center', font='smallObliqueLabelFont')
         cmds.separator(height=5, style='none')
         
+        # 打开/新建场景时重新加载肢体（随窗口一起删除）
+        cmds.scriptJob(event=['SceneOpened', self.load_from_scene], parent=self.window)
+        cmds.scriptJob(event=['NewSceneOpened', self.load_from_scene], parent=self.window)
+        
         cmds.showWindow(self.window)
     
     def switch_language(self, lang):
@@ -722,6 +5323,16 @@ class FKIKMatchUI:
         except RuntimeError as e:
             cmds.warning(f'UI rebuild failed: {e}')
     
+    def load_from_scene(self, *args):
+        """从场景存储节点加载肢体；新建场景或没有存储的肢体时保留当前肢体（例如跨镜头使用的预设）"""
+        count = self.engine.load_from_scene()
+        if count is None:
+            return
+        print(self.get_text('scene_loaded') + str(count))
+        if self.engine.incomplete_limbs:
+            cmds.warning(self.get_text('scene_incomplete') + ', '.join(self.engine.incomplete_limbs))
+        self.update_limb_list_ui()
+    
     def update_limb_list_ui(self):
         """更新肢体列表UI"""
         cmds.textScrollList(self.limb_list_ui, edit=True, removeAll=True)
@@ -733,15 +5344,22 @@ class FKIKMatchUI:
         cmds.textField(self.limb_name_field, edit=True, text=self.current_limb.name)
         
         cmds.textScrollList(self.blend_list, edit=True, removeAll=True)
+        # 从场景加载时缺失的位置为 None（见 read_scene_limbs）
         for jnt in self.current_limb.blend_joints:
-            cmds.textScrollList(self.blend_list, edit=True, append=jnt)
+            cmds.textScrollList(self.blend_list, edit=True, append=jnt or MISSING_NODE_LABEL)
         
         cmds.textScrollList(self.fk_list, edit=True, removeAll=True)
         for ctrl in self.current_limb.fk_controls:
-            cmds.textScrollList(self.fk_list, edit=True, append=ctrl)
+            cmds.textScrollList(self.fk_list, edit=True, append=ctrl or MISSING_NODE_LABEL)
         
         cmds.textField(self.ik_field, edit=True, text=self.current_limb.ik_control or '')
         cmds.textField(self.pv_field, edit=True, text=self.current_limb.pole_vector or '')
+        cmds.textField(self.switch_field, edit=True, text=self.current_limb.switch_attr or '')
+        cmds.floatFieldGrp(
+            self.switch_values_field, edit=True,
+            value1=self.current_limb.switch_fk_value,
+            value2=self.current_limb.switch_ik_value
+        )
     
     # ============ 加载功能 ============
     
@@ -782,6 +5400,16 @@ class FKIKMatchUI:
         self.current_limb.pole_vector = selection[0]
         cmds.textField(self.pv_field, edit=True, text=selection[0])
     
+    def load_switch_attr(self, *args):
+        """加载通道盒中选中的属性为FK/IK切换属性"""
+        selection = cmds.ls(selection=True)
+        attrs = cmds.channelBox('mainChannelBox', query=True, selectedMainAttributes=True)
+        if not selection or not attrs:
+            cmds.warning(self.get_text('no_switch_channel'))
+            return
+        self.current_limb.switch_attr = f'{selection[-1]}.{attrs[0]}'
+        cmds.textField(self.switch_field, edit=True, text=self.current_limb.switch_attr)
+    
     def clear_current(self, *args):
         self.current_limb = LimbData()
         self.update_current_limb_ui()
@@ -799,9 +5427,13 @@ class FKIKMatchUI:
         self.current_limb.name = name
         self.current_limb.ik_control = cmds.textField(self.ik_field, query=True, text=True) or None
         self.current_limb.pole_vector = cmds.textField(self.pv_field, query=True, text=True) or None
+        self.current_limb.switch_attr = cmds.textField(self.switch_field, query=True, text=True).strip() or None
+        self.current_limb.switch_fk_value = cmds.floatFieldGrp(self.switch_values_field, query=True, value1=True)
+        self.current_limb.switch_ik_value = cmds.floatFieldGrp(self.switch_values_field, query=True, value2=True)
         
         # 保存到字典
-        self.limbs[name] = LimbData.from_dict(self.current_limb.to_dict())
+        self.limbs[name] = self.current_limb.copy()
+        self.engine.save_to_scene()
         
         self.update_limb_list_ui()
         print(self.get_text('limb_saved') + name)
@@ -821,7 +5453,7 @@ class FKIKMatchUI:
         
         name = selected[0]
         if name in self.limbs:
-            self.current_limb = LimbData.from_dict(self.limbs[name].to_dict())
+            self.current_limb = self.limbs[name].copy()
             self.update_current_limb_ui()
     
     def remove_selected_limb(self, *args):
@@ -834,6 +5466,7 @@ class FKIKMatchUI:
         name = selected[0]
         if name in self.limbs:
             del self.limbs[name]
+            self.engine.save_to_scene()
             self.update_limb_list_ui()
             print(self.get_text('limb_removed') + name)
     
@@ -845,6 +5478,16 @@ class FKIKMatchUI:
         auto_key = cmds.checkBox(self.auto_key_cb, query=True, value=True)
         return use_matrix, auto_key
     
+    @contextmanager
+    def _profile_if_enabled(self):
+        """勾选了性能分析时，在代码块内开启分析并把报告打印到脚本编辑器"""
+        if not cmds.checkBox(self.profile_cb, query=True, value=True):
+            yield
+            return
+        with profiling() as profiler:
+            yield
+        print(profiler.report().format())
+    
     def save_preset(self, *args):
         if not self.limbs:
             cmds.warning(self.get_text('no_limb_selected'))
@@ -860,11 +5503,8 @@ class FKIKMatchUI:
         if not result:
             return
         
-        file_path = result[0]
-        preset_data = {name: limb.to_dict() for name, limb in self.limbs.items()}
-        
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(preset_data, f, indent=2, ensure_ascii=False)
+        # 已应用到多个命名空间时保存为模板
+        self.engine.save_preset(result[0], template=bool(self.engine.templates))
         
         cmds.inViewMessage(amg=f'<span style="color:#00ff00;">{self.get_text("preset_saved")}</span>', pos='midCenter', fade=True)
     
@@ -879,126 +5519,95 @@ class FKIKMatchUI:
         if not result:
             return
         
-        file_path = result[0]
-        
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                preset_data = json.load(f)
-            
-            self.limbs = {name: LimbData.from_dict(data) for name, data in preset_data.items()}
+            count = self.engine.load_preset(result[0])
+            self.engine.save_to_scene()
             self.update_limb_list_ui()
             
-            cmds.inViewMessage(amg=f'<span style="color:#00ff00;">{self.get_text("preset_loaded")}{len(self.limbs)}</span>', pos='midCenter', fade=True)
+            cmds.inViewMessage(amg=f'<span style="color:#00ff00;">{self.get_text("preset_loaded")}{count}</span>', pos='midCenter', fade=True)
             
         except (json.JSONDecodeError, IOError, KeyError) as e:
             cmds.warning(self.get_text('preset_error') + str(e))
+
+    def auto_load_preset(self, *args):
+        """从预设库中加载与场景节点匹配的预设"""
+        try:
+            match = self.engine.load_matching_preset()
+        except (json.JSONDecodeError, IOError, KeyError) as e:
+            cmds.warning(self.get_text('preset_error') + str(e))
+            return
+
+        if match is None:
+            cmds.warning(self.get_text('preset_no_match'))
+            return
+
+        self.engine.save_to_scene()
+        self.update_limb_list_ui()
+
+        message = self.get_text('preset_matched').format(rig=match.entry['rig'], limbs=len(self.limbs))
+        print(message)
+        cmds.inViewMessage(amg=f'<span style="color:#00ff00;">{message}</span>', pos='midCenter', fade=True)
+
+    def instantiate_namespaces(self, *args):
+        """把当前肢体作为模板应用到场景中所有包含相同节点的命名空间"""
+        if not self.limbs and not self.engine.templates:
+            cmds.warning(self.get_text('no_limb_selected'))
+            return
+        
+        instances = self.engine.instantiate()
+        self.engine.save_to_scene()
+        self.update_limb_list_ui()
+        
+        message = self.get_text('instances_found').format(namespaces=len(instances), limbs=len(self.limbs))
+        print(message)
+        cmds.inViewMessage(amg=f'<span style="color:#00ff00;">{message}</span>', pos='midCenter', fade=True)
     
     # ============ 匹配功能 ============
     
     def match_limb_ik_to_fk(self, limb, use_matrix=True, auto_key=False):
-        """
-        匹配单个肢体的IK到FK
-        
-        核心逻辑：将IK控制器移动到Blend末端的位置
-        """
-        if not limb.blend_joints:
-            return False
-        
-        if not limb.ik_control or not cmds.objExists(limb.ik_control):
-            return False
-        
-        # 参考末端 = Blend骨骼的最后一个
-        ref_end = limb.blend_joints[-1]
-        
-        if not cmds.objExists(ref_end):
-            return False
-        
-        target_pos = get_world_position(ref_end)
-
-        # 0. 优先设置极向量 (PV)
-        # 必须先设置PV，因为PV的位置决定了IK链的平面朝向
-        # 如果后设置PV，会导致IK Solver更新骨骼，从而改变末端骨骼的旋转，导致之前的旋转设置失效
-        if limb.pole_vector and cmds.objExists(limb.pole_vector) and len(limb.blend_joints) >= 3:
-            pv_pos = calculate_pole_vector_position(
-                get_world_position(limb.blend_joints[0]),
-                get_world_position(limb.blend_joints[1]),
-                get_world_position(limb.blend_joints[-1])
-            )
-            set_world_position(limb.pole_vector, pv_pos)
-            
-            if auto_key:
-                cmds.setKeyframe(limb.pole_vector)
-        
-        # 混合匹配策略：
-        # 位置：使用简单世界空间匹配（直接复制）
-        # 旋转：使用预校准偏移矩阵匹配（补偿IK控制器和Blend骨骼的朝向差异）
-        
-        # 1. 匹配位置 - 简单世界空间
-        set_world_position(limb.ik_control, target_pos)
-        
-        # 2. 匹配旋转 - 使用四元数偏移补偿IK控制器和Blend骨骼的朝向差异
-        if limb.rotation_offset:
-            match_rotation_with_offset(limb.ik_control, ref_end, limb.rotation_offset)
-        else:
-            # 没有校准数据时回退到直接匹配
-            match_transform_matrix(limb.ik_control, ref_end, translate=False, rotate=True)
-        
-        # 打Key
-        if auto_key:
-            cmds.setKeyframe(limb.ik_control)
-        
-        return True
+        """匹配单个肢体的IK到FK（委托给引擎）"""
+        return self.engine.match_limb_ik_to_fk(limb, use_matrix, auto_key)
     
     def match_limb_fk_to_ik(self, limb, use_matrix=True, auto_key=False):
-        """
-        匹配单个肢体的FK到IK
-        
-        核心逻辑：将FK控制器旋转匹配到对应的Blend骨骼
-        """
-        if not limb.fk_controls or not limb.blend_joints:
-            return False
+        """匹配单个肢体的FK到IK（委托给引擎）"""
+        return self.engine.match_limb_fk_to_ik(limb, use_matrix, auto_key)
+    
+    def _run_match_all(self, direction):
+        use_matrix, auto_key = self._get_match_settings()
         
-        # 遍历FK控制器，匹配到对应的Blend骨骼
-        for i, fk_ctrl in enumerate(limb.fk_controls):
-            if not cmds.objExists(fk_ctrl):
-                continue
-            if i < len(limb.blend_joints):
-                blend_jnt = limb.blend_joints[i]
-                if cmds.objExists(blend_jnt):
-                    if use_matrix:
-                        # 只有第一个FK控制器(根部)需要匹配位移，其他只匹配旋转
-                        match_transform_matrix(fk_ctrl, blend_jnt, translate=(i == 0), rotate=True)
-                    else:
-                        if i == 0:
-                            set_world_position(fk_ctrl, get_world_position(blend_jnt))
-                        set_world_rotation(fk_ctrl, get_world_rotation(blend_jnt))
+        # 多角色场景按命名空间分组在后台执行
+        if self._background() and len(self.limbs) > MATCH_GROUP_SIZE and (use_matrix or direction == BAKE_IK_TO_FK):
+            writer = AnimCurveWriter()
+            self._start_task(
+                self.engine.iter_match_all(direction, auto_key=auto_key, writer=writer),
+                self.get_text('match_all_ik_to_fk' if direction == BAKE_IK_TO_FK else 'match_all_fk_to_ik'),
+                writer, lambda plans: self._finish_match_all(plans, writer)
+            )
+            return
         
-        if auto_key:
-            for fk_ctrl in limb.fk_controls:
-                if cmds.objExists(fk_ctrl):
-                    cmds.setKeyframe(fk_ctrl, attribute='rotate')
+        with self._profile_if_enabled():
+            if match_command_loaded() and (use_matrix or direction == BAKE_IK_TO_FK):
+                plan = self._run_command(direction=direction, key=auto_key)
+            else:
+                plan = self.engine.match_all(direction, use_matrix=use_matrix, auto_key=auto_key)
+        if plan is not None:
+            print(f'FK/IK match plan: {len(plan.targets)} controls, {plan.format_timings()}')
         
-        return True
+        cmds.inViewMessage(amg=f'<span style="color:#00ff00;">{self.get_text("match_success")}</span>', pos='midCenter', fade=True)
+    
+    def _finish_match_all(self, plans, writer):
+        self._keep_writer(writer)
+        targets = sum(len(plan.targets) for plan in plans)
+        print(f'FK/IK match plan: {targets} controls in {len(plans)} group(s)')
+        cmds.inViewMessage(amg=f'<span style="color:#00ff00;">{self.get_text("match_success")}</span>', pos='midCenter', fade=True)
     
     def match_all_ik_to_fk(self, *args):
-        """匹配所有肢体 IK -> FK"""
-        use_matrix, auto_key = self._get_match_settings()
-        
-        with undo_chunk():
-            for limb in self.limbs.values():
-                self.match_limb_ik_to_fk(limb, use_matrix, auto_key)
-            
-            cmds.inViewMessage(amg=f'<span style="color:#00ff00;">{self.get_text("match_success")}</span>', pos='midCenter', fade=True)
+        """匹配所有肢体 IK -> FK（两阶段：先读取全部，再写入全部）"""
+        self._run_match_all(BAKE_IK_TO_FK)
     
     def match_all_fk_to_ik(self, *args):
-        """匹配所有肢体 FK -> IK"""
-        use_matrix, auto_key = self._get_match_settings()
-        
-        with undo_chunk():
-            for limb in self.limbs.values():
-                self.match_limb_fk_to_ik(limb, use_matrix, auto_key)
-            
-            cmds.inViewMessage(amg=f'<span style="color:#00ff00;">{self.get_text("match_success")}</span>', pos='midCenter', fade=True)
+        """匹配所有肢体 FK -> IK（两阶段：先读取全部，再写入全部）"""
+        self._run_match_all(BAKE_FK_TO_IK)
     
     def calibrate_all_limbs(self, *args):
         """
@@ -1011,36 +5620,9 @@ class FKIKMatchUI:
             cmds.warning(self.get_text('no_limb_selected'))
             return
         
-        calibrated_count = 0
-        
-        for name, limb in self.limbs.items():
-            # 检查必要的对象是否存在
-            if not limb.ik_control or not cmds.objExists(limb.ik_control):
-                continue
-            
-            if not limb.blend_joints or len(limb.blend_joints) == 0:
-                continue
-            
-            ref_end = limb.blend_joints[-1]
-            if not cmds.objExists(ref_end):
-                continue
-            
-            # 提取纯旋转（四元数）- 避免位移干扰
-            ik_transform = om2.MTransformationMatrix(om2.MMatrix(get_world_matrix(limb.ik_control)))
-            blend_transform = om2.MTransformationMatrix(om2.MMatrix(get_world_matrix(ref_end)))
-            
-            ik_quat = ik_transform.rotation(asQuaternion=True)
-            blend_quat = blend_transform.rotation(asQuaternion=True)
-            
-            # 使用四元数计算纯旋转偏移: offset_quat = IK_quat × Blend_quat⁻¹
-            # 这只捕捉旋转差异，不受位移影响
-            blend_quat_inv = blend_quat.inverse()
-            offset_quat = ik_quat * blend_quat_inv
-            
-            # 存储四元数的4个分量 [x, y, z, w]
-            limb.rotation_offset = [offset_quat.x, offset_quat.y, offset_quat.z, offset_quat.w]
-            
-            calibrated_count += 1
+        with self._profile_if_enabled():
+            calibrated_count = self.engine.calibrate()
+        self.engine.save_to_scene()
         
         cmds.inViewMessage(
             amg=f'<span style="color:#aaaaff;">{self.get_text("calibrate_success")}{calibrated_count}</span>',
@@ -1049,6 +5631,29 @@ class FKIKMatchUI:
         )
 
     
+    def calibrate_from_bind(self, *args):
+        """按绑定数据（静止姿势快照 / dagPose / bindPreMatrix）校准，不改变当前姿势"""
+        if not self.limbs:
+            cmds.warning(self.get_text('no_limb_selected'))
+            return
+        
+        with self._profile_if_enabled():
+            result = self.engine.calibrate_from_bind()
+        if result['calibrated']:
+            self.engine.save_to_scene()
+        for name, source in result['calibrated'].items():
+            print(f'FK/IK calibrate: {name} from {source}')
+        for name, nodes in result['missing'].items():
+            print(f'FK/IK calibrate: {name} has no bind data for {", ".join(nodes)}')
+        if result['missing']:
+            cmds.warning(self.get_text('calibrate_bind_missing').format(limbs=len(result['missing'])))
+        
+        cmds.inViewMessage(
+            amg=f'<span style="color:#aaaaff;">{self.get_text("calibrate_success")}{len(result["calibrated"])}</span>',
+            pos='midCenter',
+            fade=True
+        )
+    
     def match_selected_ik_to_fk(self, *args):
         """匹配选中肢体 IK -> FK"""
         selected = cmds.textScrollList(self.limb_list_ui, query=True, selectItem=True)
@@ -1060,7 +5665,7 @@ class FKIKMatchUI:
         if name in self.limbs:
             use_matrix, auto_key = self._get_match_settings()
             
-            with undo_chunk():
+            with undo_chunk(), self._profile_if_enabled():
                 self.match_limb_ik_to_fk(self.limbs[name], use_matrix, auto_key)
                 cmds.inViewMessage(amg=f'<span style="color:#00ff00;">{self.get_text("match_success")}</span>', pos='midCenter', fade=True)
     
@@ -1075,9 +5680,232 @@ class FKIKMatchUI:
         if name in self.limbs:
             use_matrix, auto_key = self._get_match_settings()
             
-            with undo_chunk():
+            with undo_chunk(), self._profile_if_enabled():
                 self.match_limb_fk_to_ik(self.limbs[name], use_matrix, auto_key)
                 cmds.inViewMessage(amg=f'<span style="color:#00ff00;">{self.get_text("match_success")}</span>', pos='midCenter', fade=True)
+    
+    def match_viewport_selection(self, *args):
+        """匹配视图中选中的控制器所属的肢体，方向由切换属性决定（不需要在列表中选择）"""
+        use_matrix, auto_key = self._get_match_settings()
+        with self._profile_if_enabled():
+            matched = self.engine.match_selection(use_matrix=use_matrix, auto_key=auto_key)
+        if not matched:
+            cmds.warning(self.get_text('no_selection_limb'))
+            return
+        cmds.inViewMessage(amg=f'<span style="color:#00ff00;">{self.get_text("match_success")}</span>', pos='midCenter', fade=True)
+    
+    # ============ 烘焙功能 ============
+    
+    def _get_bake_names(self):
+        """获取需要烘焙的肢体名称（全部或列表中选中的肢体）"""
+        if not cmds.checkBox(self.bake_selected_cb, query=True, value=True):
+            return list(self.limbs.keys())
+        
+        selected = cmds.textScrollList(self.limb_list_ui, query=True, selectItem=True) or []
+        return [name for name in selected if name in self.limbs]
+    
+    def _run_bake(self, direction):
+        names = self._get_bake_names()
+        if not names:
+            cmds.warning(self.get_text('no_limb_selected'))
+            return
+        
+        start = cmds.intFieldGrp(self.bake_range_field, query=True, value1=True)
+        end = cmds.intFieldGrp(self.bake_range_field, query=True, value2=True)
+        
+        incremental = cmds.checkBox(self.bake_incremental_cb, query=True, value=True)
+        fast = cmds.checkBox(self.bake_fast_cb, query=True, value=True)
+        
+        if self._background():
+            # 后台分块烘焙：更小的帧块，每块写入后交还控制权；快速烘焙的设置只在时间片内生效
+            writer = AnimCurveWriter()
+            report = FastBakeReport() if fast else None
+            steps = self.engine.iter_bake(
+                min(start, end), max(start, end), direction, names, incremental=incremental, fast=fast,
+                writer=writer, chunk_size=TASK_BAKE_CHUNK_SIZE, fast_report=report
+            )
+            self._start_task(
+                steps, self.get_text('bake_ik_to_fk' if direction == BAKE_IK_TO_FK else 'bake_fk_to_ik'), writer,
+                lambda stats: self._finish_bake(stats, direction, start, end, names, False), fast_report=report
+            )
+            return
+        
+        use_command = match_command_loaded()
+        with self._profile_if_enabled():
+            if use_command:
+                # 命令内部保存烘焙指纹，Ctrl+Z 一步撤销
+                stats = self._run_command(
+                    direction=direction, start=min(start, end), end=max(start, end), limb=names,
+                    incremental=incremental, fast=fast
+                )
+            else:
+                stats = self.engine.bake(
+                    min(start, end), max(start, end), direction, names, incremental=incremental, fast=fast
+                )
+        self._finish_bake(stats, direction, start, end, names, use_command)
+    
+    def _finish_bake(self, stats, direction, start, end, names, use_command):
+        """烘焙完成后：保存指纹、输出统计、按需校验"""
+        if not stats:
+            cmds.warning(self.get_text('bake_nothing'))
+            return
+        
+        if not use_command:
+            # 保存烘焙指纹
+            self.engine.save_to_scene()
+        if not stats['rebaked_frames']:
+            cmds.inViewMessage(amg=f'<span style="color:#aaaaff;">{self.get_text("bake_up_to_date")}</span>', pos='midCenter', fade=True)
+            return
+        
+        if not use_command:
+            self._keep_writer(stats['writer'])
+        print(
+            f'FK/IK bake: {stats["targets"]} controls x {stats["frames"]} frames '
+            f'({stats["skipped_frames"]} limb-frames unchanged), '
+            f'sample {stats["sample_time"]:.3f}s, solve {stats["solve_time"]:.3f}s, write {stats["write_time"]:.3f}s'
+        )
+        if stats.get('fast_bake'):
+            print(stats['fast_bake'].format())
+        cmds.inViewMessage(amg=f'<span style="color:#00ff00;">{self.get_text("bake_success")}{stats["keys"]}</span>', pos='midCenter', fade=True)
+        
+        if cmds.checkBox(self.bake_verify_cb, query=True, value=True):
+            self._verify_bake(direction, min(start, end), max(start, end), names)
+    
+    def _verify_bake(self, direction, start, end, names):
+        """烘焙后校验残差，超出容差时给出警告"""
+        if self._background():
+            self._start_task(
+                self.engine.iter_verify(direction, start, end, names), self.get_text('bake_verify'), None,
+                self._report_verify
+            )
+            return
+        self._report_verify(self.engine.verify(direction, start, end, names))
+    
+    def _report_verify(self, report):
+        if report is None:
+            return
+        print(report.format())
+        failed = report.failed
+        if failed:
+            frames = len({frame for limb_frames in failed.values() for frame in limb_frames})
+            cmds.warning(self.get_text('verify_failed').format(limbs=len(failed), frames=frames))
+        else:
+            print(self.get_text('verify_passed'))
+    
+    def bake_ik_to_fk(self, *args):
+        """烘焙帧范围 IK -> FK"""
+        self._run_bake(BAKE_IK_TO_FK)
+    
+    def bake_fk_to_ik(self, *args):
+        """烘焙帧范围 FK -> IK"""
+        self._run_bake(BAKE_FK_TO_IK)
+    
+    def match_switches(self, *args):
+        """在烘焙范围内的所有FK/IK切换点执行匹配"""
+        names = self._get_bake_names()
+        if not names:
+            cmds.warning(self.get_text('no_limb_selected'))
+            return
+        
+        start = cmds.intFieldGrp(self.bake_range_field, query=True, value1=True)
+        end = cmds.intFieldGrp(self.bake_range_field, query=True, value2=True)
+        
+        fast = cmds.checkBox(self.bake_fast_cb, query=True, value=True)
+        use_command = match_command_loaded()
+        with self._profile_if_enabled():
+            if use_command:
+                stats = self._run_command(
+                    switches=True, start=min(start, end), end=max(start, end), limb=names, fast=fast
+                )
+            else:
+                stats = self.engine.match_switches(names, min(start, end), max(start, end), fast=fast)
+        if not stats:
+            cmds.warning(self.get_text('no_switches'))
+            return
+        
+        self.last_bake_writer = None if use_command else stats['writer']
+        for name, hold_frame, switch_frame, direction in stats['points']:
+            print(f'FK/IK switch: {name} {direction} @ {hold_frame:g} -> {switch_frame:g}')
+        message = self.get_text('switches_matched').format(switches=stats['switches'], keys=stats['keys'])
+        cmds.inViewMessage(amg=f'<span style="color:#00ff00;">{message}</span>', pos='midCenter', fade=True)
+    
+    def _run_command(self, **flags):
+        """
+        通过 fkikMatch 命令执行（整批修改在撤销队列中只占一步）
+        
+        Returns:
+            命令的结果（MatchPlan 或统计信息），与直接调用引擎相同
+        """
+        set_command_matcher(self.engine)
+        getattr(cmds, MATCH_COMMAND)(**flags)
+        return self.engine.last_result
+    
+    def _keep_writer(self, writer):
+        """
+        保留没有经过 fkikMatch 命令写入的 writer（后台任务、未加载插件时的烘焙）
+        
+        加载了插件时通过 fkikMatch -task 放入撤销队列（Ctrl+Z 一步撤销），否则留给“撤销上次烘焙”
+        """
+        if not match_command_loaded():
+            self.last_bake_writer = writer
+            return
+        set_command_matcher(self.engine)
+        self.engine.task_writer = writer
+        getattr(cmds, MATCH_COMMAND)(task=True)
+        self.last_bake_writer = None
+    
+    def _background(self):
+        """长时间操作是否在后台分块执行"""
+        return bool(self.bake_background_cb) and cmds.checkBox(self.bake_background_cb, query=True, value=True)
+    
+    def _start_task(self, steps, title, writer, on_done, fast_report=None):
+        """
+        在后台分块执行 steps（ChunkedTask），取消时询问回滚还是保留已写入 writer 的部分
+        
+        writer 为 None 时操作不修改场景，取消时直接结束；fast_report 不为 None 时每个时间片在 fast_bake 中执行
+        """
+        task = ChunkedTask(
+            steps, title, on_done=on_done,
+            on_cancel=lambda rolled_back: self._task_cancelled(writer, rolled_back),
+            rollback=writer.undo if writer is not None else None,
+            choose_rollback=self._ask_rollback,
+            fast_report=fast_report,
+        )
+        if not task.start():
+            steps.close()
+            cmds.warning(self.get_text('task_busy'))
+        return task
+    
+    def _ask_rollback(self):
+        rollback = self.get_text('task_rollback')
+        keep = self.get_text('task_keep')
+        answer = cmds.confirmDialog(
+            title=self.get_text('task_cancelled'),
+            message=self.get_text('task_cancel_message'),
+            button=[rollback, keep],
+            defaultButton=keep,
+            cancelButton=keep,
+            dismissString=keep
+        )
+        return answer == rollback
+    
+    def _task_cancelled(self, writer, rolled_back):
+        if writer is None:
+            return
+        if rolled_back:
+            message = self.get_text('task_rolled_back')
+        else:
+            self._keep_writer(writer)
+            message = self.get_text('task_kept')
+        cmds.inViewMessage(amg=f'<span style="color:#aaaaff;">{message}</span>', pos='midCenter', fade=True)
+    
+    def undo_last_bake(self, *args):
+        """整批撤销上次烘焙写入的关键帧"""
+        if self.last_bake_writer is None:
+            return
+        self.last_bake_writer.undo()
+        self.last_bake_writer = None
+        cmds.inViewMessage(amg=f'<span style="color:#aaaaff;">{self.get_text("undo_bake_done")}</span>', pos='midCenter', fade=True)
 
 
 # ============================================================================
@@ -1088,5 +5916,21 @@ def show_ui(language='en'):
     return FKIKMatchUI(language=language)
 
 
+def match_selection(use_matrix=True, auto_key=False):
+    """
+    热键入口：匹配视图中选中的控制器所属的肢体，方向由每个肢体切换属性的当前值决定
+    
+    窗口打开时使用窗口中的肢体（反向索引只建立一次），否则从场景存储节点加载。
+    热键命令: import universal_fkik_match; universal_fkik_match.match_selection()
+    
+    Returns:
+        dict: {方向: [肢体名称]}
+    """
+    matched = get_command_matcher().match_selection(use_matrix=use_matrix, auto_key=auto_key)
+    if not matched:
+        cmds.warning('FK/IK match: no limb with a switch attribute found for the selection')
+    return matched
+
+
 if __name__ == '__main__':
     show_ui('en')